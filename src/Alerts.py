@@ -0,0 +1,399 @@
+import argparse
+import email.parser
+import email.policy
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+import Protocol
+from Metrics import REGISTRY
+
+"""
+Envio de alertas de violação de EPI para o Telegram, via a API HTTP do bot.
+
+A captura só chama AlertDispatcher.submit, que coloca o alerta em uma fila limitada e retorna
+imediatamente; se a fila estiver cheia o alerta é descartado. Uma thread própria agrupa os
+alertas por chat e as requisições são feitas por um pequeno pool de threads com uma única
+requests.Session (conexões reaproveitadas). Assim a latência do bot nunca atrasa a captura.
+
+Para cada chat:
+    - os alertas que chegam dentro de `batch_window` segundos vão em uma única mensagem, com a
+      lista das violações e a imagem do alerta mais recente;
+    - é enviada no máximo uma mensagem a cada `min_interval` segundos; os alertas desse
+      intervalo se acumulam para a próxima mensagem;
+    - falhas de rede, 429 e 5xx são repetidas até `retries` vezes, com espera exponencial (ou a
+      indicada em Retry-After).
+
+Endpoints do bot (relativos a `url`):
+    POST /api/bot/telegram/send-text   JSON {"to": chat, "text": texto}
+    POST /api/bot/telegram/send-photo  multipart: campos "to" e "caption", arquivo "photo" (JPEG)
+
+start_stub_server sobe localmente um servidor com os mesmos endpoints que apenas registra as
+mensagens recebidas, para testes sem o bot:
+
+    python Alerts.py stub --port 5000
+    python Alerts.py test --url http://127.0.0.1:5000 --chat 123
+"""
+
+logger = logging.getLogger(__name__)
+
+TEXT_PATH = '/api/bot/telegram/send-text'
+PHOTO_PATH = '/api/bot/telegram/send-photo'
+# Limite de tamanho da legenda de uma foto no Telegram.
+MAX_CAPTION = 1024
+# Linhas de violação listadas em uma mensagem; as demais são resumidas.
+MAX_LINES = 15
+
+SENT = REGISTRY.counter('epi_alerts_sent_total', "Mensagens de alerta entregues ao bot")
+FAILED = REGISTRY.counter('epi_alerts_failed_total', "Mensagens de alerta descartadas após as tentativas")
+DROPPED = REGISTRY.counter('epi_alerts_dropped_total', "Alertas descartados com a fila cheia")
+RETRIES = REGISTRY.counter('epi_alerts_retries_total', "Novas tentativas de envio de alertas")
+SEND_MS = REGISTRY.histogram('epi_alert_send_ms', "Tempo de uma requisição ao bot, em ms")
+
+
+def describe(records):
+    """
+    Descreve as violações de um status (array Protocol.RESULT_DTYPE), uma linha por pessoa.
+
+    Com rastreamento, só as categorias que acabaram de virar violação (events) são listadas.
+    """
+    lines = []
+    for p, record in enumerate(records):
+        if record['events']:
+            missing = [k for k in range(Protocol.N_PPE) if record['events'] >> k & 1]
+        else:
+            missing = np.flatnonzero(record['status'] == Protocol.STATUS_NOT_USING).tolist()
+        if missing:
+            who = f"pessoa {record['track']}" if record['track'] else f"pessoa {p + 1}"
+            lines.append(f"{who} sem {', '.join(Protocol.PPE_NAMES[k] for k in missing)}")
+    return lines
+
+
+class _Alert:
+    def __init__(self, camera, timestamp, lines, image):
+        self.camera = camera
+        self.timestamp = timestamp
+        self.lines = lines
+        self.image = image
+        self.queued = time.monotonic()
+
+
+class _Chat:
+    def __init__(self):
+        self.alerts = []
+        self.next_allowed = 0.0
+        self.sending = False
+
+
+class AlertDispatcher:
+    """
+    Fila de alertas de violação de EPI, agrupados e enviados em segundo plano.
+
+    Atributos:
+        url (str): Endereço base da API do bot (por exemplo, http://localhost:5000).
+        chats (list): Chats que recebem os alertas quando submit não informa outros.
+        min_interval (float): Intervalo mínimo, em segundos, entre duas mensagens para o mesmo chat.
+        batch_window (float): Tempo, em segundos, que o primeiro alerta espera por outros para irem na mesma mensagem.
+        timeout (float): Tempo máximo de cada requisição.
+        retries (int): Novas tentativas após uma falha temporária.
+        backoff (float): Espera antes da primeira nova tentativa; dobra a cada tentativa.
+        max_size (int): Maior lado da imagem enviada, em pixels.
+        sent, failed, dropped (int): Mensagens entregues, mensagens descartadas após as tentativas e alertas descartados com a fila cheia.
+    Métodos:
+        submit(camera, records, image=None, timestamp=None, chats=None, copy=False):
+            Enfileira um alerta com as violações de `records` (array Protocol.RESULT_DTYPE) e a imagem anotada. Não bloqueia.
+            A imagem é reduzida para max_size na própria chamada; copy=True garante uma cópia mesmo quando ela já é pequena.
+        send_text(text, chats=None):
+            Enfileira uma mensagem de texto avulsa (sem agrupamento nem limite de frequência).
+        stop(timeout=10.0):
+            Envia os alertas pendentes e encerra as threads.
+    """
+    def __init__(self, url, chats=None, min_interval=60.0, batch_window=5.0, timeout=5.0, retries=3, backoff=1.0,
+                 max_size=1280, max_queue=256, workers=2, session=None):
+        self.url = url.rstrip('/')
+        self.chats = list(chats or [])
+        self.min_interval = min_interval
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_size = max_size
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._chats = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='alertas')
+        REGISTRY.gauge('epi_alerts_queue', "Alertas aguardando agrupamento", fn=self._queue.qsize)
+        self._thread = threading.Thread(target=self._loop, name='alertas', daemon=True)
+        self._thread.start()
+
+    def submit(self, camera, records, image=None, timestamp=None, chats=None, copy=False):
+        lines = describe(Protocol.as_records(records))
+        if not lines:
+            return False
+        if image is not None:
+            image = self._shrink(image, copy)
+        alert = _Alert(camera, time.time() if timestamp is None else timestamp, lines, image)
+        return self._put(('alert', alert, chats or self.chats))
+
+    def send_text(self, text, chats=None):
+        return self._put(('text', text, chats or self.chats))
+
+    def _put(self, item):
+        if not item[2]:
+            logger.warning("Alerta sem chats de destino configurados")
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            DROPPED.inc()
+            return False
+        return True
+
+    def stop(self, timeout=10.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+    def _loop(self):
+        while True:
+            wait = self._next_due()
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                kind, payload, chats = item
+                for chat in chats:
+                    if kind == 'text':
+                        self._executor.submit(self._post_text, chat, payload)
+                    else:
+                        with self._lock:
+                            self._chats.setdefault(chat, _Chat()).alerts.append(payload)
+            self._flush()
+        self._flush(force=True)
+
+    def _next_due(self):
+        now = time.monotonic()
+        due = None
+        with self._lock:
+            for state in self._chats.values():
+                if state.alerts and not state.sending:
+                    when = max(state.next_allowed, state.alerts[0].queued + self.batch_window)
+                    due = when if due is None else min(due, when)
+        return None if due is None else max(0.0, due - now)
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            ready = []
+            for chat, state in self._chats.items():
+                if not state.alerts or (state.sending and not force):
+                    continue
+                if force or now >= max(state.next_allowed, state.alerts[0].queued + self.batch_window):
+                    ready.append((chat, state.alerts))
+                    state.alerts = []
+                    state.sending = True
+                    state.next_allowed = now + self.min_interval
+        for chat, alerts in ready:
+            try:
+                self._executor.submit(self._send_batch, chat, alerts)
+            except RuntimeError:   # executor já encerrado
+                pass
+
+    def _send_batch(self, chat, alerts):
+        try:
+            cameras = sorted({alert.camera for alert in alerts if alert.camera is not None})
+            title = f"Violação de EPI ({len(alerts)} ocorrência{'s' if len(alerts) > 1 else ''})"
+            if cameras:
+                title += f" - câmera{'s' if len(cameras) > 1 else ''} {', '.join(map(str, cameras))}"
+            lines = [f"{time.strftime('%H:%M:%S', time.localtime(alert.timestamp))}"
+                     f"{'' if alert.camera is None else ' ' + str(alert.camera)}: {line}"
+                     for alert in alerts for line in alert.lines]
+            if len(lines) > MAX_LINES:
+                lines = lines[:MAX_LINES] + [f"... e mais {len(lines) - MAX_LINES}"]
+            text = '\n'.join([title] + lines)
+            image = next((alert.image for alert in reversed(alerts) if alert.image is not None), None)
+            if image is None:
+                self._post_text(chat, text)
+            else:
+                self._post_photo(chat, text[:MAX_CAPTION], self._encode(image))
+        except Exception:
+            logger.exception("Erro ao enviar alertas para o chat %s", chat)
+        finally:
+            with self._lock:
+                state = self._chats[chat]
+                state.sending = False
+                pending = bool(state.alerts)
+            if pending:
+                # _next_due ignora chats com envio em andamento: sem este aviso, alertas que chegaram
+                # durante o envio ficariam na fila até o próximo item.
+                self._wake()
+
+    def _wake(self):
+        try:
+            self._queue.put_nowait(())
+        except queue.Full:   # a fila cheia já acorda o loop
+            pass
+
+    def _shrink(self, image, copy=False):
+        # Reduz já no submit: a cópia guardada na fila é a imagem pequena, não o frame 4K.
+        height, width = image.shape[:2]
+        if self.max_size and max(height, width) > self.max_size:
+            scale = self.max_size / max(height, width)
+            return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        return image.copy() if copy else image
+
+    def _encode(self, image):
+        return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+    def _post_text(self, chat, text):
+        return self._post(chat, TEXT_PATH, json={'to': chat, 'text': text})
+
+    def _post_photo(self, chat, caption, photo):
+        return self._post(chat, PHOTO_PATH, data={'to': chat, 'caption': caption},
+                          files={'photo': ('ocorrencia.jpg', photo, 'image/jpeg')})
+
+    def _post(self, chat, path, **kwargs):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                RETRIES.inc()
+                time.sleep(delay)
+                delay *= 2
+            try:
+                with SEND_MS.time():
+                    response = self.session.post(f'{self.url}{path}', timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                logger.warning("Erro ao enviar alerta para o chat %s (tentativa %d): %s", chat, attempt + 1, e)
+                continue
+            if response.ok:
+                self.sent += 1
+                SENT.inc()
+                logger.info("Alerta enviado para o chat %s", chat)
+                return True
+            if response.status_code != 429 and response.status_code < 500:
+                logger.error("Bot recusou o alerta para o chat %s: %s %s", chat, response.status_code, response.text[:200])
+                break
+            logger.warning("Bot indisponível para o chat %s (tentativa %d): %s", chat, attempt + 1, response.status_code)
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        self.failed += 1
+        FAILED.inc()
+        return False
+
+
+def start_stub_server(port=0, host='127.0.0.1', fail=0, delay=0.0):
+    """
+    Sobe um servidor local com os endpoints do bot que apenas registra as mensagens recebidas.
+
+    Args:
+        fail (int): Quantidade de requisições iniciais respondidas com 503, para exercitar as novas tentativas.
+        delay (float): Atraso, em segundos, antes de cada resposta, para simular um bot lento.
+
+    Retorna:
+        ThreadingHTTPServer: O servidor (server_address traz a porta); `messages` é a lista das mensagens
+            recebidas ({'path', 'to', 'text'/'caption', 'photo_bytes'}). Encerre com shutdown().
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if delay:
+                time.sleep(delay)
+            with server.lock:
+                server.requests += 1
+                failing = server.requests <= fail
+            if failing:
+                self.send_error(503)
+                return
+            if self.path == TEXT_PATH:
+                message = {'path': self.path, **json.loads(body)}
+            elif self.path == PHOTO_PATH:
+                parts = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+                message = {'path': self.path}
+                for part in parts.iter_parts():
+                    name = part.get_param('name', header='content-disposition')
+                    if name == 'photo':
+                        message['photo_bytes'] = len(part.get_payload(decode=True))
+                    else:
+                        message[name] = part.get_payload(decode=True).decode('utf-8')
+            else:
+                self.send_error(404)
+                return
+            with server.lock:
+                server.messages.append(message)
+            logger.info("Stub recebeu %s", {k: v for k, v in message.items()})
+            data = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug("stub %s", format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.messages = []
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name='stub-bot', daemon=True).start()
+    logger.info("Bot de teste em http://%s:%d", host, server.server_address[1])
+    return server
+
+
+def main():
+    from Metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description="Alertas de violação de EPI pelo bot do Telegram")
+    commands = parser.add_subparsers(dest='command', required=True)
+    stub = commands.add_parser('stub', help="Sobe o bot de teste local")
+    stub.add_argument('--host', default='127.0.0.1')
+    stub.add_argument('--port', type=int, default=5000)
+    stub.add_argument('--fail', type=int, default=0, help="Requisições iniciais respondidas com 503")
+    test = commands.add_parser('test', help="Envia uma mensagem de teste")
+    test.add_argument('--url', required=True)
+    test.add_argument('--chat', action='append', required=True)
+    test.add_argument('--text', default='test')
+    args = parser.parse_args()
+    configure_logging('INFO')
+
+    if args.command == 'stub':
+        server = start_stub_server(args.port, args.host, args.fail)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        dispatcher = AlertDispatcher(args.url, args.chat)
+        dispatcher.send_text(args.text)
+        dispatcher.stop()
+        raise SystemExit(0 if dispatcher.sent else 1)
+
+
+if __name__ == "__main__":
+    main()
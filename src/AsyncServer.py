@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import Protocol
+import SharedFrames
+from Metrics import REGISTRY, BYTES_OUT, CONNECTIONS, FRAME_LATENCY_MS, PROTOCOL_ERRORS, RESPONSE_ERRORS
+from Tracker import Tracker
+
+"""
+Servidor asyncio de detecção de EPI.
+
+Substitui o laço accept + uma thread por conexão de server.py: todas as conexões são atendidas
+por um único event loop e o trabalho bloqueante (decodificação e envio à fila de inferência) roda
+em um ThreadPoolExecutor de tamanho fixo.
+
+Limites:
+    max_clients: conexões simultâneas. Conexões acima do limite são fechadas imediatamente.
+    max_pending: frames recebidos e ainda sem resposta, somando todas as conexões. Ao atingir o
+        limite o servidor para de ler os sockets, o que aplica backpressure via TCP aos clientes
+        em vez de acumular frames em memória.
+    max_frame_bytes: tamanho máximo de um frame (e da apresentação, até Protocol.MAX_HELLO_BYTES).
+        Um tamanho anunciado acima do limite fecha a conexão antes de qualquer leitura do payload,
+        para que um cliente não faça o servidor reservar até 4 GB por frame.
+"""
+
+logger = logging.getLogger(__name__)
+
+REJECTED = REGISTRY.counter('epi_server_connections_rejected_total', "Conexões recusadas por max_clients")
+
+
+class AsyncFrameServer:
+    """
+    Servidor asyncio que atende os modos legado e persistente de Protocol.
+
+    Atributos:
+        submit_frame (callable): submit_frame(frame_data, encoding, width, height, detailed, ring) -> concurrent.futures.Future com o status.
+        max_clients (int): Máximo de conexões simultâneas.
+        max_pending (int): Máximo de frames em processamento, somando todas as conexões.
+        executor_workers (int): Threads do executor usado para decodificar e enfileirar frames.
+        max_frame_bytes (int): Tamanho máximo, em bytes, de um frame anunciado pelo cliente.
+        queue_depth (callable): Retorna os frames aguardando inferência, informados nas respostas às conexões que pedem
+            'load'. Se None, a fila é informada como 0 (apenas o tempo de cada frame é útil ao cliente).
+        detach_ring (callable): detach_ring(nome) fecha o segmento de memória compartilhada de uma conexão encerrada.
+            Padrão: SharedFrames.detach (apenas neste processo).
+    Métodos:
+        serve(host, port):
+            Corrotina que escuta em host:port até ser cancelada.
+        run(host, port):
+            Executa serve em um novo event loop (bloqueante).
+    """
+    def __init__(self, submit_frame, max_clients=256, max_pending=64, executor_workers=8, queue_depth=None, detach_ring=None,
+                 max_frame_bytes=Protocol.MAX_FRAME_BYTES):
+        self.submit_frame = submit_frame
+        self.max_frame_bytes = max_frame_bytes
+        self.queue_depth = queue_depth or (lambda: 0)
+        self.detach_ring = detach_ring or SharedFrames.detach
+        self.max_clients = max_clients
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix='decode')
+        self.clients = 0
+        self._pending = None
+        REGISTRY.gauge('epi_server_active_connections', "Conexões abertas", fn=lambda: self.clients)
+
+    def run(self, host='localhost', port=13750):
+        try:
+            asyncio.run(self.serve(host, port))
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def serve(self, host='localhost', port=13750):
+        self._pending = asyncio.Semaphore(self.max_pending)
+        server = await asyncio.start_server(self.handle_client, host, port, backlog=1024)
+        logger.info("Servidor rodando em %s:%d (asyncio)", host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        if self.clients >= self.max_clients:
+            REJECTED.inc()
+            logger.warning("Limite de %d clientes atingido, recusando %s", self.max_clients, addr)
+            writer.close()
+            return
+        self.clients += 1
+        CONNECTIONS.inc()
+        logger.debug("Conexão de %s", addr)
+        try:
+            head = await reader.readexactly(Protocol.LENGTH.size)
+            if head == Protocol.MAGIC:
+                await self.handle_persistent(reader, writer)
+            else:
+                frame_length, = Protocol.LENGTH.unpack(head)
+                Protocol.check_length(frame_length, self.max_frame_bytes)
+                async with self._pending:
+                    frame_data = await reader.readexactly(frame_length)
+                    received = time.perf_counter()
+                    status = await self.infer(frame_data)
+                response = Protocol.encode_results(status)
+                writer.write(Protocol.LENGTH.pack(len(response)) + response)
+                await writer.drain()
+                BYTES_OUT.inc(Protocol.LENGTH.size + len(response))
+                FRAME_LATENCY_MS.observe((time.perf_counter() - received) * 1000)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            PROTOCOL_ERRORS.inc()
+            logger.warning("Conexão de %s encerrada: %s", addr, e)
+        except Exception as e:
+            logger.error("Erro ao processar o cliente: %s", e)
+        finally:
+            self.clients -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def infer(self, frame_data, encoding=Protocol.ENCODING_JPEG, width=0, height=0, detailed=False, ring=None):
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(self.executor, self.submit_frame, frame_data, encoding, width, height, detailed, ring)
+        return await asyncio.wrap_future(future)
+
+    async def handle_persistent(self, reader, writer):
+        length, = Protocol.LENGTH.unpack(await reader.readexactly(Protocol.LENGTH.size))
+        Protocol.check_length(length, Protocol.MAX_HELLO_BYTES)
+        hello = json.loads((await reader.readexactly(length)).decode('utf-8'))
+        reply = Protocol.negotiate(hello)
+        ring = None
+        if reply['ok'] and hello.get('shm'):
+            ring = SharedFrames.attach(hello['shm'])
+            reply['shm'] = ring is not None
+        data = json.dumps(reply).encode('utf-8')
+        writer.write(Protocol.LENGTH.pack(len(data)) + data)
+        await writer.drain()
+        if not reply['ok']:
+            return
+        result_format = reply['result']
+        load = reply['load']
+        tracker = Tracker() if reply['track'] else None
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.info("Conexão persistente da câmera %s%s", hello.get('camera'), " (memória compartilhada)" if ring else "")
+
+        write_lock = asyncio.Lock()
+        tasks = set()
+        previous = None
+        try:
+            while True:
+                header = await reader.readexactly(Protocol.FRAME_HEADER.size)
+                seq, encoding, original_w, original_h, width, height, length = Protocol.FRAME_HEADER.unpack(header)
+                Protocol.check_length(length, self.max_frame_bytes)
+                await self._pending.acquire()
+                try:
+                    frame_data = await reader.readexactly(length)
+                except BaseException:
+                    self._pending.release()
+                    raise
+                scale = None
+                if width and height and original_w and original_h and (width, height) != (original_w, original_h):
+                    scale = (original_w / width, original_h / height)
+                task = asyncio.create_task(self.respond(writer, write_lock, seq, frame_data, encoding, width, height, scale,
+                                                        result_format, tracker, previous, ring, load))
+                if tracker is not None:
+                    previous = task
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if ring is not None:
+                self.detach_ring(ring.name)
+
+    async def respond(self, writer, write_lock, seq, frame_data, encoding, width, height, scale, result_format,
+                      tracker=None, previous=None, ring=None, load=False):
+        received = time.perf_counter()
+        try:
+            try:
+                status = await self.infer(frame_data, encoding, width, height, result_format == 'binary', ring)
+            finally:
+                # O Tracker precisa dos frames na ordem de captura: espera a resposta anterior.
+                if previous is not None:
+                    await asyncio.wait([previous])
+            if tracker is not None:
+                status = tracker.update(status)
+            elif result_format == 'binary':
+                status = Protocol.assoc_to_records(status)
+            if scale is not None:
+                status = Protocol.scale_status(status, *scale)
+            response = Protocol.encode_results(status, result_format)
+        except Exception as e:
+            RESPONSE_ERRORS.inc()
+            logger.warning("Erro ao processar frame %d: %s", seq, e)
+            response = b''
+        finally:
+            self._pending.release()
+        if load:
+            response = Protocol.LOAD_HEADER.pack(self.queue_depth(), (time.perf_counter() - received) * 1000) + response
+
+        async with write_lock:
+            writer.write(Protocol.RESPONSE_HEADER.pack(seq, len(response)) + response)
+            await writer.drain()
+        BYTES_OUT.inc(Protocol.RESPONSE_HEADER.size + len(response))
+        FRAME_LATENCY_MS.observe((time.perf_counter() - received) * 1000)
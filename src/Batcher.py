@@ -0,0 +1,139 @@
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from Metrics import BATCH_SIZE, INFERENCE_ERRORS, INFERENCE_MS, POSTPROCESS_MS
+
+"""
+Agendador de inferência em micro-lotes.
+
+Todos os frames recebidos pelo servidor, de todas as câmeras, entram em uma única fila. Uma
+thread de inferência retira da fila até `max_batch` frames, esperando no máximo `max_wait_ms`
+milissegundos pelo lote completar, executa uma única predição do YOLO (PPE.inner_batch) seguida
+do pós-processamento de cada frame (PPE.parse) e devolve cada resultado ao Future de quem
+enviou o frame.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+
+class InferenceBatcher:
+    """
+    Fila central de inferência com agrupamento em lotes.
+
+    Atributos:
+        model (NN.PPE): Modelo usado para a inferência.
+        max_batch (int): Tamanho máximo de cada lote.
+        max_wait_ms (float): Tempo máximo, em milissegundos, que o primeiro frame de um lote espera pelos demais.
+        report_interval (float): Intervalo, em segundos, entre relatórios de desempenho no log. 0 desativa.
+        window (int): Quantidade de latências recentes consideradas nos percentis.
+    Métodos:
+        submit(frame, detailed=False):
+            Enfileira um frame e retorna um Future com o status de EPI (ou a saída de PPE.associate, se detailed).
+        run(frame):
+            Enfileira um frame e aguarda o resultado.
+        stats():
+            Retorna vazão (frames/s), latências p50/p99 (ms) e tamanho médio dos lotes.
+        stop():
+            Encerra a thread de inferência após processar os frames já enfileirados.
+    """
+    def __init__(self, model, max_batch=8, max_wait_ms=10.0, report_interval=10.0, window=1000):
+        self.model = model
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_ms = max_wait_ms
+        self.report_interval = report_interval
+
+        self.queue = queue.Queue()
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.completed = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, detailed=False):
+        future = Future()
+        self.queue.put((frame, future, time.perf_counter(), detailed))
+        return future
+
+    def run(self, frame):
+        return self.submit(frame).result()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self):
+        item = self.queue.get()
+        if item is None:
+            return None, True
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            frames = [frame for frame, _, _, _ in batch]
+            try:
+                with INFERENCE_MS.time():
+                    responses = self.model.inner_batch(frames)
+                with POSTPROCESS_MS.time():
+                    results = [self.model.parse(resp, detailed) for resp, (_, _, _, detailed) in zip(responses, batch)]
+            except Exception as e:
+                INFERENCE_ERRORS.inc(len(batch))
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            BATCH_SIZE.observe(len(batch))
+
+            now = time.perf_counter()
+            with self._lock:
+                for _, _, submitted, _ in batch:
+                    self.latencies.append(now - submitted)
+                self.batch_sizes.append(len(batch))
+                self.completed += len(batch)
+            for (_, future, _, _), result in zip(batch, results):
+                future.set_result(result)
+
+            if self.report_interval and now - self._last_report >= self.report_interval:
+                self._last_report = now
+                stats = self.stats()
+                logger.info("Inferência: %.1f frames/s, p50 %.1f ms, p99 %.1f ms, lote médio %.1f, fila %d",
+                            stats['fps'], stats['p50_ms'], stats['p99_ms'], stats['mean_batch'], stats['queue'])
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self.latencies, dtype=np.float64) * 1000
+            batch_sizes = list(self.batch_sizes)
+            completed = self.completed
+        elapsed = time.perf_counter() - self.started
+        return {
+            'completed': completed,
+            'fps': completed / elapsed if elapsed > 0 else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+            'p99_ms': float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+            'mean_batch': float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+            'queue': self.queue.qsize(),
+        }
@@ -0,0 +1,532 @@
+import argparse
+import json
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import NN
+import Protocol
+from Overlay import OverlayRenderer
+from Tracker import iou_matrix
+
+"""
+Benchmarks do pipeline de detecção de EPI.
+
+Uso:
+    python Benchmark.py check --people 40 --ppe 200 --repeats 50 --output check.json
+    python Benchmark.py geometry --boxes 200
+    python Benchmark.py draw --people 40 --ppe 200
+    python Benchmark.py server --model model/best.pt --source video.mp4 --max-size 640
+    python Benchmark.py load --cameras 8 --rate 2 --duration 60 --source video.mp4 --max-size 640 --metrics-url http://localhost:9464/metrics
+
+`check`, `geometry` e `draw` são micro-benchmarks do pós-processamento e do desenho. `server`
+mede, no próprio processo, as etapas do servidor (decodificação, inferência e pós-processamento)
+com o modelo real. `load` é um gerador de carga: simula N câmeras que enviam frames de um vídeo
+(ou sintéticos) a um server.py em execução, na taxa pedida, e mede as etapas do cliente
+(codificação, ida e volta, decodificação da resposta, anotação e gravação), a vazão e a latência
+fim a fim. O tempo de cada frame no servidor vem na própria resposta (Protocol.LOAD_HEADER), e a
+rede é a ida e volta menos esse tempo. As etapas do servidor (decodificação, inferência e
+pós-processamento) são a diferença dos histogramas do /metrics do servidor entre o início e o fim
+da execução.
+
+Os resultados são impressos (e opcionalmente gravados) em JSON, para que possam ser
+comparados entre versões.
+"""
+
+
+class SyntheticBoxes:
+    """
+    Conjunto de caixas sintéticas com a mesma interface de ultralytics Boxes (xywh, xyxy, conf, cls),
+    usando arrays NumPy.
+    """
+    def __init__(self, xywh, conf, cls):
+        self.xywh = xywh
+        self.xyxy = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+        self.conf = conf
+        self.cls = cls
+
+
+def synthetic_boxes(n_people=40, n_ppe=200, width=3840, height=2160, seed=0):
+    """
+    Gera um frame sintético com pessoas e EPIs. A maior parte dos EPIs é posicionada dentro de
+    alguma pessoa, o restante em posições aleatórias.
+
+    Retorna:
+        tuple: (boxes, people, ppe) onde people e ppe são os índices de cada grupo em boxes.
+    """
+    rng = np.random.default_rng(seed)
+
+    people_wh = np.stack([rng.uniform(100, 400, n_people), rng.uniform(300, 900, n_people)], axis=1)
+    people_xy = np.stack([rng.uniform(0, width, n_people), rng.uniform(0, height, n_people)], axis=1)
+
+    owner = rng.integers(0, max(n_people, 1), n_ppe)
+    offset = rng.uniform(-0.5, 0.5, (n_ppe, 2)) * (people_wh[owner] if n_people else 0)
+    ppe_xy = (people_xy[owner] if n_people else 0) + offset
+    stray = (rng.random(n_ppe) < 0.1) | (n_people == 0)
+    ppe_xy[stray] = np.stack([rng.uniform(0, width, stray.sum()), rng.uniform(0, height, stray.sum())], axis=1)
+    ppe_wh = rng.uniform(20, 150, (n_ppe, 2))
+
+    xywh = np.concatenate([np.concatenate([people_xy, people_wh], axis=1),
+                           np.concatenate([ppe_xy, ppe_wh], axis=1)]).astype(np.float32)
+    conf = rng.uniform(0.25, 1.0, n_people + n_ppe).astype(np.float32)
+    cls = np.concatenate([np.zeros(n_people), rng.integers(1, 2 * NN.N_PPE + 1, n_ppe)]).astype(np.float32)
+
+    return SyntheticBoxes(xywh, conf, cls), np.arange(n_people), np.arange(n_people, n_people + n_ppe)
+
+
+def measure(fn, repeats, warmup=2):
+    """Executa fn repetidas vezes e retorna os tempos em milissegundos."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summarize(times):
+    times = np.asarray(times)
+    if not times.size:
+        return {'count': 0}
+    return {
+        'count': int(times.size),
+        'mean_ms': float(times.mean()),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'p99_ms': float(np.percentile(times, 99)),
+        'min_ms': float(times.min()),
+        'max_ms': float(times.max()),
+    }
+
+
+def synthetic_frame(width=3840, height=2160, index=0):
+    """Gera um frame sintético com fundo em gradiente e retângulos que se deslocam com `index`."""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (x[None, :] * 0.5 + y[:, None] * 0.5).astype(np.uint8)
+    frame[..., 1] = x[None, :].astype(np.uint8)
+    frame[..., 2] = y[:, None].astype(np.uint8)
+    for k in range(8):
+        cx = int((width * (k + 1) / 9 + index * 7 * (k + 1)) % width)
+        cy = int(height * (0.3 + 0.4 * (k % 2)))
+        cv2.rectangle(frame, (cx, cy), (cx + width // 20, cy + height // 6), (40 * k % 255, 255 - 30 * k, 120), -1)
+    return frame
+
+
+def load_frames(source=None, count=30, width=3840, height=2160):
+    """
+    Carrega até `count` frames de um vídeo (ou gera frames sintéticos se `source` for None).
+    Os frames são carregados antes da medição, para que a leitura do vídeo não entre nos tempos.
+    """
+    if source is None:
+        return [synthetic_frame(width, height, i) for i in range(count)]
+    cap = cv2.VideoCapture(str(source))
+    frames = []
+    try:
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        raise ValueError(f"Não foi possível ler frames de {source}")
+    return frames
+
+
+def bench_check(n_people=40, n_ppe=200, repeats=50, seed=0):
+    """Compara PPE.check_loop (implementação original) com PPE.check (vetorizada)."""
+    ppe = NN.PPE(None)
+    boxes, people, items = synthetic_boxes(n_people, n_ppe, seed=seed)
+
+    same = json.dumps(ppe.check_loop(list(people), list(items), boxes)) == json.dumps(ppe.check(people, items, boxes))
+    loop = summarize(measure(lambda: ppe.check_loop(list(people), list(items), boxes), repeats))
+    vectorized = summarize(measure(lambda: ppe.check(people, items, boxes), repeats))
+
+    return {
+        'benchmark': 'check',
+        'people': n_people,
+        'ppe': n_ppe,
+        'repeats': repeats,
+        'same_output': same,
+        'loop': loop,
+        'vectorized': vectorized,
+        'speedup': loop['mean_ms'] / vectorized['mean_ms'] if vectorized['mean_ms'] else None,
+    }
+
+
+def bench_geometry(n_boxes=200, repeats=20, seed=0):
+    """Compara PPE.Iou e PPE.is_inside, chamados par a par, com as versões vetorizadas (iou_matrix e a máscara de associate)."""
+    ppe = NN.PPE(None)
+    boxes, _, _ = synthetic_boxes(n_boxes // 5, n_boxes - n_boxes // 5, seed=seed)
+    xyxy = boxes.xyxy.astype(np.int64)
+    xywh = boxes.xywh.astype(np.int64)
+    xyxy_list, xywh_list = xyxy.tolist(), xywh.tolist()
+
+    def iou_loop():
+        return [[ppe.Iou(a, b) for b in xyxy_list] for a in xyxy_list]
+
+    def inside_loop():
+        return [[ppe.is_inside(a, b) for b in xywh_list] for a in xywh_list]
+
+    def inside_vectorized():
+        half = xywh[:, 2:] / 2
+        return ((xywh[None, :, :2] > xywh[:, None, :2] - half[:, None]) & (xywh[None, :, :2] < xywh[:, None, :2] + half[:, None])).all(axis=2)
+
+    pairs = n_boxes * n_boxes
+    result = {'benchmark': 'geometry', 'boxes': n_boxes, 'pairs': pairs, 'repeats': repeats}
+    for name, fn in [('iou_loop', iou_loop), ('iou_matrix', lambda: iou_matrix(xyxy, xyxy)),
+                     ('is_inside_loop', inside_loop), ('is_inside_vectorized', inside_vectorized)]:
+        stats = summarize(measure(fn, repeats))
+        stats['ns_per_pair'] = stats['mean_ms'] * 1e6 / pairs
+        result[name] = stats
+    return result
+
+
+def bench_draw(n_people=40, n_ppe=200, repeats=20, width=3840, height=2160, seed=0):
+    """Mede OverlayRenderer.render (usado por RTSPStreamCapture.draw_boxes) e a codificação JPEG da ocorrência."""
+    ppe = NN.PPE(None)
+    boxes, people, items = synthetic_boxes(n_people, n_ppe, width, height, seed=seed)
+    status = ppe.check(people, items, boxes)
+    records = Protocol.as_records(status)
+    frame = synthetic_frame(width, height)
+    renderer = OverlayRenderer()
+    annotated = renderer.render(frame, records)
+    return {
+        'benchmark': 'draw',
+        'people': n_people,
+        'ppe': n_ppe,
+        'violations': int((records['status'] == Protocol.STATUS_NOT_USING).sum()),
+        'size': [width, height],
+        'repeats': repeats,
+        'render_list': summarize(measure(lambda: renderer.render(frame, status), repeats)),
+        'render_records': summarize(measure(lambda: renderer.render(frame, records), repeats)),
+        'occurrence_jpeg': summarize(measure(lambda: cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, 90]), repeats)),
+    }
+
+
+def bench_server(model_path, source=None, frames=30, repeats=3, max_size=640, encoding='jpeg', quality=95, model_options=None):
+    """Mede as etapas do servidor com o modelo real: decodificação do frame, inferência (YOLO) e pós-processamento (PPE.parse)."""
+    ppe = NN.PPE(str(model_path), **(model_options or {}))
+    encoding = Protocol.ENCODINGS[encoding]
+    payloads = [Protocol.encode_frame(frame, encoding, quality, max_size) for frame in load_frames(source, frames)]
+
+    times = {'decode': [], 'inference': [], 'postprocess': [], 'total': []}
+    ppe.run(Protocol.decode_frame(payloads[0][0], encoding, *payloads[0][1]))   # aquecimento
+    for _ in range(repeats):
+        for payload, (width, height) in payloads:
+            t0 = time.perf_counter()
+            frame = Protocol.decode_frame(payload, encoding, width, height)
+            t1 = time.perf_counter()
+            resp = ppe.inner(frame)
+            t2 = time.perf_counter()
+            ppe.parse(resp)
+            t3 = time.perf_counter()
+            times['decode'].append((t1 - t0) * 1000)
+            times['inference'].append((t2 - t1) * 1000)
+            times['postprocess'].append((t3 - t2) * 1000)
+            times['total'].append((t3 - t0) * 1000)
+
+    result = {'benchmark': 'server', 'model': str(model_path), 'options': model_options or {}, 'frames': len(payloads) * repeats,
+              'payload_bytes': int(np.mean([len(p) for p, _ in payloads]))}
+    result.update({stage: summarize(values) for stage, values in times.items()})
+    result['fps'] = 1000 / result['total']['mean_ms'] if result['total']['mean_ms'] else None
+    return result
+
+
+class _LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {'encode': [], 'round_trip': [], 'server': [], 'network': [], 'decode_response': [], 'annotate': [],
+                       'write': [], 'latency': []}
+        self.sent = 0
+        self.completed = 0
+        self.failed = 0
+
+    def add(self, **values):
+        with self.lock:
+            for stage, value in values.items():
+                self.stages[stage].append(value)
+
+
+def simulate_camera(index, frames, stats, host, port, rate, duration, encoding, quality, max_size, max_in_flight,
+                    result_format, write_dir=None, shared_memory=False):
+    """
+    Simula uma câmera: envia `frames` em loop, `rate` frames por segundo, por `duration` segundos, e
+    trata as respostas como RTSPStreamCapture (decodifica, desenha e, se `write_dir`, grava o JPEG).
+    Com `shared_memory`, os frames vão por memória compartilhada e 'encode' mede apenas a redução.
+    'server' é o tempo do frame no servidor informado na resposta e 'network' é round_trip menos 'server'.
+    """
+    renderer = OverlayRenderer()
+    handled = threading.Semaphore(0)
+
+    def on_response(context, response):
+        try:
+            handle(context, response)
+        finally:
+            handled.release()
+
+    def handle(context, response):
+        frame, started, encode_ms, sent_at = context
+        received = time.perf_counter()
+        load = client.load   # LOAD_HEADER desta resposta: válido apenas durante on_response
+        if not response:
+            with stats.lock:
+                stats.failed += 1
+            return
+        records = Protocol.as_records(Protocol.decode_results(response, result_format))
+        decoded = time.perf_counter()
+        annotated = renderer.render(frame, records)
+        annotated_at = time.perf_counter()
+        write_ms = None
+        if write_dir is not None:
+            cv2.imwrite(str(Path(write_dir) / f'{index}.jpg'), annotated, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            write_ms = (time.perf_counter() - annotated_at) * 1000
+        round_trip = (received - sent_at) * 1000
+        values = dict(encode=encode_ms, round_trip=round_trip, decode_response=(decoded - received) * 1000,
+                      annotate=(annotated_at - decoded) * 1000, latency=(time.perf_counter() - started) * 1000)
+        if load is not None:
+            values['server'] = load[1]
+            values['network'] = max(0.0, round_trip - load[1])
+        if write_ms is not None:
+            values['write'] = write_ms
+        stats.add(**values)
+        with stats.lock:
+            stats.completed += 1
+
+    client = Protocol.FrameClient(host, port, on_response, max_in_flight=max_in_flight,
+                                  hello={'camera': f'bench-{index}', 'result': result_format, 'load': True},
+                                  shared_memory=shared_memory)
+    encoding = Protocol.ENCODINGS[encoding]
+    start = time.perf_counter()
+    i = 0
+    submitted = 0
+    try:
+        while True:
+            due = start + i / rate
+            now = time.perf_counter()
+            if due - start >= duration:
+                break
+            if due > now:
+                time.sleep(due - now)
+            frame = frames[i % len(frames)]
+            height, width = frame.shape[:2]
+            started = time.perf_counter()
+            try:
+                seq = None
+                if shared_memory:
+                    resized = Protocol.resize_frame(frame, max_size)
+                    sent_at = time.perf_counter()
+                    seq = client.submit_shared(resized, (frame, started, (sent_at - started) * 1000, sent_at), (width, height))
+                if seq is None:
+                    payload, size = Protocol.encode_frame(frame, encoding, quality, max_size)
+                    sent_at = time.perf_counter()
+                    client.submit(payload, (frame, started, (sent_at - started) * 1000, sent_at), encoding, (width, height), size)
+            except (OSError, ConnectionError) as e:
+                print(f"Câmera {index}: erro ao enviar frame: {e}")
+                with stats.lock:
+                    stats.failed += 1
+            else:
+                submitted += 1
+                with stats.lock:
+                    stats.sent += 1
+            i += 1
+        # Aguarda as respostas pendentes antes de fechar a conexão.
+        deadline = time.perf_counter() + 10.0
+        for _ in range(submitted):
+            if not handled.acquire(timeout=max(0.0, deadline - time.perf_counter())):
+                break
+    finally:
+        client.close()
+
+
+# Histogramas do servidor lidos por bench_load: etapa -> (métrica, medida por frame ou por lote)
+SERVER_STAGES = {
+    'decode': ('epi_server_decode_ms', 'frame'),
+    'inference': ('epi_server_inference_ms', 'batch'),
+    'postprocess': ('epi_server_postprocess_ms', 'batch'),
+    'frame_latency': ('epi_server_frame_latency_ms', 'frame'),
+}
+
+
+def scrape_metrics(url, timeout=5.0):
+    """
+    Lê as somas e contagens dos histogramas do endpoint /metrics (formato texto do Prometheus).
+
+    Retorna:
+        dict: {nome_da_amostra: valor} com as amostras *_sum e *_count sem rótulos, ou None se o endpoint não responder.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            text = response.read().decode('utf-8')
+    except OSError as e:
+        print(f"Não foi possível ler as métricas do servidor em {url}: {e}")
+        return None
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#') or '{' in line:
+            continue
+        name, _, value = line.partition(' ')
+        if name.endswith(('_sum', '_count')):
+            samples[name] = float(value)
+    return samples
+
+
+def server_stages(before, after):
+    """
+    Médias das etapas do servidor entre duas leituras de scrape_metrics.
+
+    Inclui todo o tráfego do servidor no intervalo, não apenas o das câmeras simuladas. Etapas
+    medidas por lote trazem também a média por frame, dividida pelo tamanho médio do lote.
+    """
+    def delta(name):
+        return after.get(name, 0.0) - before.get(name, 0.0)
+
+    batches = delta('epi_server_batch_size_count')
+    frames = delta('epi_server_batch_size_sum')
+    result = {'batches': int(batches), 'mean_batch': frames / batches if batches else None}
+    for stage, (metric, unit) in SERVER_STAGES.items():
+        count, total = delta(f'{metric}_count'), delta(f'{metric}_sum')
+        result[stage] = {'count': int(count), f'mean_ms_per_{unit}': total / count if count else None}
+        if unit == 'batch':
+            result[stage]['mean_ms_per_frame'] = total / frames if frames else None
+    return result
+
+
+def bench_load(host='localhost', port=13750, cameras=4, rate=1.0, duration=30.0, source=None, frames=30, encoding='jpeg',
+               quality=95, max_size=640, max_in_flight=4, result_format='binary', write=False, shared_memory=False,
+               metrics_url=None):
+    """
+    Gerador de carga: `cameras` câmeras simuladas enviando frames a um servidor em execução.
+
+    Com `metrics_url` (o /metrics do server.py), o resultado inclui em 'server_stages' as etapas do servidor no período.
+    """
+    loaded = load_frames(source, frames)
+    stats = _LoadStats()
+    before = scrape_metrics(metrics_url) if metrics_url else None
+    with tempfile.TemporaryDirectory() as tmp:
+        threads = [threading.Thread(target=simulate_camera,
+                                    args=(i, loaded, stats, host, port, rate, duration, encoding, quality, max_size,
+                                          max_in_flight, result_format, tmp if write else None, shared_memory), daemon=True)
+                   for i in range(cameras)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    after = scrape_metrics(metrics_url) if before is not None else None
+
+    result = {
+        'benchmark': 'load',
+        'server': f'{host}:{port}',
+        'cameras': cameras,
+        'rate_per_camera': rate,
+        'target_fps': cameras * rate,
+        'duration_s': elapsed,
+        'source': str(source) if source else 'synthetic',
+        'frame_size': list(loaded[0].shape[1::-1]),
+        'max_size': max_size,
+        'encoding': 'shm' if shared_memory else encoding,
+        'result_format': result_format,
+        'sent': stats.sent,
+        'completed': stats.completed,
+        'failed': stats.failed,
+        'throughput_fps': stats.completed / elapsed if elapsed > 0 else 0.0,
+    }
+    result.update({stage: summarize(values) for stage, values in stats.stages.items()})
+    if after is not None:
+        result['server_stages'] = server_stages(before, after)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks do pipeline de detecção de EPI")
+    parser.add_argument('--output', help="Arquivo JSON onde gravar os resultados")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    check = sub.add_parser('check', help="PPE.check vetorizado x implementação original")
+    check.add_argument('--people', type=int, default=40)
+    check.add_argument('--ppe', type=int, default=200)
+    check.add_argument('--repeats', type=int, default=50)
+    check.add_argument('--seed', type=int, default=0)
+
+    geometry = sub.add_parser('geometry', help="PPE.Iou/PPE.is_inside par a par x versões vetorizadas")
+    geometry.add_argument('--boxes', type=int, default=200)
+    geometry.add_argument('--repeats', type=int, default=20)
+    geometry.add_argument('--seed', type=int, default=0)
+
+    draw = sub.add_parser('draw', help="Desenho das anotações (draw_boxes) e codificação da ocorrência")
+    draw.add_argument('--people', type=int, default=40)
+    draw.add_argument('--ppe', type=int, default=200)
+    draw.add_argument('--repeats', type=int, default=20)
+    draw.add_argument('--seed', type=int, default=0)
+
+    server = sub.add_parser('server', help="Etapas do servidor com o modelo real")
+    server.add_argument('--model', default=str(Path('model') / 'best.pt'))
+    server.add_argument('--backend', choices=list(NN.BACKENDS), default='torch')
+    server.add_argument('--imgsz', type=int, default=640)
+    server.add_argument('--half', action='store_true')
+    server.add_argument('--threads', type=int, default=None)
+    server.add_argument('--roi', action='store_true', help="Inferência em duas etapas (use com --max-size 0 para enviar os frames em resolução plena)")
+    server.add_argument('--roi-imgsz', type=int, default=None)
+    server.add_argument('--repeats', type=int, default=3, help="Passagens sobre os frames carregados")
+
+    load = sub.add_parser('load', help="Gerador de carga contra um server.py em execução")
+    load.add_argument('--host', default='localhost')
+    load.add_argument('--port', type=int, default=13750)
+    load.add_argument('--cameras', type=int, default=4)
+    load.add_argument('--rate', type=float, default=1.0, help="Frames por segundo por câmera")
+    load.add_argument('--duration', type=float, default=30.0, help="Duração em segundos")
+    load.add_argument('--max-in-flight', type=int, default=4)
+    load.add_argument('--result-format', choices=Protocol.RESULT_FORMATS, default='binary')
+    load.add_argument('--write', action='store_true', help="Grava o frame anotado a cada resposta (mede a escrita em disco)")
+    load.add_argument('--shared-memory', action='store_true', help="Envia os frames por memória compartilhada (servidor na mesma máquina)")
+    load.add_argument('--metrics-url', default=None,
+                      help="Endpoint de métricas do servidor (por exemplo, http://localhost:9464/metrics, com o servidor iniciado com --metrics-port 9464) para medir as etapas do servidor")
+
+    for command in (server, load):
+        command.add_argument('--source', default=None, help="Vídeo a reproduzir (padrão: frames sintéticos 4K)")
+        command.add_argument('--frames', type=int, default=30, help="Frames carregados da fonte")
+        command.add_argument('--max-size', type=int, default=640)
+        command.add_argument('--encoding', choices=list(Protocol.ENCODINGS), default='jpeg')
+        command.add_argument('--quality', type=int, default=95)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == 'check':
+        result = bench_check(args.people, args.ppe, args.repeats, args.seed)
+    elif args.command == 'geometry':
+        result = bench_geometry(args.boxes, args.repeats, args.seed)
+    elif args.command == 'draw':
+        result = bench_draw(args.people, args.ppe, args.repeats, seed=args.seed)
+    elif args.command == 'server':
+        result = bench_server(args.model, args.source, args.frames, args.repeats, max_size=args.max_size, encoding=args.encoding,
+                              quality=args.quality, model_options={'backend': args.backend, 'imgsz': args.imgsz,
+                                                                   'half': args.half, 'threads': args.threads,
+                                                                   'roi': args.roi, 'roi_imgsz': args.roi_imgsz})
+    elif args.command == 'load':
+        result = bench_load(args.host, args.port, args.cameras, args.rate, args.duration, args.source, args.frames,
+                            args.encoding, args.quality, args.max_size, args.max_in_flight, args.result_format, args.write, args.shared_memory,
+                            args.metrics_url)
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
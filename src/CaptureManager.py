@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Alerts import AlertDispatcher
+from Motion import MotionGate
+from Occurrences import OccurrenceWriter
+from Sampling import AdaptiveSampler
+from StreamCapture import RTSPStreamCapture
+
+"""
+Gerenciador de várias câmeras.
+
+As câmeras são descritas em um arquivo JSON:
+
+    {
+        "server": {"host": "localhost", "port": 13750},
+        "alerts": {"url": "http://localhost:5000", "chats": ["123456"], "min_interval": 60.0},
+        "defaults": {"capture_interval": 1.0, "max_size": 640, "motion": {"min_changed": 0.005}},
+        "cameras": [
+            {"name": "portaria", "url": "rtsp://10.0.0.10/stream1"},
+            {"name": "galpao", "url": "rtsp://10.0.0.11/stream1", "track": true}
+        ]
+    }
+
+Cada câmera recebe as opções de "defaults" sobrepostas pelas suas próprias, com os mesmos nomes
+dos argumentos de RTSPStreamCapture. "motion" pode ser true (MotionGate padrão), false ou um
+dicionário com os argumentos de MotionGate. Da mesma forma, "sampling" pode ser true ou um
+dicionário com os argumentos de Sampling.AdaptiveSampler, que passa a ajustar o intervalo da
+câmera entre min_interval e max_interval a partir da carga do servidor e da cena, tendo o
+capture_interval da câmera como base_interval.
+
+"alerts", opcional, tem os argumentos de Alerts.AlertDispatcher: as ocorrências de todas as
+câmeras são enviadas ao bot do Telegram por um único AlertDispatcher, que agrupa os alertas por
+chat. "telegran" em uma câmera substitui os chats padrão para ela. Uma mudança em "alerts" troca
+o AlertDispatcher das câmeras em execução, sem reiniciá-las.
+
+Todas as câmeras compartilham um único ThreadPoolExecutor com `workers` threads para a
+codificação e o envio dos frames e um único OccurrenceWriter. Cada câmera mantém apenas a sua
+thread de leitura do stream, que já decodifica o próximo frame enquanto o anterior está sendo
+codificado, enviado ou processado pelo servidor.
+
+O arquivo é relido sempre que é modificado: câmeras novas são iniciadas, câmeras removidas
+são encerradas e câmeras com opções alteradas são reiniciadas, sem reiniciar o processo.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def load_config(path):
+    """Lê o arquivo de configuração e retorna (servidor, {nome: opções da câmera}, alertas ou None)."""
+    with open(path) as f:
+        config = json.load(f)
+    defaults = config.get('defaults', {})
+    cameras = {}
+    for camera in config.get('cameras', []):
+        options = {**defaults, **camera}
+        url = options.pop('url')
+        name = options.pop('name', None) or str(url)
+        if name in cameras:
+            raise ValueError(f"Câmera repetida na configuração: {name}")
+        cameras[name] = {'url': url, **options}
+    return config.get('server', {}), cameras, config.get('alerts')
+
+
+class CaptureManager:
+    """
+    Executa e supervisiona várias RTSPStreamCapture.
+
+    Atributos:
+        config_path (str): Arquivo de configuração. None para adicionar as câmeras apenas por add_camera.
+        host (str), port (int): Servidor usado pelas câmeras, se a configuração não informar outro.
+        workers (int): Threads compartilhadas para codificação e envio dos frames.
+        reload_interval (float): Intervalo, em segundos, entre verificações de mudança no arquivo.
+        occurrences (OccurrenceWriter): Gravador de ocorrências compartilhado pelas câmeras.
+        alerts (AlertDispatcher): Envio de alertas ao Telegram compartilhado pelas câmeras, criado a partir de "alerts" na configuração (None se não houver).
+        cameras (dict): Câmeras em execução, por nome.
+    Métodos:
+        start():
+            Lê a configuração, inicia as câmeras e a verificação do arquivo.
+        stop():
+            Encerra todas as câmeras, o executor, o gravador de ocorrências e o envio de alertas.
+        add_camera(name, url, **options):
+            Inicia uma câmera (substituindo outra com o mesmo nome).
+        remove_camera(name):
+            Encerra e remove uma câmera.
+        reload():
+            Relê o arquivo de configuração e aplica as diferenças.
+        stats():
+            Retorna RTSPStreamCapture.stats() de cada câmera.
+    """
+    def __init__(self, config_path=None, host='localhost', port=13750, workers=4, reload_interval=5.0, occurrences=None):
+        self.config_path = config_path
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.reload_interval = reload_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='envio')
+        self._owns_occurrences = occurrences is None
+        self.occurrences = occurrences if occurrences is not None else OccurrenceWriter()
+        self.alerts = None
+        self._alerts_options = None
+        self.cameras = {}
+        self._options = {}
+        self._mtime = None
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._watcher = None
+
+    def start(self):
+        if self.config_path is not None:
+            self.reload()
+            self._watcher = threading.Thread(target=self._watch, name='config', daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            for name in list(self.cameras):
+                self.remove_camera(name)
+        self.executor.shutdown(wait=True)
+        if self._owns_occurrences:
+            self.occurrences.stop()
+        if self.alerts is not None:
+            self.alerts.stop()
+
+    def add_camera(self, name, url, **options):
+        with self._lock:
+            if name in self.cameras:
+                self.remove_camera(name)
+            capture = RTSPStreamCapture(url, name=name, executor=self.executor, occurrences=self.occurrences,
+                                        alerts=self.alerts, **self._capture_options(options))
+            capture.start()
+            self.cameras[name] = capture
+            self._options[name] = {'url': url, **options}
+            logger.info("Câmera %s iniciada (%s)", name, url)
+            return capture
+
+    def remove_camera(self, name):
+        with self._lock:
+            capture = self.cameras.pop(name, None)
+            self._options.pop(name, None)
+        if capture is not None:
+            capture.stop()
+            logger.info("Câmera %s encerrada", name)
+
+    def reload(self):
+        """Relê a configuração. Em caso de erro no arquivo, as câmeras atuais continuam como estão."""
+        try:
+            self._mtime = os.path.getmtime(self.config_path)
+            server, cameras, alerts = load_config(self.config_path)
+            previous = self.alerts
+            if alerts != self._alerts_options:
+                self.alerts = AlertDispatcher(**alerts) if alerts else None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Erro ao ler a configuração %s: %s", self.config_path, e)
+            return
+        with self._lock:
+            if self.alerts is not previous:   # alertas mudaram: as câmeras em execução passam a usar o novo AlertDispatcher
+                self._alerts_options = alerts
+                for capture in self.cameras.values():
+                    capture.alerts = self.alerts
+            if server.get('host', self.host) != self.host or server.get('port', self.port) != self.port:
+                self.host = server.get('host', self.host)
+                self.port = server.get('port', self.port)
+                for name in list(self.cameras):   # servidor mudou: todas as câmeras reconectam
+                    self._options[name] = None
+            for name in set(self.cameras) - set(cameras):
+                self.remove_camera(name)
+            for name, options in cameras.items():
+                if self._options.get(name) != options:
+                    options = dict(options)
+                    self.add_camera(name, options.pop('url'), **options)
+        if previous is not None and self.alerts is not previous:
+            previous.stop()
+
+    def stats(self):
+        with self._lock:
+            cameras = list(self.cameras.values())
+        return [capture.stats() for capture in cameras]
+
+    def _capture_options(self, options):
+        options = {'host': self.host, 'port': self.port, **options}
+        motion = options.pop('motion', None)
+        if motion is True:
+            options['motion'] = MotionGate()
+        elif isinstance(motion, dict):
+            options['motion'] = MotionGate(**motion)
+        sampling = options.pop('sampling', None)
+        if sampling is True or isinstance(sampling, dict):
+            sampling = sampling if isinstance(sampling, dict) else {}
+            options['sampling'] = AdaptiveSampler(**{'base_interval': options.get('capture_interval', 1.0), **sampling})
+        return options
+
+    def _watch(self):
+        while not self._stopped.wait(self.reload_interval):
+            try:
+                mtime = os.path.getmtime(self.config_path)
+            except OSError:
+                continue
+            if mtime != self._mtime:
+                logger.info("Configuração %s alterada, recarregando", self.config_path)
+                self.reload()
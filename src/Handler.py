@@ -1,13 +1,18 @@
+import argparse
+import logging
 import socket
 import cv2
 import numpy as np
 import threading
 import time
-from StreamCapture import RTSPStreamCapture
+from CaptureManager import CaptureManager
+import Metrics
 from pathlib import Path
 
-def mock_cliente():
-    # Lista de links RTSP
+logger = logging.getLogger('Handler')
+
+def mock_cliente(config=None, workers=4, report_interval=10):
+    # Lista de links RTSP, usada quando nenhum arquivo de configuração é informado
     rtsp_links = [
         # str(Path('./videos_test/8488067-uhd_3840_2160_30fps (1).mp4').resolve()),
         str(Path('./videos_test/6000217_People_Person_3840x2160.mp4').resolve()),
@@ -15,25 +20,47 @@ def mock_cliente():
         # str(Path('./videos_test/8488053-uhd_2160_3840_30fps.mp4').resolve())
     ]
 
-    # Inicializa e inicia as capturas de cada link
-    captures = [RTSPStreamCapture(url) for url in rtsp_links]
-    for capture in captures:
-        capture.start()
+    # Inicializa e inicia as capturas; com um arquivo de configuração, as câmeras podem ser
+    # adicionadas ou removidas editando o arquivo, sem reiniciar o cliente
+    manager = CaptureManager(config, workers=workers)
+    manager.start()
+    if config is None:
+        # Frames sem movimento não são enviados
+        for url in rtsp_links:
+            manager.add_camera(url, url, motion=True)
 
     # Mantém o programa em execução e para as capturas quando interrompido
     try:
         while True:
-            time.sleep(1)  
+            time.sleep(report_interval)
+            for stats in manager.stats():
+                logger.info("Câmera %s: %d frames enviados, %d descartados sem movimento (%d heartbeats), %d descartados com o envio ocupado, %d reconexões, %.1f frames/s decodificados, intervalo %.2f s",
+                            stats['camera'], stats['sent'], stats.get('skipped', 0), stats.get('heartbeats', 0),
+                            stats['busy'], stats['reconnects'], stats['decoded_fps'], stats['interval'])
 
     except KeyboardInterrupt:
-        print("Encerrando capturas...")
-        for capture in captures:
-            capture.stop()
+        logger.info("Encerrando capturas...")
+        manager.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cliente de captura de EPI")
+    parser.add_argument('--config', help="Arquivo JSON com o servidor e as câmeras (ver cameras.example.json)")
+    parser.add_argument('--workers', type=int, default=4, help="Threads compartilhadas para codificação e envio dos frames")
+    parser.add_argument('--metrics-port', type=int, default=9101, help="Porta do endpoint de métricas Prometheus (0 desativa)")
+    parser.add_argument('--metrics-host', default='127.0.0.1', help="Endereço do endpoint de métricas")
+    parser.add_argument('--log-level', default='INFO', help="Nível de log (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument('--log-json', action='store_true', help="Log estruturado, um objeto JSON por linha")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+    Metrics.configure_logging(args.log_level, args.log_json)
+    if args.metrics_port:
+        Metrics.start_http_server(args.metrics_port, args.metrics_host)
     # Inicia o cliente mock
-    mock_cliente() 
+    mock_cliente(args.config, args.workers)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,268 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Métricas e logs do servidor e dos clientes de captura.
+
+Os contadores e histogramas ficam em memória, com os buckets alocados na criação, de modo que
+registrar uma medida no caminho crítico custa apenas uma busca binária e um incremento sob um
+lock. Todas as métricas de um processo ficam em REGISTRY e são expostas no formato texto do
+Prometheus por start_http_server (GET /metrics).
+
+Uso:
+    FRAMES = REGISTRY.counter('epi_frames_received_total', 'Frames recebidos')
+    INFERENCE = REGISTRY.histogram('epi_inference_ms', 'Tempo de inferência por lote (ms)')
+    FRAMES.inc()
+    with INFERENCE.time():
+        ...
+
+Métricas com rótulos (por exemplo, uma série por câmera) são criadas passando os rótulos como
+argumentos nomeados: REGISTRY.counter('epi_client_frames_sent_total', '...', camera='cam1').
+"""
+
+# Buckets padrão dos histogramas de tempo, em milissegundos.
+MS_BUCKETS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Buckets dos histogramas de tamanho (bytes).
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)
+
+
+class Counter:
+    """Contador monotônico."""
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Gauge:
+    """Valor instantâneo, definido com set ou lido de uma função no momento da coleta."""
+    kind = 'gauge'
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                value = float('nan')
+        return [(name, labels, value)]
+
+
+class Histogram:
+    """Histograma com buckets fixos (limites superiores inclusivos, como no Prometheus)."""
+    kind = 'histogram'
+
+    def __init__(self, buckets=MS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager que registra o tempo do bloco, em milissegundos."""
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            samples.append((f'{name}_bucket', {**labels, 'le': _format(bound)}, cumulative))
+        samples.append((f'{name}_bucket', {**labels, 'le': '+Inf'}, count))
+        samples.append((f'{name}_sum', labels, total))
+        samples.append((f'{name}_count', labels, count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class Registry:
+    """
+    Conjunto de métricas de um processo.
+
+    Métodos:
+        counter(name, help, **labels) / gauge(name, help, fn=None, **labels) / histogram(name, help, buckets=MS_BUCKETS, **labels):
+            Retornam a métrica com o nome e os rótulos informados, criando-a na primeira chamada.
+        remove(**labels):
+            Remove, de todas as métricas, as séries que têm os rótulos informados (por exemplo, as de uma câmera encerrada).
+        render():
+            Retorna todas as métricas no formato texto do Prometheus.
+    """
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            kind, _, series = self._families.setdefault(name, (cls.kind, help, {}))
+            if kind != cls.kind:
+                raise ValueError(f"Métrica {name} já registrada como {kind}")
+            if key not in series:
+                series[key] = cls(**kwargs)
+            return series[key]
+
+    def counter(self, name, help, **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, fn=None, **labels):
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help, buckets=MS_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def remove(self, **labels):
+        items = set(labels.items())
+        with self._lock:
+            for name, (_, _, series) in list(self._families.items()):
+                for key in [key for key in series if items <= set(key)]:
+                    del series[key]
+                if not series:
+                    del self._families[name]
+
+    def render(self):
+        with self._lock:
+            families = [(name, kind, help, list(series.items())) for name, (kind, help, series) in self._families.items()]
+        lines = []
+        for name, kind, help, series in families:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, metric in series:
+                for sample, labels, value in metric.samples(name, dict(key)):
+                    lines.append(f'{sample}{_labels(labels)} {_format(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format(value):
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+REGISTRY = Registry()
+
+# Métricas das etapas do servidor, compartilhadas por server.py, AsyncServer.py, Batcher.py e
+# WorkerPool.py para que cada série seja declarada em um único lugar.
+DECODE_MS = REGISTRY.histogram('epi_server_decode_ms', "Tempo de decodificação de um frame, em ms")
+INFERENCE_MS = REGISTRY.histogram('epi_server_inference_ms', "Tempo de inferência (YOLO) por lote, em ms")
+POSTPROCESS_MS = REGISTRY.histogram('epi_server_postprocess_ms', "Tempo de pós-processamento (PPE.parse) por lote, em ms")
+BATCH_SIZE = REGISTRY.histogram('epi_server_batch_size', "Frames por lote de inferência", buckets=(1, 2, 4, 8, 16, 32, 64))
+FRAME_LATENCY_MS = REGISTRY.histogram('epi_server_frame_latency_ms', "Tempo entre a chegada de um frame e o envio da resposta, em ms")
+BYTES_OUT = REGISTRY.counter('epi_server_bytes_out_total', "Bytes de respostas enviadas")
+CONNECTIONS = REGISTRY.counter('epi_server_connections_total', "Conexões aceitas")
+DECODE_ERRORS = REGISTRY.counter('epi_server_errors_total', "Erros no processamento de frames", stage='decode')
+INFERENCE_ERRORS = REGISTRY.counter('epi_server_errors_total', "Erros no processamento de frames", stage='inference')
+RESPONSE_ERRORS = REGISTRY.counter('epi_server_errors_total', "Erros no processamento de frames", stage='response')
+PROTOCOL_ERRORS = REGISTRY.counter('epi_server_errors_total', "Erros no processamento de frames", stage='protocol')
+
+
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    """
+    Expõe as métricas em http://host:port/metrics em uma thread própria.
+
+    Retorna:
+        ThreadingHTTPServer: O servidor, que pode ser encerrado com shutdown().
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.getLogger(__name__).debug("metrics %s", format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.getLogger(__name__).info("Métricas em http://%s:%d/metrics", host, server.server_address[1])
+    return server
+
+
+class JsonFormatter(logging.Formatter):
+    """Formata cada registro de log como um objeto JSON por linha, incluindo os campos passados em `extra`."""
+    _reserved = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self._reserved})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging(level='INFO', json_format=False):
+    """Configura o log do processo: nível (DEBUG, INFO, WARNING, ...) e formato texto ou JSON."""
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
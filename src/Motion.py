@@ -0,0 +1,87 @@
+import time
+
+import cv2
+import numpy as np
+
+"""
+Detecção de movimento no cliente, para não enviar ao servidor frames de uma cena parada.
+
+Cada frame candidato ao envio é reduzido para uma imagem em tons de cinza de `width` pixels de
+largura e comparado com a versão reduzida do último frame enviado. O frame só é enviado se a
+fração de pixels cuja diferença passa de `threshold` for de pelo menos `min_changed`; os demais
+são descartados sem codificação nem inferência. Para que o servidor continue recebendo o estado
+da câmera mesmo sem movimento, um frame é enviado (heartbeat) sempre que a última transmissão
+tiver sido há mais de `max_skip` segundos.
+"""
+
+
+class MotionGate:
+    """
+    Decide quais frames de uma câmera devem ser enviados ao servidor.
+
+    Atributos:
+        threshold (int): Diferença mínima de intensidade (0-255) para um pixel ser considerado alterado.
+        min_changed (float): Fração mínima de pixels alterados para o frame ser enviado.
+        width (int): Largura da imagem reduzida usada na comparação.
+        max_skip (float): Intervalo máximo, em segundos, sem enviar nenhum frame. 0 desativa o heartbeat.
+        sent (int): Frames liberados por movimento (inclui o primeiro frame).
+        heartbeats (int): Frames liberados apenas pelo heartbeat.
+        skipped (int): Frames descartados.
+    Métodos:
+        check(frame, now=None):
+            Retorna True se o frame deve ser enviado.
+        changed_fraction(frame):
+            Fração de pixels alterados em relação ao último frame enviado (1.0 se não houver referência).
+        stats():
+            Retorna os contadores e a fração de frames descartados.
+    """
+    def __init__(self, threshold=25, min_changed=0.005, width=160, max_skip=30.0):
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.width = width
+        self.max_skip = max_skip
+        self.sent = 0
+        self.heartbeats = 0
+        self.skipped = 0
+        self._reference = None
+        self._last_sent = None
+
+    def _small(self, frame):
+        height, width = frame.shape[:2]
+        # Amostra por passo antes do resize para não percorrer o frame inteiro em 4K.
+        step = max(1, width // (2 * self.width))
+        small = frame[::step, ::step]
+        size = (self.width, max(1, round(height * self.width / width)))
+        small = cv2.resize(small, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed_fraction(self, frame, small=None):
+        small = self._small(frame) if small is None else small
+        if self._reference is None or self._reference.shape != small.shape:
+            return 1.0
+        return float(np.count_nonzero(cv2.absdiff(small, self._reference) > self.threshold)) / small.size
+
+    def check(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        small = self._small(frame)
+        if self.changed_fraction(frame, small) >= self.min_changed:
+            self.sent += 1
+        elif self.max_skip and (self._last_sent is None or now - self._last_sent >= self.max_skip):
+            self.heartbeats += 1
+        else:
+            self.skipped += 1
+            return False
+        self._reference = small
+        self._last_sent = now
+        return True
+
+    def stats(self):
+        total = self.sent + self.heartbeats + self.skipped
+        return {
+            'sent': self.sent,
+            'heartbeats': self.heartbeats,
+            'skipped': self.skipped,
+            'skip_ratio': self.skipped / total if total else 0.0,
+        }
@@ -1,11 +1,33 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
 from ultralytics import YOLO
+
+from Protocol import N_PPE, STATUS_UNKNOWN, STATUS_USING, STATUS_NOT_USING, STATUS_VALUES
 """
 Classe PPE para detecção e verificação do uso de Equipamentos de Proteção Individual (EPI) utilizando um modelo YOLO.
 Atributos:
-    model (YOLO): O modelo YOLO utilizado para detecção.
+    model (YOLO): O modelo YOLO utilizado para detecção. None quando a instância só é usada para pós-processamento.
+    backend (str): Backend de inferência: 'torch', 'onnx', 'openvino' ou 'torchscript' (ver BACKENDS).
+    predict_args (dict): Opções repassadas a YOLO.predict (imgsz, half, conf, iou e, se informado, device).
+    roi (bool): Inferência em duas etapas (ver refine): pessoas no frame inteiro em imgsz e EPIs nos recortes das pessoas em alta resolução.
+    roi_args (dict): Opções de YOLO.predict na segunda etapa (as mesmas de predict_args, com imgsz = roi_imgsz).
+    roi_margin (float): Margem acrescentada a cada lado da caixa da pessoa no recorte, em fração da largura/altura.
+    roi_batch (int): Máximo de recortes por predição na segunda etapa.
 Métodos:
-    __init__(self, model):
-        Inicializa a classe PPE com um modelo YOLO fornecido.
+    __init__(self, model, backend='torch', imgsz=640, half=False, int8=False, conf=0.25, iou=0.7, threads=None, device=None,
+             roi=False, roi_imgsz=None, roi_margin=0.15, roi_batch=16):
+        Inicializa a classe PPE com um modelo YOLO fornecido. Com um backend diferente de 'torch' e um modelo .pt,
+        o modelo é exportado uma única vez (ver export_model) e o artefato exportado é usado nas inicializações seguintes.
+        threads define torch.set_num_threads; ONNX Runtime e OpenVINO usam a configuração padrão de threads de cada runtime.
+        roi_imgsz é o tamanho de entrada dos recortes (padrão: imgsz). Os modelos são exportados com eixos dinâmicos, para
+        aceitar lotes de qualquer tamanho; com um backend exportado, a inicialização executa uma predição em lote (ver check_batch).
+    check_batch(self, size=2):
+        Executa uma predição com `size` frames vazios e levanta RuntimeError se o modelo carregado não aceitar lotes
+        (por exemplo, um artefato exportado com lote fixo 1).
     is_inside(self, box1, box2):
         Verifica se o centro da box1 está dentro da box2.
         Args:
@@ -49,14 +71,30 @@ Métodos:
             Boxes: Objeto de caixas detectadas.
         Retorna:
             list: Status de uso de EPI para cada categoria.
-    check(self, people, ppe, Boxes):
-        Associa EPI detectado com pessoas detectadas e verifica conformidade.
+    associate(self, people, ppe, xywh, xyxy, conf, cls):
+        Associa EPIs a pessoas com operações vetorizadas sobre todas as caixas do frame.
+        Para cada pessoa e categoria de EPI escolhe a detecção de "usando" e de "não usando" de maior
+        confiança cujo centro está dentro da caixa da pessoa (mesmo critério de is_inside/get_max/using).
+        Args:
+            people (np.ndarray): Índices das pessoas detectadas.
+            ppe (np.ndarray): Índices dos EPIs detectados.
+            xywh, xyxy, conf, cls (np.ndarray): Caixas, confianças e classes de todas as detecções do frame.
+        Retorna:
+            dict: Arrays 'person_box' (P, 4), 'status' (P, 5) com STATUS_*, 'use_box'/'no_use_box' (P, 5, 4),
+            'use_conf'/'no_use_conf' (P, 5) e 'has_use'/'has_no_use' (P, 5).
+    to_status(self, assoc):
+        Converte a saída de associate na lista [caixa_pessoa, [(status, caixa_usando, caixa_nao_usando) x 5]] de cada pessoa.
+    check(self, people, ppe, Boxes, detailed=False):
+        Associa EPI detectado com pessoas detectadas e verifica conformidade, usando associate.
         Args:
             people (list): Índices das pessoas detectadas.
             ppe (list): Índices dos EPIs detectados.
             Boxes: Objeto de caixas detectadas.
+            detailed (bool): Se True, retorna a saída de associate em vez da lista de status.
         Retorna:
             list: Lista de status para cada pessoa, incluindo caixa delimitadora e status dos EPIs.
+    check_loop(self, people, ppe, Boxes):
+        Implementação original de check, pessoa a pessoa e EPI a EPI. Mantida como referência para comparação e benchmark.
     all_safe(status):
         Verifica se todas as pessoas detectadas estão em conformidade com os EPIs.
         Args:
@@ -69,17 +107,181 @@ Métodos:
             frame: Imagem/frame de entrada.
         Retorna:
             Resultado da predição do YOLO.
-    run(self, frame):
+    inner_batch(self, frames):
+        Executa a predição do modelo YOLO em vários frames de uma só vez. Com roi, executa também a segunda etapa (refine).
+        Args:
+            frames (list): Lista de imagens/frames de entrada.
+        Retorna:
+            list: Resultados da predição do YOLO (ou Detections, com roi), um por frame.
+    refine(self, frames, responses):
+        Segunda etapa da inferência com roi. Recorta do frame original (em resolução plena) a região de cada pessoa
+        detectada na primeira etapa, com margem (ver roi_regions), executa a detecção em todos os recortes dos frames
+        em lotes de até roi_batch e converte as caixas dos EPIs para as coordenadas do frame. As pessoas continuam
+        sendo as da primeira etapa; os EPIs da primeira etapa só são mantidos fora das regiões recortadas.
+        Itens pequenos (óculos, luvas) ocupam muito mais pixels na entrada do modelo do que no frame inteiro reduzido,
+        com um custo proporcional ao número de pessoas e não à resolução da câmera.
+        Args:
+            frames (list): Frames em resolução plena.
+            responses (list): Resultados da primeira etapa, um por frame.
+        Retorna:
+            list: Detections de cada frame, aceito por parse.
+    parse(self, resp, detailed=False):
+        Separa pessoas e EPIs de um resultado do YOLO e verifica a conformidade.
+        Args:
+            resp: Resultado da predição do YOLO para um frame.
+            detailed (bool): Se True, retorna a saída de associate (com as confianças), usada pelo Tracker.
+        Retorna:
+            list: Status de conformidade de EPI para cada pessoa detectada.
+    run(self, frame, detailed=False):
         Executa todo o pipeline de detecção de EPI e verificação de conformidade em um frame.
         Args:
             frame: Imagem/frame de entrada.
+            detailed (bool): Ver parse.
         Retorna:
             list: Status de conformidade de EPI para cada pessoa detectada.
+    run_batch(self, frames, detailed=False):
+        Executa o pipeline completo em um lote de frames com uma única predição do YOLO.
+        Args:
+            frames (list): Lista de imagens/frames de entrada.
+            detailed (bool | list): Ver parse. Uma lista indica o valor de cada frame.
+        Retorna:
+            list: Status de conformidade de EPI de cada frame, na mesma ordem da entrada.
 """
 
+# A categoria de EPI k (ver Protocol.PPE_NAMES) corresponde às classes 2k+1 (usando) e
+# 2k+2 (não usando); a classe 0 é pessoa.
+
+
+logger = logging.getLogger(__name__)
+
+# Backends aceitos por PPE e o formato correspondente de YOLO.export (None: o próprio .pt).
+BACKENDS = {'torch': None, 'onnx': 'onnx', 'openvino': 'openvino', 'torchscript': 'torchscript'}
+
+
+def export_path(model, backend, imgsz=640, half=False, int8=False, dynamic=True):
+    """
+    Retorna o caminho do artefato exportado de `model` para `backend` com as opções informadas.
+
+    Os artefatos ficam em <diretório do modelo>/exports/<nome>-<backend>-<imgsz>[-half][-int8][-dynamic]/.
+    """
+    model = Path(model)
+    options = (f"{model.stem}-{backend}-{imgsz}" + ('-half' if half else '') + ('-int8' if int8 else '') +
+               ('-dynamic' if dynamic else ''))
+    names = {'onnx': f'{model.stem}.onnx', 'openvino': f'{model.stem}_openvino_model', 'torchscript': f'{model.stem}.torchscript'}
+    return model.parent / 'exports' / options / names[backend]
+
+
+def export_model(model, backend, imgsz=640, half=False, int8=False, dynamic=True):
+    """
+    Exporta um modelo .pt para `backend`, reaproveitando um artefato já exportado.
+
+    Com dynamic, o artefato é exportado com eixos dinâmicos e aceita lotes de qualquer tamanho (InferenceBatcher,
+    WorkerPool, recortes de roi, Offline); sem ele, o grafo exportado só aceita lotes de 1 frame.
+    O artefato é refeito apenas se não existir ou se o .pt for mais recente que ele. Deve ser
+    chamado uma vez antes de iniciar vários processos com o mesmo modelo, para que eles não
+    exportem ao mesmo tempo.
+
+    Retorna:
+        str: Caminho do modelo a carregar (o próprio .pt para o backend 'torch').
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconhecido: {backend} (use {', '.join(BACKENDS)})")
+    if BACKENDS[backend] is None:
+        return str(model)
+    if int8 and backend != 'openvino':
+        raise ValueError("int8 só é suportado pelo backend 'openvino'")
+
+    target = export_path(model, backend, imgsz, half, int8, dynamic)
+    if target.exists() and target.stat().st_mtime >= os.path.getmtime(model):
+        return str(target)
+
+    logger.info("Exportando %s para %s (imgsz %d%s%s%s)...", model, backend, imgsz, ', half' if half else '', ', int8' if int8 else '',
+                ', dinâmico' if dynamic else '')
+    exported = Path(YOLO(str(model)).export(format=BACKENDS[backend], imgsz=imgsz, half=half, int8=int8, dynamic=dynamic))
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        shutil.rmtree(target) if target.is_dir() else target.unlink()
+    shutil.move(str(exported), str(target))
+    return str(target)
+
+
+def to_numpy(values):
+    """Converte um tensor (ou lista) em np.ndarray, copiando para a CPU se necessário."""
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def roi_regions(boxes, shape, margin=0.15, min_size=32):
+    """
+    Calcula as regiões de recorte em torno de caixas de pessoas.
+
+    Args:
+        boxes (np.ndarray): Caixas (N, 4) no formato x1, y1, x2, y2.
+        shape (tuple): Formato do frame (altura, largura, ...).
+        margin (float): Margem em cada lado, em fração da largura/altura da caixa.
+        min_size (int): Lado mínimo da região, em pixels.
+
+    Retorna:
+        np.ndarray: Regiões (M, 4) inteiras x1, y1, x2, y2, limitadas ao frame; regiões vazias são descartadas.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    height, width = shape[:2]
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    pad_x = np.maximum(w * margin, (min_size - w) / 2)
+    pad_y = np.maximum(h * margin, (min_size - h) / 2)
+    regions = np.stack([
+        np.clip(np.floor(boxes[:, 0] - pad_x), 0, width),
+        np.clip(np.floor(boxes[:, 1] - pad_y), 0, height),
+        np.clip(np.ceil(boxes[:, 2] + pad_x), 0, width),
+        np.clip(np.ceil(boxes[:, 3] + pad_y), 0, height),
+    ], axis=1).astype(np.int64)
+    return regions[(regions[:, 2] > regions[:, 0]) & (regions[:, 3] > regions[:, 1])]
+
+
+class Detections:
+    """Detecções de um frame como np.ndarray, com a mesma interface de resp.boxes do YOLO (xyxy, xywh, conf, cls)."""
+    def __init__(self, xyxy, xywh, conf, cls):
+        self.xyxy = xyxy
+        self.xywh = xywh
+        self.conf = conf
+        self.cls = cls
+        self.boxes = self
+
+
 class PPE():
-    def __init__(self,model):
-        self.model = YOLO(model)
+    def __init__(self,model,backend='torch',imgsz=640,half=False,int8=False,conf=0.25,iou=0.7,threads=None,device=None,
+                 roi=False,roi_imgsz=None,roi_margin=0.15,roi_batch=16):
+        self.backend = backend
+        self.predict_args = {'imgsz': imgsz, 'half': half, 'conf': conf, 'iou': iou}
+        if device is not None:
+            self.predict_args['device'] = device
+        self.roi = roi
+        self.roi_args = {**self.predict_args, 'imgsz': roi_imgsz or imgsz}
+        self.roi_margin = roi_margin
+        self.roi_batch = max(1, int(roi_batch))
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = None
+        if model is not None:
+            if Path(model).suffix == '.pt':
+                model = export_model(model, backend, imgsz, half, int8)
+            self.model = YOLO(model, task='detect')
+            if backend != 'torch':
+                self.check_batch()
+
+    def check_batch(self, size=2):
+        imgsz = self.predict_args['imgsz']
+        frames = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(size)]
+        try:
+            responses = self.model.predict(frames, verbose=False, **self.predict_args)
+        except Exception as e:
+            raise RuntimeError(f"O modelo exportado ({self.backend}) não aceita lotes de "
+                               f"{size} frames; exporte-o novamente com eixos dinâmicos (ver export_model)") from e
+        if len(responses) != size:
+            raise RuntimeError(f"O modelo ({self.backend}) retornou {len(responses)} resultados para um lote de {size} frames")
 
 
     def is_inside(self, box1, box2):
@@ -124,7 +326,7 @@ class PPE():
 
         for i in objs[1:]:
             if Boxes.conf[i] > Boxes.conf[maxi]:
-                maxi = objs[i]
+                maxi = i
         return float(Boxes.conf[maxi]),list(map(int,(Boxes.xyxy[maxi])))
     
     def using(self,use,no_use,Boxes):
@@ -179,8 +381,81 @@ class PPE():
             
             
 
-    def check(self, people, ppe, Boxes):
-        personal_ppe = []
+    def associate(self, people, ppe, xywh, xyxy, conf, cls):
+        people = np.asarray(people, dtype=np.intp)
+        ppe = np.asarray(ppe, dtype=np.intp)
+        n_people = len(people)
+
+        # Mesmos arredondamentos de check_loop: caixas truncadas para inteiros.
+        person_xywh = xywh[people].astype(np.int64)
+        person_box = xyxy[people].astype(np.int64)
+        ppe_xywh = xywh[ppe].astype(np.int64)
+        ppe_box = xyxy[ppe].astype(np.int64)
+        ppe_conf = conf[ppe].astype(np.float32)
+        ppe_cls = cls[ppe].astype(np.int64)
+
+        # (P, E): centro do EPI dentro da caixa da pessoa
+        half_w = person_xywh[:, 2:3] / 2
+        half_h = person_xywh[:, 3:4] / 2
+        px, py = person_xywh[:, 0:1], person_xywh[:, 1:2]
+        ex, ey = ppe_xywh[None, :, 0], ppe_xywh[None, :, 1]
+        inside = (px - half_w < ex) & (ex < px + half_w) & (py - half_h < ey) & (ey < py + half_h)
+
+        # (P, 2*N_PPE, E): EPI dentro da pessoa e da classe 1..10
+        classes = np.arange(1, 2 * N_PPE + 1)
+        mask = inside[:, None, :] & (ppe_cls[None, None, :] == classes[None, :, None])
+        found = mask.any(axis=2)
+        if len(ppe):
+            masked_conf = np.where(mask, ppe_conf[None, None, :], -np.inf)
+            best = masked_conf.argmax(axis=2)
+            best_conf = np.take_along_axis(masked_conf, best[:, :, None], axis=2)[:, :, 0]
+            best_box = ppe_box[best]
+        else:
+            best_conf = np.full((n_people, 2 * N_PPE), -np.inf)
+            best_box = np.zeros((n_people, 2 * N_PPE, 4), dtype=np.int64)
+
+        has_use, has_no_use = found[:, 0::2], found[:, 1::2]
+        use_conf, no_use_conf = best_conf[:, 0::2], best_conf[:, 1::2]
+
+        status = np.full((n_people, N_PPE), STATUS_UNKNOWN, dtype=np.int8)
+        status[has_use] = STATUS_USING
+        status[has_no_use & ~has_use] = STATUS_NOT_USING
+        status[has_use & has_no_use & (no_use_conf > use_conf)] = STATUS_NOT_USING
+
+        return {
+            'person_box': person_box,
+            'status': status,
+            'use_box': best_box[:, 0::2],
+            'no_use_box': best_box[:, 1::2],
+            'use_conf': use_conf,
+            'no_use_conf': no_use_conf,
+            'has_use': has_use,
+            'has_no_use': has_no_use,
+        }
+
+    def to_status(self, assoc):
+        status = []
+        person_box = assoc['person_box'].tolist()
+        codes = assoc['status'].tolist()
+        use_box = assoc['use_box'].tolist()
+        no_use_box = assoc['no_use_box'].tolist()
+        has_use = assoc['has_use'].tolist()
+        has_no_use = assoc['has_no_use'].tolist()
+        for p in range(len(person_box)):
+            status.append([person_box[p], [
+                (STATUS_VALUES[codes[p][k]],
+                 use_box[p][k] if has_use[p][k] else 0,
+                 no_use_box[p][k] if has_no_use[p][k] else 0)
+                for k in range(N_PPE)
+            ]])
+        return status
+
+    def check(self, people, ppe, Boxes, detailed=False):
+        assoc = self.associate(people, ppe, to_numpy(Boxes.xywh), to_numpy(Boxes.xyxy),
+                               to_numpy(Boxes.conf), to_numpy(Boxes.cls))
+        return assoc if detailed else self.to_status(assoc)
+
+    def check_loop(self, people, ppe, Boxes):
         status = []
 
         for p in people:
@@ -189,8 +464,6 @@ class PPE():
             for e in ppe:
                 ppe_bbox = list(map(int,Boxes.xywh[e]))
 
-                iou = self.Iou(ppe_bbox, person_bbox)
-
                 if self.is_inside(ppe_bbox, person_bbox):
                     _ppe.append(e)
             status.append([list(map(int,Boxes.xyxy[p])),self.check_ppe(_ppe, Boxes)])
@@ -204,23 +477,61 @@ class PPE():
         return True
 
     def inner(self, frame):
-        resp = self.model.predict(frame,verbose=False)[0]
+        if self.roi:
+            return self.inner_batch([frame])[0]
+        resp = self.model.predict(frame,verbose=False,**self.predict_args)[0]
         return resp
 
-    def run(self, frame):
-        resp = self.inner(frame)
-        people = []
-        ppe = []
+    def inner_batch(self, frames):
+        responses = self.model.predict(frames, verbose=False, **self.predict_args)
+        if self.roi:
+            return self.refine(frames, responses)
+        return responses
 
-        for i,r in enumerate(resp.boxes.cls):
-            if int(r) == 0:
-                people.append(i)
-            else:
-                ppe.append(i)
-        
-        status = self.check(people,ppe,resp.boxes)
+    def refine(self, frames, responses):
+        detections = []
+        crops, owners = [], []
+        for i, (frame, resp) in enumerate(zip(frames, responses)):
+            xyxy, xywh = to_numpy(resp.boxes.xyxy), to_numpy(resp.boxes.xywh)
+            conf, cls = to_numpy(resp.boxes.conf), to_numpy(resp.boxes.cls).astype(np.int64)
+            regions = roi_regions(xyxy[cls == 0], frame.shape, self.roi_margin)
+            cx, cy = xywh[:, 0:1], xywh[:, 1:2]
+            covered = ((regions[None, :, 0] <= cx) & (cx < regions[None, :, 2]) &
+                       (regions[None, :, 1] <= cy) & (cy < regions[None, :, 3])).any(axis=1)
+            keep = (cls == 0) | ~covered
+            detections.append([(xyxy[keep], xywh[keep], conf[keep], cls[keep])])
+            for x1, y1, x2, y2 in regions.tolist():
+                crops.append(frame[y1:y2, x1:x2])
+                owners.append((i, x1, y1))
+
+        for start in range(0, len(crops), self.roi_batch):
+            batch = crops[start:start + self.roi_batch]
+            for (i, x, y), resp in zip(owners[start:start + self.roi_batch], self.model.predict(batch, verbose=False, **self.roi_args)):
+                cls = to_numpy(resp.boxes.cls).astype(np.int64)
+                ppe = cls != 0
+                detections[i].append((to_numpy(resp.boxes.xyxy)[ppe] + np.array([x, y, x, y], dtype=np.float32),
+                                      to_numpy(resp.boxes.xywh)[ppe] + np.array([x, y, 0, 0], dtype=np.float32),
+                                      to_numpy(resp.boxes.conf)[ppe], cls[ppe]))
+        return [Detections(*(np.concatenate(column) for column in zip(*parts))) for parts in detections]
+
+    def parse(self, resp, detailed=False):
+        cls = to_numpy(resp.boxes.cls).astype(np.int64)
+        people = np.flatnonzero(cls == 0)
+        ppe = np.flatnonzero(cls != 0)
+
+        status = self.check(people,ppe,resp.boxes,detailed)
         return status
 
+    def run(self, frame, detailed=False):
+        return self.parse(self.inner(frame), detailed)
+
+    def run_batch(self, frames, detailed=False):
+        if not frames:
+            return []
+        if not isinstance(detailed, (list, tuple)):
+            detailed = [detailed] * len(frames)
+        return [self.parse(resp, d) for resp, d in zip(self.inner_batch(frames), detailed)]
+
   
 
 
@@ -0,0 +1,620 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import Protocol
+
+"""
+Armazenamento indexado de ocorrências.
+
+Em vez de um .jpg (e um .json) por ocorrência, o OccurrenceStore mantém em um diretório:
+
+    index.sqlite3: Índice com uma linha por ocorrência (câmera, horário, categorias de EPI
+        ausentes, posição da imagem) e uma linha por pessoa (caixa, track, status de cada EPI).
+    segments/<id>.seg: Arquivos de segmento, em que as imagens (JPEG) e as miniaturas são
+        apenas acrescentadas, uma após a outra. Um segmento é fechado ao atingir `segment_size`.
+
+As consultas (por câmera, intervalo de horário, EPI ausente, track) usam o índice, sem listar o
+diretório; uma imagem é lida diretamente da sua posição no segmento.
+
+As categorias de EPI são guardadas como máscaras de bits (bit k = Protocol.PPE_NAMES[k]):
+'missing' tem as categorias que alguma pessoa não usa e 'events' as que acabaram de virar
+violação (rastreamento, ver Tracker).
+
+Retenção e compactação:
+    prune(max_age, max_bytes) remove do índice as ocorrências mais antigas; segmentos sem
+    nenhuma ocorrência são apagados.
+    compact(min_live) regrava as ocorrências restantes de segmentos com pouco conteúdo útil no
+    segmento atual e apaga os antigos.
+    Com `retention` ou `max_bytes`, as duas são aplicadas automaticamente a cada segmento fechado.
+
+Cada processo grava apenas nos segmentos que criou (os números vêm do próprio índice), então
+vários processos podem gravar no mesmo diretório; as consultas podem ser feitas por outro
+processo enquanto as câmeras gravam (o índice usa o modo WAL do SQLite). Cada segmento registra
+o processo que o grava (máquina e pid): a retenção e a compactação de outro processo só mexem em
+um segmento aberto se esse processo, na mesma máquina, já tiver terminado.
+
+Uso pela linha de comando (ver main):
+    python OccurrenceStore.py query --camera portaria --missing Capacete --start "2026-10-17 14:00" --end "2026-10-17 15:00"
+    python OccurrenceStore.py export --camera portaria --start 2026-10-17 --out revisao/
+    python OccurrenceStore.py prune --days 30
+    python OccurrenceStore.py import ./ocorrencias
+"""
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'index.sqlite3'
+SEGMENTS = 'segments'
+SEGMENT_SIZE = 64 * 1024 * 1024
+THUMBNAIL_SIZE = 160
+# Segmentos não fechados sem processo registrado (criados por uma versão anterior) e sem gravação
+# há esse tempo, em segundos, são tratados como fechados pela retenção e pela compactação.
+IDLE_SEGMENT = 3600.0
+HOSTNAME = socket.gethostname()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0,
+    owner_host TEXT,
+    owner_pid INTEGER
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    camera TEXT,
+    timestamp REAL NOT NULL,
+    event INTEGER NOT NULL,
+    missing INTEGER NOT NULL,
+    events INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    segment INTEGER NOT NULL REFERENCES segments (id),
+    image_offset INTEGER NOT NULL,
+    image_length INTEGER NOT NULL,
+    thumb_offset INTEGER NOT NULL,
+    thumb_length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS occurrences_camera_time ON occurrences (camera, timestamp);
+CREATE INDEX IF NOT EXISTS occurrences_time ON occurrences (timestamp);
+CREATE INDEX IF NOT EXISTS occurrences_segment ON occurrences (segment);
+CREATE TABLE IF NOT EXISTS people (
+    occurrence INTEGER NOT NULL REFERENCES occurrences (id) ON DELETE CASCADE,
+    person INTEGER NOT NULL,
+    track INTEGER NOT NULL,
+    x1 INTEGER NOT NULL,
+    y1 INTEGER NOT NULL,
+    x2 INTEGER NOT NULL,
+    y2 INTEGER NOT NULL,
+    missing INTEGER NOT NULL,
+    wearing INTEGER NOT NULL,
+    events INTEGER NOT NULL,
+    PRIMARY KEY (occurrence, person)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS people_track ON people (track) WHERE track != 0;
+"""
+
+_BITS = 1 << np.arange(Protocol.N_PPE, dtype=np.int64)
+
+
+def ppe_mask(names):
+    """Converte nomes (sem diferenciar maiúsculas) ou índices de categorias de EPI em uma máscara de bits."""
+    if isinstance(names, (str, int)):
+        names = [names]
+    mask = 0
+    for name in names:
+        if isinstance(name, str):
+            lowered = [ppe.lower() for ppe in Protocol.PPE_NAMES]
+            if name.lower() not in lowered:
+                raise ValueError(f"Categoria de EPI desconhecida: {name} (use {', '.join(Protocol.PPE_NAMES)})")
+            name = lowered.index(name.lower())
+        mask |= 1 << int(name)
+    return mask
+
+
+def ppe_names(mask):
+    """Converte uma máscara de bits na lista de nomes das categorias de EPI."""
+    return [name for k, name in enumerate(Protocol.PPE_NAMES) if mask >> k & 1]
+
+
+def legacy_records(people):
+    """Converte a lista 'people' de um .json do formato antigo em um array Protocol.RESULT_DTYPE."""
+    codes = {value: code for code, value in Protocol.STATUS_VALUES.items()}
+    records = np.zeros(len(people), dtype=Protocol.RESULT_DTYPE)
+    for record, person in zip(records, people):
+        record['person'] = person['box']
+        record['track'] = person.get('track') or 0
+        record['status'] = [codes.get(person['ppe'].get(name), Protocol.STATUS_UNKNOWN) for name in Protocol.PPE_NAMES]
+    return records
+
+
+def process_alive(host, pid):
+    """True se o processo `pid` da máquina `host` ainda existe. Processos de outra máquina são considerados vivos."""
+    if host != HOSTNAME:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def to_epoch(value):
+    """Aceita um timestamp (segundos), um datetime ou uma data ISO ('2026-10-17 14:00')."""
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+class OccurrenceStore:
+    """
+    Índice SQLite e segmentos de imagens das ocorrências de um diretório.
+
+    Atributos:
+        directory (Path): Diretório do índice e dos segmentos.
+        segment_size (int): Tamanho, em bytes, a partir do qual um segmento é fechado.
+        retention (float): Se informado, ocorrências mais antigas que `retention` segundos são removidas a cada segmento fechado.
+        max_bytes (int): Se informado, as ocorrências mais antigas são removidas a cada segmento fechado até que as imagens restantes ocupem no máximo `max_bytes`.
+        quality (int): Qualidade JPEG das imagens.
+        thumbnail_size (int): Maior lado, em pixels, das miniaturas.
+    Métodos:
+        add(image, status, timestamp=None, camera=None, event=False, quality=None):
+            Grava uma ocorrência (imagem BGR e status em lista ou array Protocol.RESULT_DTYPE). Retorna o id.
+        add_encoded(jpeg, status, timestamp=None, camera=None, event=False, size=None, thumbnail=None):
+            Igual a add, com a imagem já codificada em JPEG.
+        query(camera=None, start=None, end=None, missing=None, track=None, events=False, limit=None, descending=False, people=True):
+            Retorna as ocorrências que atendem a todos os filtros, em ordem de horário, como dicionários no formato
+            dos metadados do OccurrenceWriter ('camera', 'timestamp', 'size', 'people') com 'id', 'event' e 'missing'.
+            camera aceita um nome ou uma lista; start e end, timestamps, datetimes ou datas ISO (end exclusivo);
+            missing, nomes ou índices de EPI (basta faltar um deles); events=True considera apenas violações que
+            acabaram de começar.
+        count(...):
+            Quantidade de ocorrências com os mesmos filtros de query.
+        image(occurrence, thumbnail=False, decode=False):
+            Retorna o JPEG (ou o np.ndarray, com decode=True) de uma ocorrência (id ou dicionário de query).
+        prune(max_age=None, max_bytes=None, before=None):
+            Remove ocorrências antigas. Retorna a quantidade removida.
+        compact(min_live=0.5):
+            Regrava os segmentos fechados com menos de `min_live` de conteúdo útil. Retorna os bytes liberados.
+        maintain():
+            Aplica retention/max_bytes e a compactação.
+        import_files(directory):
+            Importa ocorrências do formato antigo (.jpg e .json por ocorrência, ou só .jpg nomeado pelo timestamp).
+        stats():
+            Retorna a quantidade de ocorrências, os bytes ocupados e as ocorrências por câmera.
+        close():
+            Fecha o segmento atual e o índice.
+    """
+    def __init__(self, directory='./ocorrencias', segment_size=SEGMENT_SIZE, retention=None, max_bytes=None,
+                 quality=90, thumbnail_size=THUMBNAIL_SIZE):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        (self.directory / SEGMENTS).mkdir(parents=True, exist_ok=True)
+
+        self._db = sqlite3.connect(self.directory / INDEX, timeout=30.0, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA foreign_keys=ON')
+        self._db.executescript(SCHEMA)
+        for column in ('owner_host TEXT', 'owner_pid INTEGER'):   # índices criados antes do registro do processo
+            try:
+                self._db.execute(f'ALTER TABLE segments ADD COLUMN {column}')
+            except sqlite3.OperationalError:
+                pass   # coluna já existe
+        self._lock = threading.RLock()
+        self._segment = None   # [id, arquivo, tamanho] do segmento em que este processo grava
+
+    def add(self, image, status, timestamp=None, camera=None, event=False, quality=None):
+        quality = self.quality if quality is None else quality
+        jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        return self.add_encoded(jpeg, status, timestamp, camera, event, (image.shape[1], image.shape[0]), self._thumbnail(image))
+
+    def add_encoded(self, jpeg, status, timestamp=None, camera=None, event=False, size=None, thumbnail=None):
+        records = Protocol.as_records(status)
+        if size is None or thumbnail is None:
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("Imagem JPEG inválida")
+            size = size or (image.shape[1], image.shape[0])
+            thumbnail = thumbnail if thumbnail is not None else self._thumbnail(image)
+        timestamp = time.time() if timestamp is None else to_epoch(timestamp)
+        missing = (records['status'] == Protocol.STATUS_NOT_USING) @ _BITS
+        wearing = (records['status'] == Protocol.STATUS_USING) @ _BITS
+        events = records['events'].astype(np.int64)
+
+        with self._lock:
+            with self._db:
+                segment, offset, rolled = self._append(jpeg + thumbnail)
+                occurrence = self._db.execute(
+                    'INSERT INTO occurrences (camera, timestamp, event, missing, events, width, height, segment,'
+                    ' image_offset, image_length, thumb_offset, thumb_length) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (camera, timestamp, int(bool(event)), int(np.bitwise_or.reduce(missing, initial=0)),
+                     int(np.bitwise_or.reduce(events, initial=0)), int(size[0]), int(size[1]), segment,
+                     offset, len(jpeg), offset + len(jpeg), len(thumbnail))).lastrowid
+                self._db.executemany(
+                    'INSERT INTO people VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(occurrence, p, track, *box, m, w, e) for p, (track, box, m, w, e) in enumerate(zip(
+                        records['track'].tolist(), records['person'].tolist(), missing.tolist(), wearing.tolist(), events.tolist()))])
+        if rolled and (self.retention is not None or self.max_bytes is not None):
+            self.maintain()
+        return occurrence
+
+    def _thumbnail(self, image):
+        height, width = image.shape[:2]
+        scale = min(1.0, self.thumbnail_size / max(height, width))
+        small = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        return cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()
+
+    def _segment_path(self, segment):
+        return self.directory / SEGMENTS / f'{segment:08d}.seg'
+
+    def _append(self, data):
+        """
+        Acrescenta `data` ao segmento atual (na transação aberta pelo chamador). Retorna (segmento, offset, fechou um segmento).
+
+        Se a linha do segmento atual não existir mais no índice (removida por outro processo), ele é
+        abandonado e os dados vão para um novo segmento.
+        """
+        now = time.time()
+        rolled = False
+        if self._segment is not None and self._segment[2] and self._segment[2] + len(data) > self.segment_size:
+            self._close_segment()
+            rolled = True
+        while True:
+            if self._segment is None:
+                segment = self._db.execute('INSERT INTO segments (created, updated, owner_host, owner_pid) VALUES (?, ?, ?, ?)',
+                                           (now, now, HOSTNAME, os.getpid())).lastrowid
+                self._segment = [segment, open(self._segment_path(segment), 'ab'), 0]
+            segment, f, offset = self._segment
+            if self._db.execute('UPDATE segments SET size = ?, updated = ? WHERE id = ?',
+                                (offset + len(data), now, segment)).rowcount:
+                break
+            logger.warning("Segmento %d removido do índice por outro processo; gravando em um novo segmento", segment)
+            f.close()
+            self._segment = None
+        f.write(data)
+        f.flush()
+        self._segment[2] += len(data)
+        return segment, offset, rolled
+
+    def _close_segment(self):
+        segment, f, _ = self._segment
+        f.close()
+        self._db.execute('UPDATE segments SET closed = 1 WHERE id = ?', (segment,))
+        self._segment = None
+
+    def _where(self, camera=None, start=None, end=None, missing=None, track=None, events=False):
+        clauses, params = [], []
+        if camera is not None:
+            cameras = [camera] if isinstance(camera, str) else list(camera)
+            clauses.append(f"camera IN ({', '.join('?' * len(cameras))})")
+            params += cameras
+        if start is not None:
+            clauses.append('timestamp >= ?')
+            params.append(to_epoch(start))
+        if end is not None:
+            clauses.append('timestamp < ?')
+            params.append(to_epoch(end))
+        if missing is not None:
+            clauses.append(f"({'events' if events else 'missing'} & ?) != 0")
+            params.append(ppe_mask(missing))
+        elif events:
+            clauses.append('events != 0')
+        if track is not None:
+            clauses.append('id IN (SELECT occurrence FROM people WHERE track = ?)')
+            params.append(int(track))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, camera=None, start=None, end=None, missing=None, track=None, events=False, limit=None,
+              descending=False, people=True):
+        where, params = self._where(camera, start, end, missing, track, events)
+        sql = f"SELECT * FROM occurrences{where} ORDER BY timestamp {'DESC' if descending else 'ASC'}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        found = {}
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            if people:
+                for i in range(0, len(rows), 500):
+                    ids = [row['id'] for row in rows[i:i + 500]]
+                    for person in self._db.execute(f"SELECT * FROM people WHERE occurrence IN ({', '.join('?' * len(ids))})"
+                                                   ' ORDER BY occurrence, person', ids):
+                        found.setdefault(person['occurrence'], []).append(self._person(person))
+        return [self._occurrence(row, found.get(row['id'], []) if people else None) for row in rows]
+
+    def count(self, camera=None, start=None, end=None, missing=None, track=None, events=False):
+        where, params = self._where(camera, start, end, missing, track, events)
+        with self._lock:
+            return self._db.execute(f'SELECT COUNT(*) FROM occurrences{where}', params).fetchone()[0]
+
+    @staticmethod
+    def _occurrence(row, people):
+        occurrence = {
+            'id': row['id'],
+            'camera': row['camera'],
+            'timestamp': row['timestamp'],
+            'event': bool(row['event']),
+            'missing': ppe_names(row['missing']),
+            'size': [row['width'], row['height']],
+        }
+        if people is not None:
+            occurrence['people'] = people
+        return occurrence
+
+    @staticmethod
+    def _person(row):
+        ppe = {}
+        for k, name in enumerate(Protocol.PPE_NAMES):
+            if row['missing'] >> k & 1:
+                ppe[name] = Protocol.STATUS_VALUES[Protocol.STATUS_NOT_USING]
+            elif row['wearing'] >> k & 1:
+                ppe[name] = Protocol.STATUS_VALUES[Protocol.STATUS_USING]
+            else:
+                ppe[name] = Protocol.STATUS_VALUES[Protocol.STATUS_UNKNOWN]
+        return {'box': [row['x1'], row['y1'], row['x2'], row['y2']], 'track': row['track'], 'ppe': ppe,
+                'events': ppe_names(row['events'])}
+
+    def image(self, occurrence, thumbnail=False, decode=False):
+        occurrence = occurrence['id'] if isinstance(occurrence, dict) else int(occurrence)
+        with self._lock:
+            row = self._db.execute('SELECT segment, image_offset, image_length, thumb_offset, thumb_length'
+                                   ' FROM occurrences WHERE id = ?', (occurrence,)).fetchone()
+        if row is None:
+            raise KeyError(f"Ocorrência inexistente: {occurrence}")
+        offset, length = (row['thumb_offset'], row['thumb_length']) if thumbnail else (row['image_offset'], row['image_length'])
+        with open(self._segment_path(row['segment']), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if decode else data
+
+    def prune(self, max_age=None, max_bytes=None, before=None):
+        cutoffs = [to_epoch(before)] if before is not None else []
+        if max_age is not None:
+            cutoffs.append(time.time() - max_age)
+        removed = 0
+        with self._lock:
+            with self._db:
+                if cutoffs:
+                    removed += self._db.execute('DELETE FROM occurrences WHERE timestamp < ?', (max(cutoffs),)).rowcount
+                if max_bytes is not None:
+                    excess = self._db.execute('SELECT COALESCE(SUM(image_length + thumb_length), 0)'
+                                              ' FROM occurrences').fetchone()[0] - max_bytes
+                    oldest = []
+                    if excess > 0:
+                        for row in self._db.execute('SELECT id, image_length + thumb_length AS size FROM occurrences ORDER BY timestamp'):
+                            oldest.append(row['id'])
+                            excess -= row['size']
+                            if excess <= 0:
+                                break
+                    for i in range(0, len(oldest), 500):
+                        ids = oldest[i:i + 500]
+                        removed += self._db.execute(f"DELETE FROM occurrences WHERE id IN ({', '.join('?' * len(ids))})", ids).rowcount
+            self._drop_empty_segments()
+        if removed:
+            logger.info("%d ocorrências removidas pela retenção", removed)
+        return removed
+
+    def _inactive_segments(self, columns):
+        """
+        Segmentos que nenhum processo está gravando: fechados ou abertos por um processo desta máquina que
+        já terminou. Segmentos abertos sem processo registrado contam como inativos após IDLE_SEGMENT.
+        """
+        current = self._segment[0] if self._segment is not None else -1
+        rows = self._db.execute(
+            f'SELECT {columns}, s.closed AS closed_, s.owner_host AS host_, s.owner_pid AS pid_, s.updated AS updated_'
+            ' FROM segments s WHERE s.id != ?', (current,)).fetchall()
+        idle = time.time() - IDLE_SEGMENT
+        return [row for row in rows if row['closed_'] or (
+            row['updated_'] < idle if row['pid_'] is None else not process_alive(row['host_'], row['pid_']))]
+
+    def _drop_empty_segments(self):
+        empty = [row['id'] for row in self._inactive_segments(
+            's.id, NOT EXISTS (SELECT 1 FROM occurrences o WHERE o.segment = s.id) AS empty') if row['empty']]
+        if not empty:
+            return
+        with self._db:
+            self._db.executemany('DELETE FROM segments WHERE id = ?', [(segment,) for segment in empty])
+        for segment in empty:
+            self._segment_path(segment).unlink(missing_ok=True)
+
+    def compact(self, min_live=0.5):
+        reclaimed = 0
+        with self._lock:
+            live = ('s.id, s.size, (SELECT COALESCE(SUM(o.image_length + o.thumb_length), 0)'
+                    ' FROM occurrences o WHERE o.segment = s.id) AS live')
+            for row in self._inactive_segments(live):
+                if not row['live'] or row['live'] >= min_live * row['size']:
+                    continue
+                segment = row['id']
+                with self._db:
+                    entries = self._db.execute('SELECT id, image_offset, image_length, thumb_offset, thumb_length'
+                                               ' FROM occurrences WHERE segment = ? ORDER BY image_offset', (segment,)).fetchall()
+                    with open(self._segment_path(segment), 'rb') as f:
+                        for entry in entries:
+                            f.seek(entry['image_offset'])
+                            data = f.read(entry['image_length'])
+                            f.seek(entry['thumb_offset'])
+                            data += f.read(entry['thumb_length'])
+                            target, offset, _ = self._append(data)
+                            self._db.execute('UPDATE occurrences SET segment = ?, image_offset = ?, thumb_offset = ? WHERE id = ?',
+                                             (target, offset, offset + entry['image_length'], entry['id']))
+                    self._db.execute('DELETE FROM segments WHERE id = ?', (segment,))
+                self._segment_path(segment).unlink(missing_ok=True)
+                reclaimed += row['size'] - row['live']
+        if reclaimed:
+            logger.info("Compactação liberou %.1f MB", reclaimed / 1e6)
+        return reclaimed
+
+    def maintain(self):
+        if self.retention is not None or self.max_bytes is not None:
+            self.prune(self.retention, self.max_bytes)
+        self.compact()
+
+    def import_files(self, directory):
+        imported = 0
+        for path in sorted(Path(directory).glob('*.jpg')):
+            metadata_path = path.with_suffix('.json')
+            try:
+                if metadata_path.exists():
+                    with open(metadata_path) as f:
+                        metadata = json.load(f)
+                else:
+                    metadata = {'timestamp': float(path.stem)}
+                jpeg = path.read_bytes()
+            except (OSError, ValueError) as e:
+                logger.warning("Ignorando %s: %s", path, e)
+                continue
+            camera, timestamp = metadata.get('camera'), metadata['timestamp']
+            with self._lock:
+                exists = self._db.execute('SELECT 1 FROM occurrences WHERE timestamp = ? AND camera IS ?',
+                                          (timestamp, camera)).fetchone()
+            if exists:
+                continue
+            try:
+                self.add_encoded(jpeg, legacy_records(metadata.get('people', [])), timestamp, camera, size=metadata.get('size'))
+            except (ValueError, KeyError) as e:
+                logger.warning("Ignorando %s: %s", path, e)
+                continue
+            imported += 1
+        return imported
+
+    def stats(self):
+        with self._lock:
+            occurrences = self._db.execute('SELECT COUNT(*), COALESCE(SUM(image_length + thumb_length), 0), MIN(timestamp),'
+                                           ' MAX(timestamp) FROM occurrences').fetchone()
+            segments = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments').fetchone()
+            cameras = self._db.execute('SELECT camera, COUNT(*) FROM occurrences GROUP BY camera').fetchall()
+        return {
+            'occurrences': occurrences[0],
+            'live_bytes': occurrences[1],
+            'first': occurrences[2],
+            'last': occurrences[3],
+            'segments': segments[0],
+            'segment_bytes': segments[1],
+            'cameras': {camera: count for camera, count in cameras},
+        }
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                with self._db:
+                    self._close_segment()
+            self._db.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(directory='./ocorrencias', **options):
+    """
+    Retorna o OccurrenceStore de um diretório, compartilhado por todos que o abrirem neste processo
+    (por exemplo, os OccurrenceWriter de cada câmera). As opções só valem na primeira abertura.
+    """
+    key = Path(directory).resolve()
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = OccurrenceStore(directory, **options)
+        return store
+
+
+def format_occurrence(occurrence):
+    moment = datetime.datetime.fromtimestamp(occurrence['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+    people = []
+    for p, person in enumerate(occurrence.get('people', [])):
+        missing = [name for name, value in person['ppe'].items() if value is False]
+        if missing:
+            who = f"pessoa {person['track']}" if person['track'] else f"pessoa {p + 1}"
+            people.append(f"{who} sem {', '.join(missing)}")
+    return f"{moment}  #{occurrence['id']}  {occurrence['camera']}  {'; '.join(people)}"
+
+
+def parse_args():
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('--camera', action='append', help="Câmera (pode ser repetido)")
+    filters.add_argument('--start', help="Início (timestamp ou data ISO, ex.: '2026-10-17 14:00')")
+    filters.add_argument('--end', help="Fim, exclusivo (timestamp ou data ISO)")
+    filters.add_argument('--missing', action='append', help="Categoria de EPI ausente (pode ser repetido; basta faltar uma)")
+    filters.add_argument('--track', type=int, help="Id de rastreamento da pessoa")
+    filters.add_argument('--events', action='store_true', help="Apenas violações que acabaram de começar")
+    filters.add_argument('--limit', type=int, help="Quantidade máxima de ocorrências")
+
+    parser = argparse.ArgumentParser(description="Consulta e manutenção do armazenamento de ocorrências")
+    parser.add_argument('--directory', default='./ocorrencias', help="Diretório do armazenamento")
+    commands = parser.add_subparsers(dest='command', required=True)
+    query = commands.add_parser('query', parents=[filters], help="Lista as ocorrências")
+    query.add_argument('--json', action='store_true', help="Uma ocorrência por linha em JSON")
+    export = commands.add_parser('export', parents=[filters], help="Extrai as imagens das ocorrências")
+    export.add_argument('--out', required=True, help="Diretório de destino")
+    export.add_argument('--thumbnails', action='store_true', help="Extrai as miniaturas em vez das imagens")
+    prune = commands.add_parser('prune', help="Remove ocorrências antigas")
+    prune.add_argument('--days', type=float, help="Remove ocorrências com mais de N dias")
+    prune.add_argument('--max-gb', type=float, help="Remove as mais antigas até que as imagens ocupem no máximo N GB")
+    compact = commands.add_parser('compact', help="Regrava segmentos com pouco conteúdo útil")
+    compact.add_argument('--min-live', type=float, default=0.5, help="Fração mínima de conteúdo útil para manter um segmento")
+    legacy = commands.add_parser('import', help="Importa ocorrências do formato antigo (.jpg e .json)")
+    legacy.add_argument('source', help="Diretório com os arquivos antigos")
+    commands.add_parser('stats', help="Mostra a ocupação do armazenamento")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    store = OccurrenceStore(args.directory)
+    try:
+        if args.command in ('query', 'export'):
+            occurrences = store.query(args.camera, args.start, args.end, args.missing, args.track, args.events, args.limit)
+            if args.command == 'query':
+                for occurrence in occurrences:
+                    print(json.dumps(occurrence, ensure_ascii=False) if args.json else format_occurrence(occurrence))
+            else:
+                out = Path(args.out)
+                out.mkdir(parents=True, exist_ok=True)
+                for occurrence in occurrences:
+                    name = f"{occurrence['camera']}_{occurrence['timestamp']:.3f}_{occurrence['id']}.jpg".replace('/', '_')
+                    (out / name).write_bytes(store.image(occurrence, thumbnail=args.thumbnails))
+                print(f"{len(occurrences)} imagens exportadas para {out}")
+        elif args.command == 'prune':
+            max_age = args.days * 86400 if args.days is not None else None
+            max_bytes = int(args.max_gb * 1e9) if args.max_gb is not None else None
+            print(f"{store.prune(max_age, max_bytes)} ocorrências removidas")
+            print(f"{store.compact() / 1e6:.1f} MB liberados")
+        elif args.command == 'compact':
+            print(f"{store.compact(args.min_live) / 1e6:.1f} MB liberados")
+        elif args.command == 'import':
+            print(f"{store.import_files(args.source)} ocorrências importadas")
+        else:
+            print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
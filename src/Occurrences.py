@@ -0,0 +1,166 @@
+import json
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import Protocol
+from Metrics import REGISTRY
+from OccurrenceStore import open_store
+
+"""
+Gravação assíncrona de ocorrências (frames anotados com violação de EPI).
+
+A thread de captura apenas entrega o frame anotado e o status recebido do servidor ao
+OccurrenceWriter; a codificação JPEG e a escrita em disco acontecem em uma thread separada,
+alimentada por uma fila limitada. Se a fila estiver cheia, a ocorrência é descartada em vez de
+atrasar a captura.
+
+Por padrão as ocorrências vão para um OccurrenceStore (índice SQLite e imagens em segmentos),
+que permite consultar por câmera, horário e EPI ausente sem listar o diretório.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def violations(records):
+    """
+    Retorna as violações de um status (array Protocol.RESULT_DTYPE).
+
+    Retorna:
+        tuple: Índices das categorias de EPI não utilizadas, uma entrada por pessoa e item, ordenados.
+    """
+    return tuple(sorted(np.nonzero(records['status'] == Protocol.STATUS_NOT_USING)[1].tolist()))
+
+
+class OccurrenceWriter:
+    """
+    Grava ocorrências em segundo plano.
+
+    Cada ocorrência é gravada no OccurrenceStore do diretório, com a imagem anotada, a câmera, o
+    horário e o status de EPI de cada pessoa. No formato antigo (store=False), gera dois arquivos
+    com o mesmo nome (timestamp): a imagem (.jpg) e os metadados (.json).
+
+    Atributos:
+        directory (Path): Diretório onde as ocorrências são gravadas.
+        store (OccurrenceStore): Armazenamento das ocorrências. Com store=True (padrão) é usado o OccurrenceStore de
+            `directory`, compartilhado pelos OccurrenceWriter do processo; também pode ser informado diretamente.
+            None com store=False (formato antigo).
+        camera (str): Identificação da câmera registrada nos metadados.
+        only_violations (bool): Se True, só grava frames com pelo menos uma violação de EPI.
+        min_interval (float): Intervalo mínimo, em segundos, entre duas gravações com o mesmo conjunto de violações.
+        quality (int): Qualidade JPEG (0-100).
+        max_size (int): Se informado, reduz a imagem até que o maior lado tenha no máximo `max_size` pixels.
+        max_queue (int): Tamanho máximo da fila de gravação.
+        written (int): Ocorrências gravadas.
+        dropped (int): Ocorrências descartadas porque a fila estava cheia.
+        suppressed (int): Ocorrências ignoradas pela política (sem violação ou repetidas dentro de min_interval).
+    Métodos:
+        submit(image, status, timestamp=None, copy=False, event=False, camera=None):
+            Recebe o status no formato de lista ou como array Protocol.RESULT_DTYPE. Aplica a política e, se aceita, enfileira a ocorrência. Retorna True se foi enfileirada.
+            Com event=True (início de uma violação indicado pelo Tracker) o intervalo mínimo não é aplicado.
+            camera substitui o atributo camera nos metadados, para um OccurrenceWriter compartilhado por várias câmeras;
+            o intervalo mínimo é aplicado separadamente para cada câmera.
+        stop():
+            Grava as ocorrências pendentes e encerra a thread.
+    """
+    def __init__(self, directory='./ocorrencias', camera=None, only_violations=True, min_interval=10.0,
+                 quality=90, max_size=None, max_queue=32, store=True):
+        self.directory = Path(directory)
+        self.store = open_store(directory) if store is True else (store or None)
+        self.camera = camera
+        self.only_violations = only_violations
+        self.min_interval = min_interval
+        self.quality = quality
+        self.max_size = max_size
+        self.written = 0
+        self.dropped = 0
+        self.suppressed = 0
+
+        label = str(camera) if camera is not None else ''
+        self._written = REGISTRY.counter('epi_client_snapshots_written_total', "Ocorrências gravadas em disco", camera=label)
+        self._dropped = REGISTRY.counter('epi_client_snapshots_dropped_total', "Ocorrências descartadas com a fila de gravação cheia", camera=label)
+        self._write_ms = REGISTRY.histogram('epi_client_snapshot_write_ms', "Tempo de gravação de uma ocorrência, em ms", camera=label)
+        REGISTRY.gauge('epi_client_snapshot_queue', "Ocorrências aguardando gravação", fn=lambda: self._queue.qsize(), camera=label)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._last = {}
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, image, status, timestamp=None, copy=False, event=False, camera=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        camera = self.camera if camera is None else camera
+        status = Protocol.as_records(status)
+        found = violations(status)
+        key = (camera, found)
+        if self.only_violations and not found:
+            self.suppressed += 1
+            return False
+        last = self._last.get(key)
+        if not event and last is not None and timestamp - last < self.min_interval:
+            self.suppressed += 1
+            return False
+
+        try:
+            self._queue.put_nowait((image.copy() if copy else image, status, timestamp, camera, event))
+        except queue.Full:
+            self.dropped += 1
+            self._dropped.inc()
+            return False
+        self._last[key] = timestamp
+        if len(self._last) > 256:
+            self._last = {k: t for k, t in self._last.items() if timestamp - t < self.min_interval}
+        return True
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                with self._write_ms.time():
+                    self._write(*item)
+            except Exception as e:
+                logger.error("Erro ao salvar ocorrência: %s", e)
+
+    def _write(self, image, status, timestamp, camera=None, event=False):
+        height, width = image.shape[:2]
+        if self.max_size and max(height, width) > self.max_size:
+            scale = self.max_size / max(height, width)
+            image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+        if self.store is not None:
+            occurrence = self.store.add(image, status, timestamp, camera, event, self.quality)
+            logger.info("Ocorrência %d gravada (câmera %s)", occurrence, camera)
+            self.written += 1
+            self._written.inc()
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        url = self.directory / str(timestamp)
+        logger.info("Salvando frame com violação de EPI em: %s.jpg", url)
+        cv2.imwrite(f'{url}.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+
+        metadata = {
+            'camera': camera,
+            'timestamp': timestamp,
+            'image': f'{url.name}.jpg',
+            'size': [width, height],
+            'people': [
+                {'box': person, 'track': track, 'ppe': {name: Protocol.STATUS_VALUES[code] for name, code in zip(Protocol.PPE_NAMES, codes)}}
+                for person, codes, track in zip(status['person'].tolist(), status['status'].tolist(), status['track'].tolist())
+            ],
+        }
+        with open(f'{url}.json', 'w') as f:
+            json.dump(metadata, f)
+        self.written += 1
+        self._written.inc()
@@ -0,0 +1,507 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+
+import NN
+import Metrics
+import Protocol
+
+"""
+Análise offline de vídeos gravados e diretórios de imagens.
+
+Em vez de apontar uma RTSPStreamCapture para um arquivo e enviar os frames ao servidor em tempo
+real, os frames passam pelo NN.PPE no próprio processo, tão rápido quanto o hardware permitir:
+
+    Decodificação: `decoders` threads leem as fontes (uma fonte por thread, várias fontes ao
+        mesmo tempo) e deixam até `prefetch` frames prontos em uma fila. Frames fora da
+        amostragem (stride/every) são apenas demultiplexados (grab), sem decodificação.
+    Inferência: a thread principal junta até `batch_size` frames, de quaisquer fontes, e faz uma
+        única predição (PPE.inner_batch).
+    Pós-processamento: PPE.parse e a serialização de cada frame rodam em `post_workers` threads;
+        uma thread de escrita grava os resultados na ordem de inferência, o que mantém a ordem
+        dos frames de cada fonte.
+
+Os resultados, um registro por frame (fonte, índice, tempo no vídeo, pessoas e status de cada
+EPI, categorias ausentes), vão para um arquivo JSON Lines ou, com o pacote opcional pyarrow,
+para um diretório Parquet (um arquivo por checkpoint).
+
+Retomada: a cada `checkpoint_interval` segundos o progresso (último frame gravado de cada fonte
+e tamanho da saída) é salvo em '<saída>.progress.json'. Uma nova execução com a mesma saída
+descarta o que foi gravado depois do último checkpoint, pula as fontes concluídas e continua
+cada fonte parcial a partir do frame seguinte ao último gravado. As imagens de um diretório são
+uma fonte só, na ordem dos nomes; imagens acrescentadas entre execuções mudam essa ordem.
+
+Uso:
+    python Offline.py videos/ gravacao.mp4 --output resultados.jsonl --batch-size 16 --every 0.5
+"""
+
+logger = logging.getLogger(__name__)
+
+model_path = Path('model') / 'best.pt'
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.mov', '.m4v', '.webm', '.ts', '.mpg', '.mpeg', '.wmv', '.flv'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+FORMATS = ('jsonl', 'parquet')
+
+
+def find_sources(paths):
+    """
+    Expande os caminhos informados em fontes.
+
+    Um diretório gera uma fonte para cada vídeo e uma fonte com todas as suas imagens; um
+    arquivo de imagem é uma fonte de uma imagem; qualquer outro arquivo é tratado como vídeo.
+
+    Retorna:
+        dict: {nome da fonte: caminho do vídeo ou lista de imagens}, na ordem informada.
+    """
+    sources = {}
+    for path in map(Path, paths):
+        if path.is_dir():
+            entries = sorted(p for p in path.iterdir() if p.is_file())
+            for video in entries:
+                if video.suffix.lower() in VIDEO_EXTENSIONS:
+                    sources[str(video)] = video
+            images = [p for p in entries if p.suffix.lower() in IMAGE_EXTENSIONS]
+            if images:
+                sources[str(path)] = images
+        elif not path.exists():
+            raise FileNotFoundError(f"Fonte inexistente: {path}")
+        elif path.suffix.lower() in IMAGE_EXTENSIONS:
+            sources[str(path)] = [path]
+        else:
+            sources[str(path)] = path
+    return sources
+
+
+def read_frames(source, stride=1, every=None, start=0):
+    """
+    Lê os frames amostrados de uma fonte, a partir do índice `start`.
+
+    Args:
+        source (Path | list): Vídeo ou lista de imagens.
+        stride (int): Processa um frame a cada `stride`.
+        every (float): Em vídeos, processa um frame a cada `every` segundos (se maior que stride).
+
+    Gera:
+        tuple: (índice, tempo no vídeo em segundos ou None, nome da imagem ou None, frame BGR).
+    """
+    if isinstance(source, list):
+        for index in range(start, len(source)):
+            if index % stride:
+                continue
+            frame = cv2.imread(str(source[index]))
+            if frame is None:
+                logger.warning("Não foi possível ler a imagem %s", source[index])
+                continue
+            yield index, None, source[index].name, frame
+        return
+
+    cap = cv2.VideoCapture(str(source))
+    if not cap.isOpened():
+        raise OSError(f"Não foi possível abrir o vídeo {source}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        fps = fps if 0 < fps < 1000 else 0
+        if every and fps:
+            stride = max(stride, round(fps * every))
+        index = 0
+        while cap.grab():
+            if index >= start and index % stride == 0:
+                seconds = index / fps if fps else cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                ok, frame = cap.retrieve()
+                if ok:
+                    yield index, seconds, None, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def frame_record(source, index, seconds, image, status):
+    """Registro de um frame, com as pessoas no mesmo formato dos metadados do OccurrenceWriter."""
+    records = Protocol.as_records(status)
+    people = [
+        {'box': person, 'ppe': {name: Protocol.STATUS_VALUES[code] for name, code in zip(Protocol.PPE_NAMES, codes)}}
+        for person, codes in zip(records['person'].tolist(), records['status'].tolist())
+    ]
+    missing = (records['status'] == Protocol.STATUS_NOT_USING).any(axis=0)
+    return {
+        'source': source,
+        'frame': index,
+        'time': seconds,
+        'image': image,
+        'missing': [name for name, absent in zip(Protocol.PPE_NAMES, missing.tolist()) if absent],
+        'people': people,
+    }
+
+
+class JsonlSink:
+    """Saída JSON Lines: um objeto por frame. O checkpoint é o tamanho do arquivo."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = None
+
+    @staticmethod
+    def encode(record):
+        return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def restore(self, state):
+        self._file = open(self.path, 'a+b')
+        self._file.truncate(state['bytes'] if state else 0)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def checkpoint(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {'bytes': os.fstat(self._file.fileno()).st_size}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """
+    Saída Parquet (requer pyarrow): um diretório com um arquivo part-NNNNN.parquet por checkpoint,
+    legível como um único dataset. As pessoas de cada frame ficam em JSON na coluna 'detections'.
+    """
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("A saída Parquet requer o pacote pyarrow (pip install pyarrow)") from e
+        self._pa, self._pq = pyarrow, pyarrow.parquet
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._schema = pyarrow.schema([
+            ('source', pyarrow.string()),
+            ('frame', pyarrow.int64()),
+            ('time', pyarrow.float64()),
+            ('image', pyarrow.string()),
+            ('people', pyarrow.int32()),
+            ('violations', pyarrow.int32()),
+            ('missing', pyarrow.list_(pyarrow.string())),
+            ('detections', pyarrow.string()),
+        ])
+        self._rows = []
+        self._parts = 0
+
+    @staticmethod
+    def encode(record):
+        people = record['people']
+        return {
+            'source': record['source'],
+            'frame': record['frame'],
+            'time': record['time'],
+            'image': record['image'],
+            'people': len(people),
+            'violations': sum(any(value is False for value in person['ppe'].values()) for person in people),
+            'missing': record['missing'],
+            'detections': json.dumps(people, ensure_ascii=False),
+        }
+
+    def restore(self, state):
+        self._parts = state['parts'] if state else 0
+        for part in self.path.glob('part-*.parquet'):
+            if int(part.stem.split('-')[1]) >= self._parts:
+                part.unlink()
+
+    def write(self, row):
+        self._rows.append(row)
+
+    def checkpoint(self):
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self._schema)
+            self._pq.write_table(table, self.path / f'part-{self._parts:05d}.parquet')
+            self._parts += 1
+            self._rows = []
+        return {'parts': self._parts}
+
+    def close(self):
+        pass
+
+
+class BatchAnalyzer:
+    """
+    Processa vídeos e diretórios de imagens com o NN.PPE no próprio processo.
+
+    Atributos:
+        model (NN.PPE): Modelo usado na inferência.
+        output (Path): Arquivo .jsonl ou diretório .parquet de saída.
+        output_format (str): 'jsonl' ou 'parquet'. Padrão: pela extensão de output.
+        batch_size (int): Máximo de frames por predição.
+        max_wait_ms (float): Tempo máximo que o primeiro frame de um lote espera pelos demais.
+        decoders (int): Fontes decodificadas ao mesmo tempo.
+        post_workers (int): Threads de pós-processamento e serialização.
+        prefetch (int): Frames decodificados aguardando inferência.
+        stride (int): Processa um frame a cada `stride` de cada fonte.
+        every (float): Em vídeos, processa um frame a cada `every` segundos.
+        max_size (int): Se informado, os frames são reduzidos na decodificação até que o maior lado tenha no máximo
+            `max_size` pixels; as caixas voltam para as coordenadas do frame original. Não pode ser usado com um
+            modelo com roi, que recorta os EPIs do frame em resolução plena.
+        resume (bool): Continua a partir do último checkpoint de output. Se False, a saída é reescrita.
+        checkpoint_interval (float): Intervalo, em segundos, entre checkpoints.
+        report_interval (float): Intervalo, em segundos, entre relatórios de vazão no log. 0 desativa.
+        progress (dict): Progresso de cada fonte: último frame gravado ('frame'), 'done' e, se a leitura falhou, 'error'.
+    Métodos:
+        run(paths):
+            Processa as fontes de find_sources(paths). Retorna frames processados, tempo, vazão e fontes concluídas.
+    """
+    def __init__(self, model, output, output_format=None, batch_size=16, max_wait_ms=20.0, decoders=2, post_workers=4,
+                 prefetch=32, stride=1, every=None, max_size=None, resume=True, checkpoint_interval=10.0, report_interval=10.0):
+        self.model = model
+        self.output = Path(output)
+        self.output_format = output_format or ('parquet' if self.output.suffix == '.parquet' else 'jsonl')
+        if self.output_format not in FORMATS:
+            raise ValueError(f"Formato de saída desconhecido: {self.output_format} (use {', '.join(FORMATS)})")
+        if max_size and getattr(model, 'roi', False):
+            raise ValueError("max_size não pode ser usado com roi: os recortes dos EPIs precisam do frame em resolução plena")
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait_ms = max_wait_ms
+        self.decoders = max(1, int(decoders))
+        self.post_workers = max(1, int(post_workers))
+        self.prefetch = max(self.batch_size, int(prefetch))
+        self.stride = max(1, int(stride))
+        self.every = every
+        self.max_size = max_size
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.report_interval = report_interval
+        self.progress_path = self.output.with_name(self.output.name + '.progress.json')
+        self.progress = {}
+        self.frames = 0
+        self._encode = None
+        self._error = None
+
+    def run(self, paths):
+        sources = find_sources(paths)
+        sink = ParquetSink(self.output) if self.output_format == 'parquet' else JsonlSink(self.output)
+        state = self._load_progress() if self.resume else None
+        sink.restore(state['sink'] if state else None)
+        self.progress = state['sources'] if state else {}
+        self._encode = sink.encode
+        pending = {name: source for name, source in sources.items() if not self.progress.get(name, {}).get('done')}
+        if len(pending) < len(sources):
+            logger.info("%d de %d fontes já processadas, ignorando", len(sources) - len(pending), len(sources))
+
+        frames = queue.Queue(maxsize=self.prefetch)
+        results = queue.Queue(maxsize=self.batch_size * 4)
+        stop = threading.Event()
+        decoders = ThreadPoolExecutor(max_workers=self.decoders, thread_name_prefix='decodificacao')
+        post = ThreadPoolExecutor(max_workers=self.post_workers, thread_name_prefix='pos-processamento')
+        writer = threading.Thread(target=self._write_loop, args=(results, sink), name='escrita')
+        writer.start()
+        for name, source in pending.items():
+            start = self.progress.get(name, {}).get('frame', -1) + 1
+            decoders.submit(self._decode, name, source, start, frames, stop)
+
+        started = time.perf_counter()
+        try:
+            self._infer_loop(frames, results, post, len(pending), started)
+        finally:
+            stop.set()
+            decoders.shutdown(wait=True)
+            post.shutdown(wait=True)
+            results.put(None)
+            writer.join()
+            sink.close()
+        if self._error is not None:
+            raise self._error
+        elapsed = time.perf_counter() - started
+        stats = {
+            'frames': self.frames,
+            'seconds': elapsed,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+            'done': sum(1 for name in sources if self.progress.get(name, {}).get('done')),
+            'sources': len(sources),
+        }
+        logger.info("%d frames em %.1f s (%.1f frames/s), %d de %d fontes concluídas",
+                    stats['frames'], elapsed, stats['fps'], stats['done'], stats['sources'])
+        return stats
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get('format') != self.output_format:
+            raise ValueError(f"{self.progress_path} é de uma saída {state.get('format')}, não {self.output_format}")
+        return state
+
+    def _checkpoint(self, sink):
+        state = {'format': self.output_format, 'sink': sink.checkpoint(), 'sources': self.progress}
+        temporary = self.progress_path.with_name(self.progress_path.name + '.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.progress_path)
+
+    @staticmethod
+    def _put(target, item, stop):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode(self, name, source, start, frames, stop):
+        error = None
+        try:
+            for index, seconds, image, frame in read_frames(source, self.stride, self.every, start):
+                scale = None
+                if self.max_size:
+                    height, width = frame.shape[:2]
+                    frame = Protocol.resize_frame(frame, self.max_size)
+                    if frame.shape[:2] != (height, width):
+                        scale = (width / frame.shape[1], height / frame.shape[0])
+                if not self._put(frames, ('frame', name, index, seconds, image, frame, scale), stop):
+                    return
+        except Exception as e:
+            error = str(e)
+            logger.error("Erro ao ler %s: %s", name, e)
+        self._put(frames, ('end', name, error), stop)
+
+    def _collect(self, frames):
+        items = [frames.get()]
+        count = int(items[0][0] == 'frame')
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while count < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = frames.get(timeout=remaining) if remaining > 0 else frames.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            count += item[0] == 'frame'
+        return items
+
+    def _infer_loop(self, frames, results, post, remaining, started):
+        last_report = started
+        while remaining:
+            if self._error is not None:
+                raise self._error
+            items = self._collect(frames)
+            batch = [item for item in items if item[0] == 'frame']
+            responses = iter(self.model.inner_batch([item[5] for item in batch]) if batch else [])
+            for item in items:
+                if item[0] == 'frame':
+                    _, name, index, seconds, image, _, scale = item
+                    future = post.submit(self._postprocess, name, index, seconds, image, next(responses), scale)
+                    results.put(('frame', name, index, future))
+                else:
+                    remaining -= 1
+                    results.put(item)
+            self.frames += len(batch)
+
+            now = time.perf_counter()
+            if self.report_interval and now - last_report >= self.report_interval:
+                last_report = now
+                logger.info("%d frames processados (%.1f frames/s), %d decodificados aguardando inferência",
+                            self.frames, self.frames / (now - started), frames.qsize())
+
+    def _postprocess(self, name, index, seconds, image, response, scale):
+        status = self.model.parse(response)
+        if scale is not None:
+            status = Protocol.scale_status(status, *scale)
+        return self._encode(frame_record(name, index, seconds, image, status))
+
+    def _write_loop(self, results, sink):
+        last_checkpoint = time.monotonic()
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue   # a escrita falhou: só esvazia a fila até a thread principal encerrar
+            try:
+                if item[0] == 'frame':
+                    _, name, index, future = item
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        logger.warning("Erro no pós-processamento do frame %d de %s: %s", index, name, e)
+                    else:
+                        sink.write(data)
+                    self.progress.setdefault(name, {})['frame'] = index
+                else:
+                    _, name, error = item
+                    entry = self.progress.setdefault(name, {'frame': -1})
+                    entry['done'] = error is None
+                    if error is None:
+                        entry.pop('error', None)
+                        logger.info("Fonte %s concluída", name)
+                    else:
+                        entry['error'] = error
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    self._checkpoint(sink)
+                    last_checkpoint = time.monotonic()
+            except Exception as e:
+                logger.error("Erro ao gravar os resultados em %s: %s", self.output, e)
+                self._error = e
+        if self._error is None:
+            self._checkpoint(sink)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Análise offline de vídeos e diretórios de imagens")
+    parser.add_argument('sources', nargs='+', help="Vídeos, imagens ou diretórios")
+    parser.add_argument('--output', required=True, help="Arquivo .jsonl ou diretório .parquet de saída")
+    parser.add_argument('--format', choices=FORMATS, default=None, help="Formato da saída (padrão: pela extensão)")
+    parser.add_argument('--model', default=str(model_path), help="Modelo YOLO")
+    parser.add_argument('--backend', choices=list(NN.BACKENDS), default='torch', help="Backend de inferência (modelos exportados ficam em model/exports)")
+    parser.add_argument('--imgsz', type=int, default=640, help="Tamanho de entrada do modelo")
+    parser.add_argument('--half', action='store_true', help="Inferência em FP16, quando suportado pelo backend")
+    parser.add_argument('--int8', action='store_true', help="Quantização INT8 (apenas openvino)")
+    parser.add_argument('--conf', type=float, default=0.25, help="Confiança mínima das detecções")
+    parser.add_argument('--iou', type=float, default=0.7, help="IoU do NMS")
+    parser.add_argument('--device', default=None, help="Dispositivo de inferência (ex.: cpu, 0)")
+    parser.add_argument('--threads', type=int, default=None, help="Threads do torch")
+    parser.add_argument('--roi', action='store_true', help="Detecta pessoas no frame reduzido e EPIs nos recortes das pessoas em resolução plena")
+    parser.add_argument('--roi-imgsz', type=int, default=None, help="Tamanho de entrada dos recortes (padrão: --imgsz)")
+    parser.add_argument('--roi-margin', type=float, default=0.15, help="Margem do recorte em torno de cada pessoa")
+    parser.add_argument('--batch-size', type=int, default=16, help="Máximo de frames por predição")
+    parser.add_argument('--max-wait-ms', type=float, default=20.0, help="Espera máxima para completar um lote")
+    parser.add_argument('--decoders', type=int, default=2, help="Fontes decodificadas ao mesmo tempo")
+    parser.add_argument('--post-workers', type=int, default=4, help="Threads de pós-processamento")
+    parser.add_argument('--prefetch', type=int, default=32, help="Frames decodificados aguardando inferência")
+    parser.add_argument('--stride', type=int, default=1, help="Processa um frame a cada N")
+    parser.add_argument('--every', type=float, default=None, help="Em vídeos, processa um frame a cada N segundos")
+    parser.add_argument('--max-size', type=int, default=None, help="Reduz os frames na decodificação até este maior lado (não use com --roi)")
+    parser.add_argument('--no-resume', action='store_true', help="Reescreve a saída em vez de continuar do último checkpoint")
+    parser.add_argument('--checkpoint-interval', type=float, default=10.0, help="Segundos entre checkpoints")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Segundos entre relatórios de vazão (0 desativa)")
+    parser.add_argument('--log-level', default='INFO', help="Nível de log (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument('--log-json', action='store_true', help="Log estruturado, um objeto JSON por linha")
+    args = parser.parse_args()
+    if args.max_size and args.roi:
+        parser.error("--max-size não pode ser usado com --roi")
+    return args
+
+
+def main():
+    args = parse_args()
+    Metrics.configure_logging(args.log_level, args.log_json)
+    model = NN.PPE(args.model, backend=args.backend, imgsz=args.imgsz, half=args.half, int8=args.int8, conf=args.conf,
+                   iou=args.iou, threads=args.threads, device=args.device, roi=args.roi, roi_imgsz=args.roi_imgsz,
+                   roi_margin=args.roi_margin)
+    analyzer = BatchAnalyzer(model, args.output, args.format, args.batch_size, args.max_wait_ms, decoders=args.decoders,
+                             post_workers=args.post_workers, prefetch=args.prefetch, stride=args.stride, every=args.every,
+                             max_size=args.max_size, resume=not args.no_resume, checkpoint_interval=args.checkpoint_interval,
+                             report_interval=args.report_interval)
+    analyzer.run(args.sources)
+
+
+if __name__ == "__main__":
+    main()
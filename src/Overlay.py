@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+
+import Protocol
+
+"""
+Desenho das anotações de EPI sobre os frames.
+
+Os segmentos tracejados de todas as caixas de EPI ausente são calculados de uma vez com
+operações de array e desenhados com uma única chamada de cv2.polylines por espessura, em vez
+de um cv2.line por traço. O resultado é idêntico ao desenho traço a traço: cada aresta tem
+`solid_length` pixels sólidos em cada ponta e, entre elas, traços de `dash_length` separados
+por `gap_length`. A única diferença é a ordem: as caixas verdes (pessoas em conformidade) são
+desenhadas antes de qualquer anotação vermelha, que assim nunca fica escondida sob elas.
+"""
+
+VERMELHO = (0, 0, 255)
+VERDE = (0, 255, 0)
+
+
+def box_edges(boxes):
+    """
+    Retorna as 4 arestas (superior, inferior, esquerda, direita) de cada caixa.
+
+    Args:
+        boxes (np.ndarray): Caixas (N, 4) no formato x1, y1, x2, y2.
+
+    Retorna:
+        tuple: (início, fim) das arestas, cada um com forma (4N, 2).
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    start = np.stack([np.stack([x1, y1], 1), np.stack([x1, y2], 1), np.stack([x1, y1], 1), np.stack([x2, y1], 1)], 1)
+    end = np.stack([np.stack([x2, y1], 1), np.stack([x2, y2], 1), np.stack([x1, y2], 1), np.stack([x2, y2], 1)], 1)
+    return start.reshape(-1, 2).astype(np.float64), end.reshape(-1, 2).astype(np.float64)
+
+
+def dashed_segments(boxes, dash_length=15, gap_length=10, solid_length=20):
+    """
+    Calcula os segmentos do contorno tracejado com pontas sólidas de todas as caixas.
+
+    Args:
+        boxes (np.ndarray): Caixas (N, 4) no formato x1, y1, x2, y2.
+
+    Retorna:
+        tuple: (sólidos, traços), arrays int32 (M, 2, 2) com os pontos inicial e final de cada segmento.
+    """
+    start, end = box_edges(np.asarray(boxes).reshape(-1, 4))
+    dist = np.linalg.norm(end - start, axis=1).astype(np.int64)
+    keep = dist > 0
+    start, end, dist = start[keep], end[keep], dist[keep]
+    direction = (end - start) / dist[:, None]
+
+    solid = np.concatenate([
+        np.stack([start, start + direction * solid_length], 1),
+        np.stack([end - direction * solid_length, end], 1),
+    ])
+
+    # Traço k começa em t = solid_length + k * (dash_length + gap_length) e é desenhado
+    # enquanto t < dist - solid_length - dash_length.
+    period = dash_length + gap_length
+    usable = dist - 2 * solid_length - dash_length
+    counts = np.where(usable > 0, -(-usable // period), 0)
+    edge = np.repeat(np.arange(len(dist)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = solid_length + k * period
+    dash_start = start[edge] + direction[edge] * t[:, None]
+    dashes = np.stack([dash_start, dash_start + direction[edge] * dash_length], 1)
+
+    return solid.astype(np.int32), dashes.astype(np.int32)
+
+
+class OverlayRenderer:
+    """
+    Desenha as anotações de EPI em um buffer reaproveitado entre frames.
+
+    Atributos:
+        thickness (int): Espessura das caixas das pessoas e das pontas sólidas; os traços usam a metade.
+        font_scale (float): Escala do texto dos rótulos.
+    Métodos:
+        render(frame, status, color=(0, 0, 255)):
+            Recebe o status no formato de lista ou como array Protocol.RESULT_DTYPE. Copia o frame para o buffer interno, desenha as anotações e retorna o buffer. O buffer é
+            sobrescrito na próxima chamada; quem precisar guardar a imagem deve copiá-la.
+    """
+    def __init__(self, thickness=10, font_scale=1.5):
+        self.thickness = thickness
+        self.font_scale = font_scale
+        self._buffer = None
+
+    def render(self, frame, status, color=VERMELHO):
+        if self._buffer is None or self._buffer.shape != frame.shape or self._buffer.dtype != frame.dtype:
+            self._buffer = np.empty_like(frame)
+        np.copyto(self._buffer, frame)
+        img = self._buffer
+
+        records = Protocol.as_records(status)
+        people = records['person']
+        missing_mask = records['status'] == Protocol.STATUS_NOT_USING
+        violators = missing_mask.any(axis=1)
+
+        # Caixas verdes primeiro, para que nenhuma anotação de violação fique escondida sob elas.
+        self._rectangles(img, people[~violators], VERDE)
+        if violators.any():
+            missing = records['no_use'][missing_mask]
+            labels = np.nonzero(missing_mask)[1]
+            solid, dashes = dashed_segments(missing)
+            cv2.polylines(img, list(solid), False, VERMELHO, self.thickness)
+            cv2.polylines(img, list(dashes), False, VERMELHO, self.thickness // 2)
+            for (x1, y1, _, _), i in zip(missing.tolist(), labels.tolist()):
+                cv2.putText(img, f'Nao Usando {Protocol.PPE_NAMES[i]}', (x1, y1 + 40), cv2.FONT_HERSHEY_SIMPLEX,
+                            fontScale=self.font_scale, color=color, thickness=2)
+
+        self._rectangles(img, people[violators], VERMELHO)
+        return img
+
+    def _rectangles(self, img, boxes, color):
+        # Equivalente a um cv2.rectangle por caixa (que também desenha um polígono fechado).
+        if len(boxes):
+            x1, y1, x2, y2 = boxes.T
+            corners = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1), np.stack([x2, y2], 1), np.stack([x1, y2], 1)], 1)
+            cv2.polylines(img, list(corners), True, color, self.thickness)
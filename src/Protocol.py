@@ -0,0 +1,638 @@
+import json
+import logging
+import socket
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+import SharedFrames
+
+"""
+Protocolo de transporte de frames entre RTSPStreamCapture e o servidor.
+
+Existem dois modos de conexão:
+
+    Legado:
+        Uma conexão TCP por frame. O cliente envia o tamanho do JPEG em 4 bytes (big-endian)
+        seguido dos dados; o servidor responde com o tamanho do JSON em 4 bytes seguido do JSON
+        e fecha a conexão.
+
+    Persistente:
+        O cliente abre uma única conexão e envia primeiro MAGIC seguido de uma mensagem de
+        apresentação (hello) em JSON. Depois disso, cada frame é enviado com um cabeçalho
+        FRAME_HEADER (seq, codificação, tamanho original, tamanho enviado, tamanho do payload)
+        e cada resposta volta com o mesmo número de sequência, o que permite manter vários
+        frames em trânsito ao mesmo tempo na mesma conexão.
+
+        Quando o cliente reduz o frame antes de enviá-lo, o servidor usa o tamanho original do
+        cabeçalho para devolver as caixas nas coordenadas do frame original.
+
+        Com cliente e servidor na mesma máquina, o hello pode oferecer um segmento de memória
+        compartilhada (ver SharedFrames); se o servidor aceitar, os frames vão nesse segmento e
+        o payload de cada frame ENCODING_SHM é apenas o índice da posição (4 bytes).
+
+        Se o cliente pedir ('load' no hello), cada resposta começa com LOAD_HEADER: os frames
+        aguardando inferência no servidor e o tempo, em ms, entre a chegada do frame e o envio da
+        resposta. O cliente usa essas medidas para ajustar a sua taxa de envio (ver Sampling).
+
+MAGIC ocupa os mesmos 4 bytes do tamanho no modo legado; interpretado como tamanho ele
+valeria mais de 1 GB, o que nunca acontece com um frame real, então o servidor consegue
+distinguir os dois modos lendo apenas os 4 primeiros bytes.
+"""
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EPI\x01'
+PROTOCOL_VERSION = 2
+
+# seq, codificação, largura e altura originais, largura e altura enviadas, tamanho do payload
+FRAME_HEADER = struct.Struct('>IBHHHHI')
+RESPONSE_HEADER = struct.Struct('>II')   # seq, tamanho da resposta
+LOAD_HEADER = struct.Struct('>If')       # frames aguardando inferência, tempo do frame no servidor (ms)
+LENGTH = struct.Struct('>I')
+
+# Limites padrão dos tamanhos anunciados pelo cliente: um frame BGR 4K sem compressão tem 24 MB.
+MAX_FRAME_BYTES = 64 << 20
+MAX_HELLO_BYTES = 64 << 10
+
+ENCODING_JPEG = 0
+ENCODING_PNG = 1
+ENCODING_RAW = 2   # BGR uint8 sem compressão, largura x altura x 3
+ENCODING_SHM = 3   # BGR uint8 em uma posição de SharedFrames.FrameRing; o payload é o índice da posição
+ENCODINGS = {'jpeg': ENCODING_JPEG, 'png': ENCODING_PNG, 'raw': ENCODING_RAW}
+
+# Nomes das categorias de EPI, na ordem em que aparecem no status de cada pessoa.
+PPE_NAMES = ['Capacete', 'Veste', 'Oculos', 'Luvas', 'Calcados']
+N_PPE = len(PPE_NAMES)
+
+# Status de uso de cada categoria. No JSON os mesmos valores aparecem como 'unknown', True e False.
+STATUS_UNKNOWN = 0
+STATUS_USING = 1
+STATUS_NOT_USING = 2
+STATUS_VALUES = {STATUS_UNKNOWN: 'unknown', STATUS_USING: True, STATUS_NOT_USING: False}
+
+# Formato binário das respostas: RESULT_HEADER seguido de `count` registros RESULT_DTYPE
+# (little-endian, sem alinhamento). Em 'has', o bit 0 indica que 'use' é válido e o bit 1 que
+# 'no_use' é válido; caixas ausentes são zeros. 'track' é o identificador da pessoa atribuído
+# pelo Tracker (0 quando a conexão não usa rastreamento) e 'events' tem o bit k ligado no frame
+# em que a categoria k passou a ser uma violação para aquela pessoa.
+RESULT_MAGIC = b'EPR'
+RESULT_VERSION = 2
+RESULT_HEADER = struct.Struct('<3sBI')   # magic, versão, quantidade de pessoas
+RESULT_DTYPE = np.dtype([
+    ('person', '<i4', (4,)),
+    ('status', 'u1', (N_PPE,)),
+    ('has', 'u1', (N_PPE,)),
+    ('use', '<i4', (N_PPE, 4)),
+    ('no_use', '<i4', (N_PPE, 4)),
+    ('track', '<u4'),
+    ('events', 'u1'),
+])
+RESULT_FORMATS = ('json', 'binary')
+
+
+class HandshakeError(ConnectionError):
+    """O servidor aceitou a conexão TCP mas não concluiu a apresentação do modo persistente (recusa, resposta inválida ou timeout)."""
+
+
+def recv_exact(sock, size):
+    """
+    Lê exatamente `size` bytes do socket em um buffer pré-alocado.
+
+    Args:
+        sock (socket.socket): Socket conectado.
+        size (int): Quantidade de bytes a ler.
+
+    Retorna:
+        bytearray: Dados lidos.
+
+    Levanta:
+        ConnectionError: Se a conexão for fechada antes de receber todos os bytes.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError(f"Conexão encerrada após {received} de {size} bytes")
+        received += n
+    return buffer
+
+
+def check_length(length, limit):
+    """Levanta ValueError se o tamanho anunciado de uma mensagem exceder `limit` (None ou 0: sem limite)."""
+    if limit and length > limit:
+        raise ValueError(f"Mensagem de {length} bytes excede o limite de {limit} bytes")
+
+
+def send_legacy(sock, payload):
+    """Envia um payload no formato legado (tamanho em 4 bytes + dados)."""
+    sock.sendall(LENGTH.pack(len(payload)))
+    sock.sendall(payload)
+
+
+def recv_legacy(sock, max_length=None):
+    """Recebe um payload no formato legado (tamanho em 4 bytes + dados), recusando tamanhos acima de `max_length`."""
+    length, = LENGTH.unpack(recv_exact(sock, LENGTH.size))
+    check_length(length, max_length)
+    return recv_exact(sock, length)
+
+
+def send_json(sock, obj):
+    """Envia um objeto JSON prefixado pelo seu tamanho."""
+    send_legacy(sock, json.dumps(obj).encode('utf-8'))
+
+
+def recv_json(sock, max_length=MAX_HELLO_BYTES):
+    """Recebe um objeto JSON prefixado pelo seu tamanho."""
+    return json.loads(recv_legacy(sock, max_length).decode('utf-8'))
+
+
+def send_message(sock, header, payload, *fields):
+    """Envia uma mensagem do modo persistente: cabeçalho (fields + tamanho do payload) e payload."""
+    sock.sendall(header.pack(*fields, len(payload)))
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock, header, max_length=None):
+    """
+    Recebe uma mensagem do modo persistente.
+
+    Retorna:
+        tuple: (fields, payload), onde fields são os campos do cabeçalho exceto o tamanho.
+
+    Levanta:
+        ValueError: Se o tamanho anunciado exceder `max_length`, antes de alocar o payload.
+    """
+    *fields, length = header.unpack(recv_exact(sock, header.size))
+    check_length(length, max_length)
+    return fields, recv_exact(sock, length)
+
+
+def resize_frame(frame, max_size=None):
+    """Reduz o frame, mantendo a proporção, até que o maior lado tenha no máximo `max_size` pixels."""
+    height, width = frame.shape[:2]
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def encode_frame(frame, encoding=ENCODING_JPEG, quality=95, max_size=None):
+    """
+    Reduz (opcionalmente) e codifica um frame para envio.
+
+    Args:
+        frame (np.ndarray): Frame BGR.
+        encoding (int): ENCODING_JPEG, ENCODING_PNG ou ENCODING_RAW.
+        quality (int): Qualidade JPEG (0-100).
+        max_size (int): Se informado, o frame é reduzido, mantendo a proporção, até que o maior
+            lado tenha no máximo `max_size` pixels (por exemplo, o tamanho de entrada do modelo).
+
+    Retorna:
+        tuple: (payload, (largura, altura) enviadas)
+    """
+    frame = resize_frame(frame, max_size)
+    height, width = frame.shape[:2]
+
+    if encoding == ENCODING_RAW:
+        payload = np.ascontiguousarray(frame).tobytes()
+    elif encoding == ENCODING_PNG:
+        payload = cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+    else:
+        payload = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+    return payload, (width, height)
+
+
+def decode_frame(payload, encoding=ENCODING_JPEG, width=0, height=0):
+    """
+    Decodifica um frame recebido.
+
+    Em ENCODING_SHM, `payload` é a referência retornada por SharedFrames.RingReader.reference e
+    o frame retornado aponta para a memória compartilhada do cliente (sem cópia).
+
+    Retorna:
+        np.ndarray: Frame BGR, ou None se os dados forem inválidos.
+    """
+    if encoding == ENCODING_SHM:
+        return SharedFrames.frame_at(payload, width, height)
+    data = np.frombuffer(payload, dtype=np.uint8)
+    if encoding == ENCODING_RAW:
+        if data.size != width * height * 3:
+            return None
+        return data.reshape(height, width, 3)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def status_to_records(status):
+    """
+    Converte um status no formato de lista (PPE.check / JSON) em um array RESULT_DTYPE.
+    """
+    records = np.zeros(len(status), dtype=RESULT_DTYPE)
+    for p, (person, ppe) in enumerate(status):
+        records['person'][p] = person
+        for k, (value, use, no_use) in enumerate(ppe):
+            if value is True:
+                records['status'][p, k] = STATUS_USING
+            elif value is False:
+                records['status'][p, k] = STATUS_NOT_USING
+            if use:
+                records['use'][p, k] = use
+                records['has'][p, k] |= 1
+            if no_use:
+                records['no_use'][p, k] = no_use
+                records['has'][p, k] |= 2
+    return records
+
+
+def assoc_to_records(assoc):
+    """
+    Converte a saída de PPE.associate em um array RESULT_DTYPE, sem passar pelo formato de lista.
+    """
+    has_use, has_no_use = assoc['has_use'], assoc['has_no_use']
+    records = np.zeros(len(assoc['person_box']), dtype=RESULT_DTYPE)
+    records['person'] = assoc['person_box']
+    records['status'] = assoc['status']
+    records['has'] = has_use.astype(np.uint8) | (has_no_use.astype(np.uint8) << 1)
+    records['use'] = np.where(has_use[..., None], assoc['use_box'], 0)
+    records['no_use'] = np.where(has_no_use[..., None], assoc['no_use_box'], 0)
+    return records
+
+
+def records_to_status(records):
+    """
+    Converte um array RESULT_DTYPE no formato de lista usado no JSON.
+    """
+    status = []
+    for person, codes, has, use, no_use in zip(records['person'].tolist(), records['status'].tolist(),
+                                               records['has'].tolist(), records['use'].tolist(), records['no_use'].tolist()):
+        status.append([person, [
+            (STATUS_VALUES[codes[k]], use[k] if has[k] & 1 else 0, no_use[k] if has[k] & 2 else 0)
+            for k in range(N_PPE)
+        ]])
+    return status
+
+
+def as_records(status):
+    """Retorna o status como array RESULT_DTYPE, convertendo-o se estiver no formato de lista ou de PPE.associate."""
+    if isinstance(status, np.ndarray):
+        return status
+    if isinstance(status, dict):
+        return assoc_to_records(status)
+    return status_to_records(status)
+
+
+def encode_results(status, result_format='json'):
+    """
+    Codifica o status de uma resposta.
+
+    Args:
+        status (list | np.ndarray): Status no formato de lista ou array RESULT_DTYPE.
+        result_format (str): 'json' ou 'binary'.
+
+    Retorna:
+        bytes: Resposta codificada.
+    """
+    if result_format == 'binary':
+        records = as_records(status)
+        return RESULT_HEADER.pack(RESULT_MAGIC, RESULT_VERSION, len(records)) + records.tobytes()
+    if isinstance(status, np.ndarray):
+        status = records_to_status(status)
+    return json.dumps(status).encode('utf-8')
+
+
+def decode_results(data, result_format='json'):
+    """
+    Decodifica uma resposta.
+
+    No formato binário, o array retornado é uma visão de `data` (sem cópia).
+
+    Retorna:
+        list | np.ndarray: Status no formato de lista (JSON) ou array RESULT_DTYPE (binário).
+    """
+    if result_format != 'binary':
+        return json.loads(bytes(data).decode('utf-8'))
+    magic, version, count = RESULT_HEADER.unpack_from(data)
+    if magic != RESULT_MAGIC or version != RESULT_VERSION:
+        raise ValueError(f"Resposta binária inválida (magic {magic!r}, versão {version})")
+    return np.frombuffer(data, dtype=RESULT_DTYPE, count=count, offset=RESULT_HEADER.size)
+
+
+def scale_status(status, sx, sy):
+    """
+    Converte as caixas de um status de um frame reduzido para o frame original.
+
+    Args:
+        status (list | np.ndarray): Status no formato de PPE.check ([caixa, [(status, caixa_usando, caixa_nao_usando), ...]]
+            por pessoa) ou array RESULT_DTYPE.
+        sx, sy (float): Razões largura_original/largura_enviada e altura_original/altura_enviada.
+    """
+    if isinstance(status, np.ndarray):
+        records = status.copy()
+        factor = np.array([sx, sy, sx, sy])
+        for field in ('person', 'use', 'no_use'):
+            records[field] = np.round(records[field] * factor)
+        return records
+
+    def scale(box):
+        if not box:
+            return box
+        x1, y1, x2, y2 = box
+        return [round(x1 * sx), round(y1 * sy), round(x2 * sx), round(y2 * sy)]
+
+    return [[scale(person), [(st, scale(use), scale(no_use)) for st, use, no_use in ppe]]
+            for person, ppe in status]
+
+
+def negotiate(hello):
+    """
+    Valida a apresentação (hello) de um cliente do modo persistente.
+
+    Campos reconhecidos no hello:
+        version (int): Deve ser PROTOCOL_VERSION.
+        camera (str): Identificação da câmera.
+        result (str): Formato das respostas, 'json' (padrão) ou 'binary'.
+        track (bool): Rastreia as pessoas entre os frames da conexão (ver Tracker). O status de
+            cada pessoa passa a ser o status suavizado da sua trilha. Só é aceito com result
+            'binary', o único formato que transporta a trilha e os eventos.
+        shm (dict): Segmento de memória compartilhada oferecido pelo cliente (SharedFrames.FrameRing.describe).
+            Não é validado aqui: o servidor tenta abri-lo com SharedFrames.attach e informa o
+            resultado no campo 'shm' da resposta.
+        load (bool): Cada resposta começa com LOAD_HEADER (carga do servidor).
+
+    Retorna:
+        dict: Resposta a enviar ao cliente; 'ok' indica se a conexão foi aceita.
+    """
+    if hello.get('version') != PROTOCOL_VERSION:
+        return {'ok': False, 'error': f"Versão de protocolo não suportada: {hello.get('version')}"}
+    result_format = hello.get('result', 'json')
+    if result_format not in RESULT_FORMATS:
+        return {'ok': False, 'error': f"Formato de resposta não suportado: {result_format}"}
+    return {'ok': True, 'version': PROTOCOL_VERSION, 'result': result_format, 'track': bool(hello.get('track')) and result_format == 'binary',
+            'load': bool(hello.get('load'))}
+
+
+class FrameClient:
+    """
+    Cliente do modo persistente.
+
+    Mantém uma única conexão aberta com o servidor e permite até `max_in_flight` frames
+    aguardando resposta ao mesmo tempo. As respostas são recebidas por uma thread própria e
+    entregues a `on_response(context, response)` na ordem em que chegam; `context` é o objeto
+    passado em `submit` (por exemplo, o frame original).
+
+    Se a conexão cair, os frames pendentes são descartados (on_response recebe None) e a
+    próxima chamada de `submit` reconecta. Depois de `close`, submit e submit_shared levantam
+    ConnectionError em vez de reconectar.
+
+    Com `shared_memory`, o primeiro frame enviado por `submit_shared` cria um
+    SharedFrames.FrameRing com o tamanho desse frame, oferecido ao servidor no hello. Cada posição
+    do segmento fica reservada até a resposta do frame chegar. Se a conexão cair com frames
+    pendentes no segmento, o servidor ou um worker ainda pode estar lendo essas posições; o
+    segmento é então abandonado e a reconexão oferece um novo FrameRing, com outro token.
+
+    Se o servidor aceitar 'load' no hello, o LOAD_HEADER de cada resposta é retirado antes de
+    on_response e fica em `load` durante a chamada.
+
+    Atributos:
+        host (str): Endereço do servidor.
+        port (int): Porta do servidor.
+        on_response (callable): Função chamada com (context, response) para cada resposta.
+        max_in_flight (int): Número máximo de frames aguardando resposta.
+        hello (dict): Campos extras enviados na apresentação.
+        timeout (float): Tempo máximo, em segundos, para conectar e concluir a apresentação.
+        shared_memory (bool): Oferece ao servidor o envio dos frames por memória compartilhada.
+        ring (SharedFrames.FrameRing): Segmento de memória compartilhada, criado no primeiro submit_shared.
+        load (tuple): (frames aguardando inferência, tempo do frame no servidor em ms) da última resposta, ou None.
+    """
+    def __init__(self, host, port, on_response, max_in_flight=4, hello=None, timeout=5.0, shared_memory=False):
+        self.host = host
+        self.port = port
+        self.on_response = on_response
+        self.max_in_flight = max_in_flight
+        self.hello = hello or {}
+        self.timeout = timeout
+        self.shared_memory = shared_memory
+        self.ring = None
+        self.server_hello = None
+        self.load = None
+
+        self._sock = None
+        self._seq = 0
+        self._pending = {}
+        self._slots = threading.Semaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._receiver = None
+        self._closed = False
+        self._ring_stale = False
+
+    def connect(self):
+        """
+        Abre a conexão e realiza a apresentação.
+
+        Levanta:
+            HandshakeError: Se o servidor recusar a apresentação, responder algo que não é uma
+                apresentação ou não responder dentro de `timeout` (por exemplo, um servidor antigo
+                que só entende o modo legado).
+            OSError: Em falhas de rede ao conectar ou ao enviar a apresentação (por exemplo, o
+                servidor ainda não está no ar); são transitórias.
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(MAGIC)
+            hello = {'version': PROTOCOL_VERSION, **self.hello}
+            if self.ring is not None:
+                hello['shm'] = self.ring.describe()
+            send_json(sock, hello)
+            try:
+                reply = recv_json(sock)
+            except socket.timeout as e:
+                raise HandshakeError(f"Servidor não respondeu à apresentação em {self.timeout}s") from e
+            except (ConnectionError, ValueError) as e:
+                # Um servidor legado lê MAGIC como o tamanho de um frame e fecha ou responde outra coisa.
+                raise HandshakeError(f"Resposta inválida à apresentação: {e}") from e
+            if not isinstance(reply, dict) or not reply.get('ok'):
+                raise HandshakeError(f"Servidor recusou a conexão: {reply.get('error') if isinstance(reply, dict) else reply}")
+            sock.settimeout(None)
+        except BaseException:
+            sock.close()
+            raise
+
+        self.server_hello = reply
+        self._sock = sock
+        self._receiver = threading.Thread(target=self._receive_loop, args=(sock,), daemon=True)
+        self._receiver.start()
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    @property
+    def in_flight(self):
+        """Frames enviados e ainda sem resposta."""
+        return len(self._pending)
+
+    def submit(self, payload, context=None, encoding=ENCODING_JPEG, original_size=(0, 0), size=(0, 0)):
+        """
+        Envia um payload ao servidor sem aguardar a resposta.
+
+        Bloqueia enquanto houver `max_in_flight` frames pendentes.
+
+        Args:
+            payload (bytes): Dados do frame codificado.
+            context: Objeto repassado a `on_response` junto com a resposta.
+            encoding (int): Codificação do payload (ENCODING_*).
+            original_size (tuple): (largura, altura) do frame capturado.
+            size (tuple): (largura, altura) do frame enviado. Se diferente de original_size, o
+                servidor devolve as caixas nas coordenadas de original_size.
+
+        Retorna:
+            int: Número de sequência atribuído ao frame.
+        """
+        return self._submit(payload, context, encoding, original_size, size)
+
+    def submit_shared(self, frame, context=None, original_size=(0, 0)):
+        """
+        Envia um frame BGR (já reduzido) pela memória compartilhada, sem codificá-lo.
+
+        Args:
+            frame (np.ndarray): Frame a enviar; o tamanho enviado é o do próprio frame.
+            context, original_size: Como em `submit`.
+
+        Retorna:
+            int | None: Número de sequência, ou None se o frame não foi enviado porque o servidor
+                não aceitou a memória compartilhada, o frame é maior que as posições do segmento
+                ou não há posição livre. Nesse caso o frame deve ser enviado codificado, por `submit`.
+        """
+        with self._send_lock:
+            self._check_open()
+            if self._sock is None:
+                self._retire_ring()
+                if self.shared_memory and self.ring is None:
+                    self.ring = SharedFrames.FrameRing(self.max_in_flight + 2, frame.nbytes)
+                self.connect()
+            # A escrita fica sob _send_lock para que close não remova o segmento durante a cópia.
+            if not self.server_hello.get('shm') or frame.nbytes > self.ring.slot_size:
+                return None
+            slot = self.ring.acquire()
+            if slot is None:
+                return None
+            try:
+                self.ring.write(slot, frame)
+                payload = LENGTH.pack(slot)
+            except BaseException:
+                self.ring.release(slot)
+                raise
+            ring = self.ring
+        return self._submit(payload, context, ENCODING_SHM, original_size, (frame.shape[1], frame.shape[0]), (ring, slot))
+
+    def _submit(self, payload, context, encoding, original_size, size, ring_slot=None):
+        self._slots.acquire()
+        registered = False
+        try:
+            with self._send_lock:
+                self._check_open()
+                if self._sock is None:
+                    self._retire_ring()
+                    self.connect()
+                with self._lock:
+                    sock = self._sock
+                    if sock is None:
+                        raise ConnectionError("Conexão encerrada pelo servidor")
+                    seq = self._seq
+                    self._seq = (seq + 1) & 0xFFFFFFFF
+                    self._pending[seq] = (context, ring_slot)
+                    registered = True
+                send_message(sock, FRAME_HEADER, payload, seq, encoding, *original_size, *size)
+        except BaseException:
+            if registered:
+                self._disconnect(sock)
+            else:
+                self._slots.release()
+                self._release(ring_slot)
+            raise
+        return seq
+
+    def _check_open(self):
+        if self._closed:
+            raise ConnectionError("Cliente encerrado")
+
+    def close(self):
+        """
+        Fecha a conexão e remove o segmento de memória compartilhada, se houver.
+
+        Um submit bloqueado esperando posição é liberado e, como os seguintes, levanta ConnectionError.
+        """
+        self._closed = True
+        self._disconnect()
+        with self._send_lock:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+    def _release(self, ring_slot):
+        # ring_slot é (ring, posição); posições de um segmento já abandonado não são devolvidas.
+        if ring_slot is not None and ring_slot[0] is self.ring:
+            ring_slot[0].release(ring_slot[1])
+
+    def _retire_ring(self):
+        # Chamado sob _send_lock antes de reconectar: nenhuma escrita no segmento está em andamento.
+        if self._ring_stale:
+            self._ring_stale = False
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+    def _receive_loop(self, sock):
+        load = bool(self.server_hello.get('load'))
+        try:
+            while True:
+                (seq,), response = recv_message(sock, RESPONSE_HEADER)
+                if load and len(response) >= LOAD_HEADER.size:
+                    self.load = LOAD_HEADER.unpack_from(response)
+                    response = memoryview(response)[LOAD_HEADER.size:]
+                with self._lock:
+                    if seq not in self._pending:
+                        continue
+                    context, ring_slot = self._pending.pop(seq)
+                self._release(ring_slot)
+                self._slots.release()
+                try:
+                    self.on_response(context, response)
+                except Exception as e:
+                    logger.exception("Erro ao tratar resposta %d: %s", seq, e)
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            self._disconnect(sock)
+
+    def _disconnect(self, sock=None):
+        with self._lock:
+            if self._sock is None or (sock is not None and sock is not self._sock):
+                return
+            sock = self._sock
+            self._sock = None
+            pending = list(self._pending.values())
+            self._pending.clear()
+            # O servidor pode ainda estar lendo as posições pendentes; em vez de devolvê-las, o
+            # segmento inteiro é trocado na próxima conexão.
+            if any(ring_slot is not None for _, ring_slot in pending):
+                self._ring_stale = True
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        for context, ring_slot in pending:
+            self._slots.release()
+            try:
+                self.on_response(context, None)
+            except Exception as e:
+                logger.exception("Erro ao descartar frame pendente: %s", e)
@@ -0,0 +1,159 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import Protocol
+from Metrics import REGISTRY
+
+"""
+Cache de resultados do servidor para frames repetidos.
+
+Streams congelados, vídeos em loop e câmeras paradas entregam a mesma imagem muitas vezes; com o
+cache, só a primeira cópia passa pela inferência e as demais recebem o resultado guardado.
+
+A chave é calculada a partir do frame recebido:
+    'exact': hash (BLAKE2b) do payload codificado. Só frames idênticos byte a byte coincidem.
+        Frames sem compressão (Protocol.ENCODING_RAW e ENCODING_SHM) não passam pelo cache neste
+        modo: o hash de um frame BGR 4K (24 MB) custaria dezenas de ms por frame, mais que o que
+        o transporte sem cópia economiza.
+    'perceptual': miniatura em tons de cinza (32x18) do frame decodificado. Um frame coincide
+        com uma entrada se a diferença média entre as miniaturas for de no máximo `tolerance`
+        níveis de cinza, o que também aproveita a mesma imagem recodificada com pequenas
+        diferenças de compressão, ao custo de decodificar o frame antes de consultar o cache (no
+        modo com workers, essa decodificação acontece no processo do servidor) e de comparar a
+        miniatura com as entradas guardadas.
+
+As entradas expiram após `ttl` segundos e as menos usadas recentemente são descartadas ao
+ultrapassar `max_entries` ou `max_bytes` (tamanho estimado dos resultados).
+"""
+
+HITS = REGISTRY.counter('epi_server_cache_hits_total', "Frames respondidos pelo cache de resultados")
+MISSES = REGISTRY.counter('epi_server_cache_misses_total', "Frames que passaram pela inferência por não estarem no cache")
+
+MODES = ('exact', 'perceptual')
+THUMBNAIL = (32, 18)   # largura, altura da miniatura do modo 'perceptual'
+
+
+def result_size(result):
+    """Estimativa, em bytes, da memória ocupada por um resultado (status em lista ou saída de PPE.associate)."""
+    if isinstance(result, dict):
+        return sum(value.nbytes for value in result.values() if isinstance(value, np.ndarray)) + 256
+    if isinstance(result, np.ndarray):
+        return result.nbytes + 128
+    return 128 + 256 * len(result)
+
+
+class ResultCache:
+    """
+    Cache LRU de resultados de inferência, com expiração e limite de memória.
+
+    Atributos:
+        max_entries (int): Máximo de resultados guardados.
+        ttl (float): Tempo, em segundos, durante o qual um resultado pode ser reaproveitado.
+        max_bytes (int): Limite do tamanho estimado de todos os resultados guardados.
+        mode (str): 'exact' ou 'perceptual' (ver o início do módulo).
+        tolerance (float): Diferença média máxima entre miniaturas no modo 'perceptual'.
+        hits (int), misses (int): Consultas atendidas e não atendidas pelo cache.
+    Métodos:
+        cacheable(encoding):
+            True se frames com essa codificação passam pelo cache (no modo 'exact', apenas JPEG e PNG).
+        needs_frame(encoding):
+            True se a chave depende do frame decodificado (modo 'perceptual').
+        key(frame_data, encoding, width, height, detailed, frame=None):
+            Calcula a chave de um frame recebido; `frame` é o frame decodificado, obrigatório quando needs_frame.
+        get(key):
+            Retorna o resultado guardado, ou None.
+        put(key, result):
+            Guarda um resultado.
+        stats():
+            Retorna os contadores e a ocupação do cache.
+    """
+    def __init__(self, max_entries=1024, ttl=10.0, max_bytes=64 * 1024 * 1024, mode='exact', tolerance=2.0):
+        if mode not in MODES:
+            raise ValueError(f"Modo de cache desconhecido: {mode} (use {', '.join(MODES)})")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        REGISTRY.gauge('epi_server_cache_entries', "Resultados guardados no cache", fn=lambda: len(self._entries))
+        REGISTRY.gauge('epi_server_cache_bytes', "Tamanho estimado dos resultados guardados no cache", fn=lambda: self.bytes)
+
+    def cacheable(self, encoding):
+        return self.mode == 'perceptual' or encoding not in (Protocol.ENCODING_RAW, Protocol.ENCODING_SHM)
+
+    def needs_frame(self, encoding):
+        return self.mode == 'perceptual'
+
+    def key(self, frame_data, encoding, width, height, detailed, frame=None):
+        if self.mode == 'perceptual':
+            small = cv2.resize(frame, THUMBNAIL, interpolation=cv2.INTER_AREA)
+            if small.ndim == 3:
+                small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            return small.tobytes(), bool(detailed), frame.shape[:2]
+        digest = hashlib.blake2b(frame_data, digest_size=16)
+        digest.update(f'{encoding}:{width}x{height}'.encode())
+        return digest.digest(), bool(detailed)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.mode == 'perceptual':
+                key = self._nearest(key)
+                entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                HITS.inc()
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            MISSES.inc()
+            return None
+
+    def _nearest(self, key):
+        thumbnail, detailed, shape = key
+        candidates = [k for k in self._entries if k[1] == detailed and k[2] == shape]
+        if not candidates:
+            return None
+        thumbnails = np.frombuffer(b''.join(k[0] for k in candidates), dtype=np.uint8).reshape(len(candidates), -1)
+        diff = np.abs(thumbnails.astype(np.int16) - np.frombuffer(thumbnail, dtype=np.uint8)).mean(axis=1)
+        best = int(diff.argmin())
+        return candidates[best] if diff[best] <= self.tolerance else None
+
+    def put(self, key, result):
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), result, size)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
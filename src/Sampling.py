@@ -0,0 +1,147 @@
+import threading
+import time
+
+"""
+Taxa de amostragem adaptativa por câmera.
+
+Com um `capture_interval` fixo, um servidor saturado acumula frames e a latência cresce sem
+limite, enquanto uma câmera com uma violação em andamento é amostrada tão devagar quanto uma
+câmera vazia. O AdaptiveSampler ajusta o intervalo de cada câmera a partir de:
+
+    Carga: o tempo de ida e volta de cada frame e, se o servidor informar (campo 'load' do
+        hello, ver Protocol.negotiate), a quantidade de frames aguardando inferência.
+    Cena: se a última resposta tinha pessoas ou violações de EPI.
+
+O intervalo desejado depende da cena: `min_interval` enquanto houver violação (e por `hold`
+segundos depois), `base_interval` com pessoas e `idle_interval` com a cena vazia. Sem
+congestionamento, o intervalo se aproxima do desejado aos poucos (multiplicado por `recovery`
+a cada ajuste), exceto quando a cena acaba de ficar mais importante (pessoas ou violação
+surgindo), em que passa direto ao desejado; se a latência passar de `target_latency_ms` ou a fila do servidor passar de
+`max_queue`, o intervalo é multiplicado por `backoff` (por apenas sqrt(backoff) em câmeras com
+violação, que assim mantêm a prioridade sobre as demais). O intervalo fica sempre entre
+`min_interval` e `max_interval` e é ajustado no máximo uma vez por intervalo, para que as
+várias respostas em trânsito de um mesmo período não se acumulem no ajuste.
+"""
+
+IDLE, PEOPLE, VIOLATION = 'idle', 'people', 'violation'
+
+
+class AdaptiveSampler:
+    """
+    Calcula o intervalo de amostragem de uma câmera.
+
+    Atributos:
+        base_interval (float): Intervalo, em segundos, com pessoas na cena (normalmente o capture_interval da câmera).
+        min_interval (float): Intervalo com violação na cena; também o menor intervalo possível.
+        max_interval (float): Maior intervalo possível, atingido apenas com o servidor congestionado.
+        idle_interval (float): Intervalo com a cena vazia. Padrão: o dobro de base_interval.
+        target_latency_ms (float): Tempo de ida e volta máximo desejado.
+        max_queue (int): Frames aguardando inferência no servidor acima dos quais ele é considerado congestionado. None ignora a fila.
+        hold (float): Tempo, em segundos, durante o qual pessoas ou violações vistas continuam valendo.
+        backoff (float): Fator de aumento do intervalo com o servidor congestionado.
+        recovery (float): Fator de redução do intervalo, sem congestionamento, até o desejado.
+        smoothing (float): Peso de cada nova medida na média móvel da latência.
+        interval (float): Intervalo atual.
+        latency_ms (float): Média móvel do tempo de ida e volta.
+        queue_depth (int): Última fila informada pelo servidor.
+    Métodos:
+        observe(round_trip_ms, queue_depth=None):
+            Registra a resposta de um frame e reajusta o intervalo.
+        observe_failure():
+            Registra um frame sem resposta (erro ou conexão perdida), tratado como congestionamento.
+        observe_scene(people, violations):
+            Registra a quantidade de pessoas e de pessoas com violação da última resposta.
+        state(now=None):
+            'violation', 'people' ou 'idle'.
+        stats():
+            Retorna o intervalo, a latência média, a fila e o estado.
+    """
+    def __init__(self, base_interval=1.0, min_interval=0.2, max_interval=10.0, idle_interval=None, target_latency_ms=500.0,
+                 max_queue=16, hold=10.0, backoff=1.5, recovery=0.9, smoothing=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.base_interval = self._clamp(base_interval)
+        self.idle_interval = self._clamp(idle_interval if idle_interval is not None else 2 * base_interval)
+        self.target_latency_ms = target_latency_ms
+        self.max_queue = max_queue
+        self.hold = hold
+        self.backoff = backoff
+        self.recovery = recovery
+        self.smoothing = smoothing
+        self.interval = self.base_interval
+        self.latency_ms = None
+        self.queue_depth = 0
+        self._last_people = None
+        self._last_violation = None
+        self._adjusted = None
+        self._escalated = False
+        self._lock = threading.Lock()
+
+    def _clamp(self, interval):
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def state(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self._last_violation is not None and now - self._last_violation <= self.hold:
+            return VIOLATION
+        if self._last_people is not None and now - self._last_people <= self.hold:
+            return PEOPLE
+        return IDLE
+
+    def observe_scene(self, people, violations):
+        now = time.monotonic()
+        escalated = (violations and self.state(now) != VIOLATION) or (people and self.state(now) == IDLE)
+        if people:
+            self._last_people = now
+        if violations:
+            self._last_violation = now
+        if escalated:
+            # A cena ficou mais importante: o próximo ajuste não espera o intervalo atual e vai direto ao desejado.
+            self._adjusted = None
+            self._escalated = True
+
+    def observe(self, round_trip_ms, queue_depth=None):
+        with self._lock:
+            if self.latency_ms is None:
+                self.latency_ms = round_trip_ms
+            else:
+                self.latency_ms += self.smoothing * (round_trip_ms - self.latency_ms)
+            if queue_depth is not None:
+                self.queue_depth = queue_depth
+            congested = self.latency_ms > self.target_latency_ms or (
+                self.max_queue is not None and queue_depth is not None and queue_depth > self.max_queue)
+            self._adjust(congested)
+
+    def observe_failure(self):
+        with self._lock:
+            self._adjust(True)
+
+    def _adjust(self, congested):
+        now = time.monotonic()
+        # 0.9: tolera respostas que chegam um pouco antes de completar o intervalo.
+        if self._adjusted is not None and now - self._adjusted < 0.9 * self.interval:
+            return
+        self._adjusted = now
+        escalated, self._escalated = self._escalated, False
+        state = self.state(now)
+        desired = {VIOLATION: self.min_interval, PEOPLE: self.base_interval, IDLE: self.idle_interval}[state]
+        if congested:
+            interval = self.interval * (self.backoff ** 0.5 if state == VIOLATION else self.backoff)
+        elif self.interval > desired and escalated:
+            interval = desired
+        elif self.interval > desired:
+            # Só acelera com folga em relação ao alvo, para não oscilar em torno dele.
+            if self.latency_ms is not None and self.latency_ms > 0.8 * self.target_latency_ms:
+                return
+            interval = max(desired, self.interval * self.recovery)
+        else:
+            interval = desired
+        self.interval = self._clamp(interval)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'latency_ms': self.latency_ms,
+            'queue': self.queue_depth,
+            'state': self.state(),
+        }
@@ -0,0 +1,180 @@
+import secrets
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+"""
+Transporte de frames por memória compartilhada, para cliente e servidor na mesma máquina.
+
+O cliente cria um FrameRing: um segmento de memória compartilhada dividido em `slots` posições
+de `slot_size` bytes, precedidas por um token aleatório. Na apresentação (hello) o cliente
+informa o nome do segmento, o tamanho das posições e o token; o servidor abre o segmento e só
+aceita o modo se ler o mesmo token, o que garante que os dois processos estão na mesma máquina.
+
+A partir daí cada frame é copiado, em BGR sem compressão, para uma posição livre e apenas o
+índice da posição vai pelo socket (Protocol.ENCODING_SHM). O servidor, ou o worker de
+inferência, lê o frame como um np.ndarray apontando para a memória compartilhada, sem cópia e
+sem decodificação. A posição só é liberada quando a resposta do frame chega (ou a conexão
+cai); como o servidor só responde depois da inferência, o cliente nunca sobrescreve um frame
+ainda em uso.
+"""
+
+TOKEN_SIZE = 16
+# Segmentos mantidos abertos por processo (servidor ou worker); os mais antigos são fechados.
+MAX_ATTACHED = 64
+
+
+class FrameRing:
+    """
+    Segmento de memória compartilhada do cliente, dividido em posições de tamanho fixo.
+
+    Atributos:
+        slots (int): Quantidade de posições (frames em trânsito ao mesmo tempo).
+        slot_size (int): Tamanho de cada posição, em bytes: o maior frame (largura x altura x 3) aceito.
+        name (str): Nome do segmento, informado ao servidor.
+    Métodos:
+        acquire():
+            Reserva uma posição livre e retorna o seu índice, ou None se todas estiverem em uso.
+        write(slot, frame):
+            Copia um frame BGR uint8 para a posição.
+        release(slot):
+            Libera a posição (chamadas repetidas são ignoradas).
+        describe():
+            Retorna a descrição do segmento enviada no hello.
+        close():
+            Fecha e remove o segmento.
+    """
+    def __init__(self, slots, slot_size):
+        self.slots = int(slots)
+        self.slot_size = int(slot_size)
+        self.token = secrets.token_bytes(TOKEN_SIZE)
+        size = TOKEN_SIZE + self.slots * self.slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self._shm.name
+        self._buffer = np.ndarray(size, dtype=np.uint8, buffer=self._shm.buf)
+        self._buffer[:TOKEN_SIZE] = np.frombuffer(self.token, dtype=np.uint8)
+        self._free = set(range(self.slots))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            return self._free.pop() if self._free else None
+
+    def release(self, slot):
+        with self._lock:
+            self._free.add(slot)
+
+    def write(self, slot, frame):
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_size:
+            raise ValueError(f"Frame {frame.shape} {frame.dtype} não cabe em uma posição de {self.slot_size} bytes")
+        offset = TOKEN_SIZE + slot * self.slot_size
+        self._buffer[offset:offset + frame.nbytes].reshape(frame.shape)[...] = frame
+
+    def describe(self):
+        return {'name': self.name, 'slots': self.slots, 'slot_size': self.slot_size, 'token': self.token.hex()}
+
+    def close(self):
+        if self._shm is None:
+            return
+        del self._buffer
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+class RingReader:
+    """
+    Lado do servidor de um FrameRing aceito em uma conexão.
+
+    Métodos:
+        reference(payload):
+            Converte o payload de um frame Protocol.ENCODING_SHM (índice da posição) na referência
+            (nome, offset, tamanho) aceita por frame_at, que pode ser enviada a um worker.
+    """
+    def __init__(self, name, slots, slot_size):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+
+    def reference(self, payload):
+        slot = int.from_bytes(bytes(payload[:4]), 'big') if len(payload) == 4 else -1
+        if not 0 <= slot < self.slots:
+            raise ValueError(f"Posição de memória compartilhada inválida: {slot}")
+        return self.name, TOKEN_SIZE + slot * self.slot_size, self.slot_size
+
+
+_attached = OrderedDict()
+_attached_lock = threading.Lock()
+
+
+def _open(name):
+    """Abre (ou reaproveita) um segmento pelo nome, sem registrá-lo para remoção ao fim do processo."""
+    with _attached_lock:
+        if name in _attached:
+            _attached.move_to_end(name)
+            return _attached[name]
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:   # Python < 3.13: o segmento é do cliente, não deve ser removido por este processo
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        _attached[name] = shm
+        while len(_attached) > MAX_ATTACHED:
+            _close(_attached.popitem(last=False)[1])
+        return shm
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass   # ainda há frames apontando para o segmento; é liberado quando forem descartados
+
+
+def attach(description):
+    """
+    Abre o segmento descrito no hello de um cliente.
+
+    Retorna:
+        RingReader: Ou None se a descrição for inválida, o segmento não existir (cliente em outra
+            máquina) ou o token não conferir.
+    """
+    if not isinstance(description, dict):
+        return None
+    try:
+        name, slots, slot_size = str(description['name']), int(description['slots']), int(description['slot_size'])
+        token = bytes.fromhex(description['token'])
+        shm = _open(name)
+    except (KeyError, TypeError, ValueError, OSError):
+        return None
+    if slots <= 0 or slot_size <= 0 or shm.size < TOKEN_SIZE + slots * slot_size or bytes(shm.buf[:TOKEN_SIZE]) != token:
+        detach(name)
+        return None
+    return RingReader(name, slots, slot_size)
+
+
+def detach(name):
+    """Fecha o segmento neste processo (ao fim da conexão que o abriu)."""
+    with _attached_lock:
+        shm = _attached.pop(name, None)
+    if shm is not None:
+        _close(shm)
+
+
+def frame_at(reference, width, height):
+    """
+    Retorna o frame de uma posição como np.ndarray (altura, largura, 3) apontando para a memória
+    compartilhada, ou None se o tamanho informado não couber na posição ou o segmento não existir
+    mais (cliente encerrado).
+    """
+    name, offset, slot_size = reference
+    size = width * height * 3
+    if size <= 0 or size > slot_size:
+        return None
+    try:
+        shm = _open(name)
+    except OSError:
+        return None
+    return np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf, offset=offset)
@@ -1,217 +1,475 @@
+import logging
 import socket
 import cv2
 import numpy as np
 import threading
 import time
-import requests
 import json
 import os
 from pathlib import Path
 
+import Protocol
+from Metrics import REGISTRY
+from Occurrences import OccurrenceWriter
+from Overlay import OverlayRenderer
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureMetrics:
+    """Métricas de uma câmera, registradas em Metrics.REGISTRY com o rótulo camera."""
+    def __init__(self, camera):
+        self.sent = REGISTRY.counter('epi_client_frames_sent_total', "Frames enviados ao servidor", camera=camera)
+        self.skipped = REGISTRY.counter('epi_client_frames_skipped_total', "Frames descartados pelo MotionGate", camera=camera)
+        self.responses = REGISTRY.counter('epi_client_responses_total', "Respostas recebidas do servidor", camera=camera)
+        self.bytes_out = REGISTRY.counter('epi_client_bytes_out_total', "Bytes de frames enviados", camera=camera)
+        self.bytes_in = REGISTRY.counter('epi_client_bytes_in_total', "Bytes de respostas recebidas", camera=camera)
+        self.encode_ms = REGISTRY.histogram('epi_client_encode_ms', "Tempo de codificação de um frame, em ms", camera=camera)
+        self.round_trip_ms = REGISTRY.histogram('epi_client_round_trip_ms', "Tempo entre o envio de um frame e a resposta, em ms", camera=camera)
+        self.annotate_ms = REGISTRY.histogram('epi_client_annotate_ms', "Tempo de desenho das anotações, em ms", camera=camera)
+        self.send_errors = REGISTRY.counter('epi_client_errors_total', "Erros no envio de frames e no tratamento das respostas", camera=camera, stage='send')
+        self.response_errors = REGISTRY.counter('epi_client_errors_total', "Erros no envio de frames e no tratamento das respostas", camera=camera, stage='response')
+
 class RTSPStreamCapture:
     """
     Classe RTSPStreamCapture
     Esta classe é responsável por capturar frames de um stream RTSP, enviar esses frames para um servidor via socket TCP, receber respostas do servidor (como detecções de EPI), desenhar anotações nos frames conforme as respostas e, opcionalmente, enviar mensagens de teste via Telegram.
     Atributos:
         rtsp_url (str): URL do stream RTSP de onde os frames serão capturados.
-        telegran (list): Lista de IDs de chat do Telegram para envio de notificações.
+        telegran (list): Lista de IDs de chat do Telegram para envio de notificações. Se vazia, são usados os chats padrão do AlertDispatcher.
         host (str): Endereço do host do servidor para onde os frames serão enviados.
         port (int): Porta do servidor para envio dos frames.
         capture_interval (float): Intervalo em segundos entre capturas de frames.
+        sampling (Sampling.AdaptiveSampler): Se informado, substitui o intervalo fixo: o intervalo passa a ser ajustado pela latência das respostas, pela fila de inferência informada pelo servidor e pela presença de pessoas e violações na cena (ver Sampling). O capture_interval deve ser o base_interval do AdaptiveSampler.
+        interval (float): Intervalo atual entre capturas (do AdaptiveSampler, se houver, ou capture_interval).
+        persistent (bool): Usa uma única conexão com vários frames em trânsito (modo persistente). Se o servidor não aceitar, volta ao modo legado (uma conexão por frame).
+        max_in_flight (int): Número máximo de frames aguardando resposta no modo persistente.
+        latest_frame (bool): Se True, o stream é lido continuamente e, a cada intervalo, é enviado o frame mais recente, sem acumular atraso. Se False, apenas um frame a cada intervalo é decodificado; os demais são só demultiplexados (grab).
+        max_size (int): Se informado, o frame é reduzido, mantendo a proporção, até que o maior lado tenha no máximo `max_size` pixels antes de ser codificado (por exemplo, 640, o tamanho de entrada do modelo). As caixas da resposta continuam nas coordenadas do frame original.
+        encoding (str): Codificação usada no envio: 'jpeg', 'png' ou 'raw' (sem compressão, apenas no modo persistente).
+        shared_memory (bool): Com o servidor na mesma máquina, envia os frames (já reduzidos por max_size) por memória compartilhada, sem codificação (ver SharedFrames). Se o servidor não aceitar, ou um frame não couber no segmento, usa `encoding`.
+        jpeg_quality (int): Qualidade da codificação JPEG (0-100).
+        result_format (str): Formato das respostas no modo persistente: 'binary' (registros Protocol.RESULT_DTYPE, decodificados sem cópia) ou 'json'. O modo legado sempre usa JSON.
+        track (bool): Pede ao servidor o rastreamento das pessoas (ver Tracker). Com rastreamento, o status de cada pessoa é suavizado entre frames e uma ocorrência só é gravada no frame em que uma violação começa.
+        motion (MotionGate): Se informado, cada frame amostrado só é enviado ao servidor se houver movimento em relação ao último frame enviado (ou se o heartbeat do MotionGate vencer). Os frames descartados não são codificados.
+        metrics (CaptureMetrics): Contadores e histogramas da câmera (frames enviados e descartados, bytes, tempos de codificação, ida e volta e anotação, erros), expostos por Metrics.start_http_server.
+        alerts (Alerts.AlertDispatcher): Se informado, cada ocorrência gravada também é enviada como alerta ao Telegram, em segundo plano e agrupada por chat (ver Alerts). Pode ser compartilhado entre câmeras e não é encerrado por stop().
+        occurrences (OccurrenceWriter): Grava em segundo plano os frames anotados com violação. Se não for informado, é criado um OccurrenceWriter padrão em './ocorrencias' para a câmera. Um OccurrenceWriter informado pode ser compartilhado entre câmeras e não é encerrado por stop().
+        name (str): Identificação da câmera (hello, métricas e metadados das ocorrências). Padrão: a própria URL.
+        executor (concurrent.futures.Executor): Se informado, a codificação e o envio de cada frame rodam no executor (compartilhado entre câmeras por CaptureManager) enquanto a thread de captura continua lendo o stream. No máximo um frame por câmera fica no executor; frames amostrados enquanto o anterior ainda não foi enviado são descartados (busy_frames).
+        reconnect_delay (float): Espera inicial, em segundos, antes de reabrir um stream que falhou. Dobra a cada falha seguida, até max_reconnect_delay.
+        max_reconnect_delay (float): Espera máxima entre tentativas de reconexão.
+        reconnects (int): Quantidade de vezes que o stream foi reaberto.
+        grabbed_frames (int): Frames lidos do stream (decodificados ou não).
+        decoded_frames (int): Frames efetivamente decodificados.
         capture_thread (threading.Thread): Thread responsável pela captura e envio dos frames.
         running (bool): Indica se a captura está ativa.
     Métodos:
         start():
-            Inicia a thread de captura e envio dos frames.
+            Inicia a thread de captura e envio dos frames. Se o stream não abrir ou parar de entregar frames, ele é reaberto com espera exponencial.
         stop():
-            Para a thread de captura e aguarda sua finalização.
+            Para a thread de captura, aguarda sua finalização e remove as métricas da câmera de Metrics.REGISTRY.
         capture_and_send():
-            Realiza a captura de um frame a cada intevalo(capture_inteval) do stream RTSP  e envia o servidor, aguardando e processando a resposta.
+            Realiza a captura de um frame a cada intevalo(capture_inteval) do stream RTSP  e envia o servidor, aguardando e processando a resposta. Apenas os frames enviados são decodificados.
+        decoded_fps():
+            Retorna a taxa de frames decodificados por segundo desde o início da captura.
+        stats():
+            Retorna os contadores da câmera: frames lidos, decodificados, enviados e descartados pelo MotionGate, e o intervalo atual.
         send_frame(frame):
-            Envia um frame para o servidor via socket TCP, recebe a resposta (por exemplo, detecções de EPI) e chama o método de anotação dos frames.
+            Envia um frame para o servidor via socket TCP. No modo legado aguarda a resposta (por exemplo, detecções de EPI) e chama o método de anotação dos frames; no modo persistente a resposta é tratada por handle_response quando chegar.
+        handle_response(frame, response):
+            Decodifica a resposta do servidor e chama o método de anotação do frame correspondente.
         draw_boxes(frame, boxes, color=(0, 0, 255)):
-            Desenha caixas delimitadoras e rótulos nos frames de acordo com as detecções recebidas, indicando violações de EPI. Salva o frame anotado em disco caso haja violação.
+            Desenha caixas delimitadoras e rótulos nos frames de acordo com as detecções recebidas, indicando violações de EPI. Entrega o frame anotado ao OccurrenceWriter, que o salva em disco caso haja violação, e as ocorrências aceitas ao AlertDispatcher.
         send_message_test(text='test'):
-            Envia uma mensagem de texto de teste para os chats do Telegram configurados, utilizando um endpoint Flask.
+            Envia uma mensagem de texto de teste para os chats do Telegram configurados, pelo AlertDispatcher.
     Notas:
-        - A classe depende de bibliotecas externas como cv2, numpy, socket, threading, time, json, requests e pathlib.
-        - O método draw_boxes salva frames anotados no diretório './ocorrencias' quando há violação de EPI.
-        - O envio de mensagens para o Telegram depende da configuração do atributo flask_url.
+        - A classe depende de bibliotecas externas como cv2, numpy, socket, threading, time, json e pathlib.
+        - O método draw_boxes grava os frames anotados com violação de EPI, com os metadados, no OccurrenceStore do diretório './ocorrencias' (consultável por OccurrenceStore.py), sem bloquear a captura.
+        - O envio de mensagens para o Telegram depende do atributo alerts (AlertDispatcher), que faz as requisições fora da thread de captura.
     """
-    def __init__(self, rtsp_url, telegran=[], host='localhost', port=13750, capture_interval=1.0):
+    # Falhas seguidas de grab() após as quais o stream é considerado perdido e reaberto.
+    MAX_GRAB_FAILURES = 5
+    # Espera máxima, em segundos, pelo envio em andamento ao encerrar a câmera.
+    DISPATCH_TIMEOUT = 10.0
+
+    def __init__(self, rtsp_url, telegran=[], host='localhost', port=13750, capture_interval=1.0, persistent=True, max_in_flight=4, latest_frame=False, max_size=None, encoding='jpeg', jpeg_quality=95, occurrences=None, result_format='binary', track=False, motion=None, name=None, executor=None, reconnect_delay=1.0, max_reconnect_delay=30.0, shared_memory=False, alerts=None, sampling=None):
         self.rtsp_url = rtsp_url
+        self.name = name or str(rtsp_url)
         self.telegran = telegran
         self.host = host
         self.port = port
         self.capture_interval = capture_interval
-        self.capture_thread = threading.Thread(target=self.capture_and_send)
+        self.latest_frame = latest_frame
+        self.max_size = max_size
+        self.encoding = Protocol.ENCODINGS[encoding]
+        self.jpeg_quality = jpeg_quality
+        self._owns_occurrences = occurrences is None
+        self.occurrences = occurrences if occurrences is not None else OccurrenceWriter(camera=self.name)
+        self.alerts = alerts
+        self.overlay = OverlayRenderer()
+        self.motion = motion
+        self.sampling = sampling
+        self.metrics = CaptureMetrics(self.name)
+        self.executor = executor
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.capture_thread = threading.Thread(target=self.capture_and_send, name=f'captura-{self.name}')
         self.running = False
+        self.grabbed_frames = 0
+        self.decoded_frames = 0
+        self.sent_frames = 0
+        self.busy_frames = 0
+        self.reconnects = 0
+        self.started_at = None
+        self.client = None
+        self._stopped = threading.Event()
+        self._dispatch_lock = threading.Lock()
+        self._dispatching = False
+        self._dispatch_idle = threading.Event()
+        self._dispatch_idle.set()
+        if persistent:
+            self.client = Protocol.FrameClient(host, port, self._on_response, max_in_flight=max_in_flight, hello={'camera': self.name, 'result': result_format, 'track': track, 'load': sampling is not None},
+                                               shared_memory=shared_memory)
+        REGISTRY.gauge('epi_client_in_flight', "Frames aguardando resposta do servidor",
+                       fn=lambda: self.client.in_flight if self.client is not None else 0, camera=self.name)
+        REGISTRY.gauge('epi_client_capture_interval_seconds', "Intervalo atual entre capturas",
+                       fn=lambda: self.interval, camera=self.name)
+
+    @property
+    def interval(self):
+        return self.sampling.interval if self.sampling is not None else self.capture_interval
 
     def start(self):
         self.running = True
+        self.started_at = time.monotonic()
         self.capture_thread.start()
 
     def stop(self):
         self.running = False
-        self.capture_thread.join()
+        self._stopped.set()
+        if self.capture_thread.is_alive():
+            self.capture_thread.join()
+        if self.client is not None:
+            # close libera um envio bloqueado esperando posição; depois dele o envio não reconecta.
+            self.client.close()
+        # O envio em andamento no executor compartilhado ainda pode estar tratando este frame.
+        if not self._dispatch_idle.wait(self.DISPATCH_TIMEOUT):
+            logger.warning("Envio da câmera %s não terminou em %.0f s", self.name, self.DISPATCH_TIMEOUT)
+        if self._owns_occurrences:
+            self.occurrences.stop()
+        # As funções dos gauges referenciam esta captura: sem remover as séries, ela nunca seria liberada.
+        REGISTRY.remove(camera=self.name)
+
+    def decoded_fps(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started_at
+        return self.decoded_frames / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        stats = {
+            'camera': self.name,
+            'grabbed': self.grabbed_frames,
+            'decoded': self.decoded_frames,
+            'decoded_fps': self.decoded_fps(),
+            'sent': self.sent_frames,
+            'busy': self.busy_frames,
+            'reconnects': self.reconnects,
+            'interval': self.interval,
+        }
+        if self.motion is not None:
+            stats['skipped'] = self.motion.skipped
+            stats['heartbeats'] = self.motion.heartbeats
+        return stats
 
     def capture_and_send(self):
-        cap = cv2.VideoCapture(self.rtsp_url)
+        delay = self.reconnect_delay
+        while self.running:
+            cap = cv2.VideoCapture(self.rtsp_url)
+            grabbed = self.grabbed_frames
+            try:
+                if cap.isOpened():
+                    if self.latest_frame:
+                        self._capture_latest(cap)
+                    else:
+                        self._capture_sampled(cap)
+            finally:
+                cap.release()
+            if not self.running:
+                break
+            if self.grabbed_frames > grabbed:
+                delay = self.reconnect_delay   # o stream funcionou: recomeça a espera do início
+            logger.warning("Stream %s indisponível, reconectando em %.1f s", self.name, delay)
+            if self._stopped.wait(delay):
+                break
+            self.reconnects += 1
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _retrieve(self, cap):
+        ret, frame = cap.retrieve()
+        if ret:
+            self.decoded_frames += 1
+        return frame if ret else None
+
+    def _capture_sampled(self, cap):
+        # Com FPS conhecido, envia um frame a cada `step` frames do stream; caso contrário
+        # (CAP_PROP_FPS = 0 ou inválido em alguns streams RTSP), usa o relógio. O passo é
+        # recalculado a cada frame porque o intervalo pode mudar (AdaptiveSampler).
         fps = cap.get(cv2.CAP_PROP_FPS)
-        cont_frames = 0
-       
+        if not 0 < fps < 1000:
+            fps = 0
+        next_send = time.monotonic()
+        since_sent = None
+        failures = 0
 
         while self.running:
-            ret, frame = cap.read()
-            if ret:
-                if cont_frames % int(fps * self.capture_interval) == 0:
-                    self.send_frame(frame)
-            cont_frames += 1
+            if not cap.grab():
+                failures += 1
+                if failures >= self.MAX_GRAB_FAILURES:
+                    return   # stream encerrado ou perdido: capture_and_send reabre
+                continue
+            failures = 0
+            self.grabbed_frames += 1
+
+            if fps:
+                due = since_sent is None or since_sent >= max(1, int(round(fps * self.interval)))
+                since_sent = 1 if due else since_sent + 1
+            else:
+                due = time.monotonic() >= next_send
+            if not due:
+                continue
 
-            
-        cap.release()
+            next_send = time.monotonic() + self.interval
+            frame = self._retrieve(cap)
+            if frame is not None:
+                self._dispatch(frame)
+
+    def _capture_latest(self, cap):
+        # A thread de captura só demultiplexa (grab) para esvaziar o buffer do stream; a thread de
+        # envio decodifica (retrieve) o último frame lido a cada intervalo.
+        lock = threading.Lock()
+        grabbed = threading.Event()
+        done = threading.Event()
+
+        def sender():
+            while self.running and not done.is_set():
+                if not grabbed.wait(timeout=0.5):
+                    continue
+                started = time.monotonic()
+                with lock:
+                    frame = self._retrieve(cap)
+                if frame is not None:
+                    self._dispatch(frame)
+                done.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+        sender_thread = threading.Thread(target=sender, daemon=True)
+        sender_thread.start()
+        failures = 0
+        try:
+            while self.running:
+                with lock:
+                    ok = cap.grab()
+                if ok:
+                    failures = 0
+                    self.grabbed_frames += 1
+                    grabbed.set()
+                else:
+                    failures += 1
+                    if failures >= self.MAX_GRAB_FAILURES:
+                        break
+        finally:
+            done.set()
+            sender_thread.join()
+
+    def _dispatch(self, frame):
+        if self.executor is None:
+            self._offer(frame)
+            return
+        with self._dispatch_lock:
+            if self._dispatching:
+                self.busy_frames += 1
+                return
+            self._dispatching = True
+            self._dispatch_idle.clear()
+
+        def job():
+            try:
+                self._offer(frame)
+            except Exception:
+                logger.exception("Erro ao enviar frame da câmera %s", self.name)
+            finally:
+                self._dispatching = False
+                self._dispatch_idle.set()
+
+        try:
+            self.executor.submit(job)
+        except RuntimeError:   # executor já encerrado
+            self._dispatching = False
+            self._dispatch_idle.set()
+
+    def _offer(self, frame):
+        if self.motion is not None and not self.motion.check(frame):
+            self.metrics.skipped.inc()
+            return
+        self.sent_frames += 1
+        self.send_frame(frame)
+
+    def _on_response(self, context, response_data):
+        frame, sent_at = context
+        round_trip_ms = (time.perf_counter() - sent_at) * 1000
+        if response_data is not None:
+            self.metrics.round_trip_ms.observe(round_trip_ms)
+        load = self.client.load if self.client is not None else None
+        self.handle_response(frame, response_data)
+        # Depois de handle_response, para que o AdaptiveSampler já conheça a cena deste frame.
+        if self.sampling is not None:
+            if response_data is not None:
+                self.sampling.observe(round_trip_ms, load[0] if load is not None else None)
+            else:
+                self.sampling.observe_failure()
 
     def send_frame(self, frame):
         """
         Envia um frame para o servidor via socket TCP, recebe a resposta do servidor (por exemplo, detecções de EPI)
         e chama o método de anotação dos frames.
 
+        No modo persistente o frame é apenas enfileirado na conexão aberta e a resposta é tratada por
+        handle_response quando chegar. A captura só passa a usar o modo legado se o servidor recusar a
+        apresentação ou não responder a ela (Protocol.HandshakeError) na primeira conexão; falhas de rede
+        (servidor fora do ar, reiniciando) descartam o frame e o modo persistente é tentado de novo no próximo.
+
         Args:
             frame (np.ndarray): Frame de imagem a ser enviado para o servidor.
 
         Retorna:
             None
         """
+        height, width = frame.shape[:2]
+
+        if self.client is not None:
+            try:
+                seq = None
+                if self.client.shared_memory:
+                    with self.metrics.encode_ms.time():
+                        resized = Protocol.resize_frame(frame, self.max_size)
+                    seq = self.client.submit_shared(resized, (frame, time.perf_counter()), (width, height))
+                if seq is not None:
+                    self.metrics.bytes_out.inc(Protocol.FRAME_HEADER.size + Protocol.LENGTH.size)
+                else:
+                    with self.metrics.encode_ms.time():
+                        frame_data, size = Protocol.encode_frame(frame, self.encoding, self.jpeg_quality, self.max_size)
+                    self.client.submit(frame_data, (frame, time.perf_counter()), self.encoding, (width, height), size)
+                    self.metrics.bytes_out.inc(Protocol.FRAME_HEADER.size + len(frame_data))
+                self.metrics.sent.inc()
+                return
+            except Protocol.HandshakeError as e:
+                if self.client.server_hello is not None:
+                    self.metrics.send_errors.inc()
+                    logger.warning("Erro ao reconectar: %s", e)
+                    return
+                logger.warning("Servidor não aceitou o modo persistente (%s), usando uma conexão por frame.", e)
+                self.client = None
+            except (OSError, ConnectionError) as e:
+                if self._stopped.is_set():
+                    return   # cliente fechado por stop()
+                self.metrics.send_errors.inc()
+                logger.warning("Erro ao enviar frame: %s", e)
+                return
+
+        # No modo legado o servidor não conhece a codificação nem o tamanho original: o frame vai
+        # como imagem (JPEG ou PNG) e as caixas são reescaladas aqui.
+        encoding = Protocol.ENCODING_PNG if self.encoding == Protocol.ENCODING_PNG else Protocol.ENCODING_JPEG
+        with self.metrics.encode_ms.time():
+            frame_data, (sent_w, sent_h) = Protocol.encode_frame(frame, encoding, self.jpeg_quality, self.max_size)
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((self.host, self.port))
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_data = buffer.tobytes()
-            client_socket.sendall(len(frame_data).to_bytes(4, 'big'))
-            client_socket.sendall(frame_data)
-        except Exception as e:
-            print(f"Erro ao enviar frame: {e}")
+            client_socket = socket.create_connection((self.host, self.port))
+        except OSError as e:
+            self.metrics.send_errors.inc()
+            logger.warning("Erro ao enviar frame: %s", e)
+            return
         try:
-            response_length = int.from_bytes(client_socket.recv(4), 'big')
-            response_data = b""
-            while len(response_data) < response_length:
-                packet = client_socket.recv(4096)
-                if not packet:
-                    break
-                response_data += packet
-            response = json.loads(response_data.decode('utf-8'))
+            sent_at = time.perf_counter()
+            Protocol.send_legacy(client_socket, frame_data)
+            self.metrics.sent.inc()
+            self.metrics.bytes_out.inc(Protocol.LENGTH.size + len(frame_data))
+            response_data = Protocol.recv_legacy(client_socket)
+            round_trip_ms = (time.perf_counter() - sent_at) * 1000
+            self.metrics.round_trip_ms.observe(round_trip_ms)
+            if self.sampling is not None:
+                self.sampling.observe(round_trip_ms)
+        except (OSError, ConnectionError) as e:
+            if self.sampling is not None:
+                self.sampling.observe_failure()
+            self.metrics.response_errors.inc()
+            logger.warning("Erro ao receber resposta: %s", e)
+            return
+        finally:
             client_socket.close()
-        except Exception as e:
-            print(f"Erro ao receber resposta: {e}")
-        print(response)
-        self.draw_boxes(frame, response)
-        
-        try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((self.host, self.port))
+        scale = (width / sent_w, height / sent_h) if (sent_w, sent_h) != (width, height) else None
+        self.handle_response(frame, response_data, scale, 'json')
 
-            
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_data = buffer.tobytes()
-
-            client_socket.sendall(len(frame_data).to_bytes(4, 'big'))
+    def handle_response(self, frame, response_data, scale=None, result_format=None):
+        """
+        Decodifica a resposta do servidor e desenha as anotações no frame correspondente.
 
-            client_socket.sendall(frame_data)
-        except Exception as e:
-            print(f"Erro ao enviar frame: {e}")
+        Args:
+            frame (np.ndarray): Frame enviado ao servidor.
+            response_data (bytes): Resposta recebida, ou None/vazia se o frame não foi processado.
+            scale (tuple): (sx, sy) para converter as caixas para o frame original, se a resposta
+                se refere a um frame reduzido.
+            result_format (str): 'json' ou 'binary'. Se None, usa o formato negociado na conexão persistente.
+        """
+        if not response_data:
+            if response_data is not None:
+                self.metrics.response_errors.inc()
+            return
+        self.metrics.responses.inc()
+        self.metrics.bytes_in.inc(len(response_data))
+        if result_format is None:
+            result_format = self.client.server_hello.get('result', 'json') if self.client and self.client.server_hello else 'json'
         try:
-            response_length = int.from_bytes(client_socket.recv(4), 'big')
-
-            response_data = b""
-            while len(response_data) < response_length:
-                packet = client_socket.recv(4096)
-                if not packet:
-                    break
-                response_data += packet
-
-            response = json.loads(response_data.decode('utf-8'))
-            
-            
-            client_socket.close()
-            
-        except Exception as e:
-            print(f"Erro ao receber resposta: {e}")
-        print(response)
-        self.draw_boxes(frame,response)
+            response = Protocol.decode_results(response_data, result_format)
+        except ValueError as e:
+            self.metrics.response_errors.inc()
+            logger.warning("Erro ao receber resposta: %s", e)
+            return
+        if scale is not None:
+            response = Protocol.scale_status(response, *scale)
+        logger.debug("Resposta da câmera %s: %s", self.name, response)
+        with self.metrics.annotate_ms.time():
+            self.draw_boxes(frame, response)
     
 
-    def draw_boxes(self, frame, boxes):
+    def draw_boxes(self, frame, boxes, color=(0, 0, 255)):
         '''Desenha caixas delimitadoras e rótulos no frame fornecido para indicar violações detectadas de EPI (Equipamento de Proteção Individual).
-        Caixas delimitadoras para pessoas detectadas são desenhadas com linhas sólidas vermelhas ou verdes, dependendo da conformidade com o EPI. Para cada item de EPI ausente, um retângulo tracejado com cantos sólidos é desenhado ao redor da região relevante, e um rótulo indicando o item ausente é adicionado. Se qualquer violação de EPI for detectada, o frame anotado é salvo no diretório './ocorrencias' com um nome de arquivo baseado em timestamp.
+        Caixas delimitadoras para pessoas detectadas são desenhadas com linhas sólidas vermelhas ou verdes, dependendo da conformidade com o EPI. Para cada item de EPI ausente, um retângulo tracejado com cantos sólidos é desenhado ao redor da região relevante, e um rótulo indicando o item ausente é adicionado. O frame anotado é entregue ao OccurrenceWriter, que o salva em segundo plano no diretório './ocorrencias' se houver violação de EPI (respeitando o intervalo mínimo entre violações repetidas); cada ocorrência aceita também é enfileirada no AlertDispatcher, se houver.
+        O desenho é feito por OverlayRenderer em um buffer reaproveitado entre frames; o frame original não é alterado.
         Args:
             frame (np.ndarray): O frame de imagem no qual desenhar as caixas e rótulos.
-            boxes (list): Uma lista de detecções, onde cada detecção contém coordenadas da caixa delimitadora e informações de status do EPI.
+            boxes (list | np.ndarray): Uma lista de detecções, onde cada detecção contém coordenadas da caixa delimitadora e informações de status do EPI, ou o array Protocol.RESULT_DTYPE equivalente.
             color (tuple, opcional): A cor BGR para desenhar as caixas e rótulos de violação. Padrão é (0, 0, 255) (vermelho).
         Retorna:
-            None'''
-        vermelho = (0, 0, 255)
-        verde = (0, 255, 0)
-        ppe_name = {0:'Capacete', 1:'Veste', 2:'Oculos', 3:'Luvas', 4:'Calcados'}
-        copy = frame.copy()
-        no_ppe = False
-        person = False
-
-        def draw_dashed_with_solid_ends(img, pt1, pt2, color, thickness=2, dash_length=15, gap_length=10, solid_length=20):
-            """Desenha linha tracejada com as pontas sólidas entre pt1 e pt2."""
-            dist = int(np.linalg.norm(np.array(pt2) - np.array(pt1)))
-            if dist == 0:
-                return
-            
-            direction = (np.array(pt2) - np.array(pt1)) / dist
-            
-            start_solid_end = np.array(pt1) + direction * solid_length
-            cv2.line(img, tuple(map(int, pt1)), tuple(map(int, start_solid_end)), color, thickness)
-            
-            end_solid_start = np.array(pt2) - direction * solid_length
-            cv2.line(img, tuple(map(int, end_solid_start)), tuple(map(int, pt2)), color, thickness)
-            
-            current = start_solid_end
-            while np.linalg.norm(current - end_solid_start) > dash_length:
-                next_dash_end = current + direction * dash_length
-                if np.linalg.norm(next_dash_end - start_solid_end) + solid_length > dist - solid_length:
-                    break
-                cv2.line(img, tuple(map(int, current)), tuple(map(int, next_dash_end)), color, thickness//2)
-                current = next_dash_end + direction * gap_length
-                if np.linalg.norm(current - end_solid_start) < 0:
-                    break
-        def draw_line(img, pt1, pt2, color, thickness=10):
-            
-            x1, y1 = int(pt1[0]), int(pt1[1])
-            x2, y2 = int(pt2[0]), int(pt2[1])
-            
-            draw_dashed_with_solid_ends(img, (x1, y1), (x2, y1), color, thickness)
-            draw_dashed_with_solid_ends(img, (x1, y2), (x2, y2), color, thickness)
-            
-            draw_dashed_with_solid_ends(img, (x1, y1), (x1, y2), color, thickness)
-            draw_dashed_with_solid_ends(img, (x2, y1), (x2, y2), color, thickness)
-
-        for det in boxes:
-            xp1, yp1, xp2, yp2 = det[0]
-            for i, ppe in enumerate(det[1]):
-                if ppe[0] == False:
-                    no_ppe = True
-                    person = True
-                    x1, y1, x2, y2 = ppe[2]
-                    draw_line(copy, (x1, y1), (x2, y2), color=vermelho)
-                    txt =  f'Nao Usando {ppe_name[i]}'
-                    copy = cv2.putText(copy, txt, (x1, y1+40), cv2.FONT_HERSHEY_SIMPLEX, fontScale=1.5, color=color, thickness=2)
-            if person:
-                cv2.rectangle(copy, (xp1, yp1), (xp2, yp2), color=vermelho, thickness=10)
-                person = False
-            else:
-                cv2.rectangle(copy, (xp1, yp1), (xp2, yp2), color=verde, thickness=10)
-        
-        if no_ppe or not no_ppe:
-            ocorrencias_dir = Path('./ocorrencias')
-            ocorrencias_dir.mkdir(parents=True, exist_ok=True)
-            url = str(ocorrencias_dir / str(time.time()))
-            print(f"Salvando frame com violação de EPI em: {url}.jpg")
-            cv2.imwrite(url+'.jpg', copy)
+            np.ndarray: O frame anotado (buffer interno, válido até a próxima chamada).'''
+        records = Protocol.as_records(boxes)
+        if self.sampling is not None:
+            self.sampling.observe_scene(len(records), int((records['status'] == Protocol.STATUS_NOT_USING).any(axis=1).sum()))
+        annotated = self.overlay.render(frame, records, color)
+        accepted = False
+        if not self.tracking:
+            accepted = self.occurrences.submit(annotated, records, copy=True, camera=self.name)
+        elif records['events'].any():
+            accepted = self.occurrences.submit(annotated, records, copy=True, event=True, camera=self.name)
+        alerts = self.alerts   # pode ser trocado pelo CaptureManager ao recarregar a configuração
+        if accepted and alerts is not None:
+            alerts.submit(self.name, records, annotated, copy=True, chats=self.telegran or None)
+        return annotated
+
+    @property
+    def tracking(self):
+        """True se a conexão persistente atual negociou o rastreamento de pessoas com o servidor."""
+        hello = self.client.server_hello if self.client is not None else None
+        return bool(hello and hello.get('track'))
 
 
 
@@ -223,20 +481,8 @@ class RTSPStreamCapture:
             text (str): Texto da mensagem a ser enviada. Padrão é 'test'.
 
         """
-        if not self.flask_url:
-            print("URL do servidor Flask não configurada.")
+        alerts = self.alerts
+        if alerts is None:
+            logger.warning("Nenhum AlertDispatcher configurado para a câmera %s.", self.name)
             return
-        for chat_id in self.telegran:
-            payload = {
-                "to": chat_id,
-                "text": text
-            }
-            try:
-                response = requests.post(f"{self.flask_url}/api/bot/telegram/send-text", json=payload)
-                if response.status_code == 200:
-                    print(f"Mensagem enviada para o Telegram: {text}")
-                else:
-                    print(f"Falha ao enviar mensagem. Resposta: {response.text}")
-            except Exception as e:
-                print(f"Erro ao enviar mensagem para o Flask: {e}")
-
+        alerts.send_text(text, self.telegran or None)
@@ -0,0 +1,164 @@
+import numpy as np
+
+import Protocol
+from Protocol import N_PPE, STATUS_UNKNOWN, STATUS_USING, STATUS_NOT_USING
+
+"""
+Rastreamento de pessoas entre frames de uma mesma câmera.
+
+O Tracker recebe a associação de PPE.associate de cada frame (na ordem de captura) e liga cada
+pessoa detectada a uma trilha pelo IoU com a última caixa conhecida da trilha. Para cada trilha
+e categoria de EPI é mantida uma janela com a evidência dos últimos frames: a confiança da
+melhor detecção de "usando" menos a da melhor detecção de "não usando" (o mesmo critério de
+PPE.get_max/using). O status da trilha só muda quando a média da janela passa de `threshold`
+no sentido oposto, de modo que uma detecção isolada não faz o status oscilar.
+
+Um evento de violação é emitido apenas no frame em que uma categoria passa a ser "não usando"
+para a trilha, e não a cada frame em que a pessoa continua sem o EPI; o cliente usa os eventos
+para gravar ocorrências e enviar alertas uma única vez por violação.
+"""
+
+
+def iou_matrix(a, b):
+    """
+    Calcula o IoU entre todas as caixas de `a` (N, 4) e de `b` (M, 4), no formato x1, y1, x2, y2.
+
+    Retorna:
+        np.ndarray: Matriz (N, M).
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+class _Track:
+    def __init__(self, track_id, window):
+        self.id = track_id
+        self.box = np.zeros(4, dtype=np.int64)
+        self.evidence = np.zeros((window, N_PPE), dtype=np.float32)
+        self.valid = np.zeros((window, N_PPE), dtype=bool)
+        self.status = np.full(N_PPE, STATUS_UNKNOWN, dtype=np.uint8)
+        self.use_box = np.zeros((N_PPE, 4), dtype=np.int64)
+        self.no_use_box = np.zeros((N_PPE, 4), dtype=np.int64)
+        self.has = np.zeros(N_PPE, dtype=np.uint8)
+        self.frames = 0
+        self.missed = 0
+
+
+class Tracker:
+    """
+    Rastreador de pessoas de uma câmera, com suavização do status de EPI de cada trilha.
+
+    Atributos:
+        window (int): Quantidade de frames considerada na suavização do status.
+        threshold (float): Média mínima da evidência (em módulo) para mudar o status de uma categoria.
+        iou_threshold (float): IoU mínimo entre a pessoa detectada e a última caixa da trilha.
+        max_missed (int): Frames consecutivos sem detecção após os quais a trilha é descartada.
+        tracks (list): Trilhas ativas.
+    Métodos:
+        update(assoc):
+            Atualiza as trilhas com a saída de PPE.associate de um frame e retorna um array
+            Protocol.RESULT_DTYPE com o status suavizado, o identificador da trilha e os eventos de cada pessoa detectada.
+        reset():
+            Descarta todas as trilhas.
+    """
+    def __init__(self, window=5, threshold=0.2, iou_threshold=0.3, max_missed=10):
+        self.window = max(1, int(window))
+        self.threshold = threshold
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self._next_id = 1
+
+    def reset(self):
+        self.tracks = []
+
+    def match(self, boxes):
+        """
+        Associa as caixas detectadas às trilhas ativas, de forma gulosa pelo maior IoU.
+
+        Retorna:
+            list: Para cada caixa, a trilha correspondente ou None.
+        """
+        matches = [None] * len(boxes)
+        if not self.tracks or not len(boxes):
+            return matches
+        iou = iou_matrix([t.box for t in self.tracks], boxes)
+        order = np.argsort(iou, axis=None)[::-1]
+        used_tracks, used_boxes = set(), set()
+        for t, b in zip(*np.unravel_index(order, iou.shape)):
+            if iou[t, b] < self.iou_threshold:
+                break
+            if t in used_tracks or b in used_boxes:
+                continue
+            used_tracks.add(t)
+            used_boxes.add(b)
+            matches[b] = self.tracks[t]
+        return matches
+
+    def update(self, assoc):
+        person_box = assoc['person_box']
+        has_use, has_no_use = assoc['has_use'], assoc['has_no_use']
+        evidence = (np.where(has_use, assoc['use_conf'], 0) - np.where(has_no_use, assoc['no_use_conf'], 0)).astype(np.float32)
+        seen = has_use | has_no_use
+
+        records = np.zeros(len(person_box), dtype=Protocol.RESULT_DTYPE)
+        matched = set()
+        for p, track in enumerate(self.match(person_box)):
+            if track is None:
+                track = _Track(self._next_id, self.window)
+                self._next_id += 1
+                self.tracks.append(track)
+            matched.add(track.id)
+            events = self._observe(track, p, assoc, evidence[p], seen[p])
+
+            record = records[p]
+            record['person'] = track.box
+            record['status'] = track.status
+            record['has'] = track.has
+            record['use'] = track.use_box
+            record['no_use'] = track.no_use_box
+            record['track'] = track.id
+            record['events'] = events
+
+        for track in self.tracks:
+            if track.id not in matched:
+                track.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        return records
+
+    def _observe(self, track, p, assoc, evidence, seen):
+        slot = track.frames % self.window
+        track.frames += 1
+        track.missed = 0
+        track.box = assoc['person_box'][p]
+        track.evidence[slot] = evidence
+        track.valid[slot] = seen
+
+        # Caixas de EPI: as do frame atual quando existem, senão as últimas vistas pela trilha.
+        use, no_use = assoc['has_use'][p], assoc['has_no_use'][p]
+        track.use_box[use] = assoc['use_box'][p][use]
+        track.no_use_box[no_use] = assoc['no_use_box'][p][no_use]
+        track.has |= use.astype(np.uint8) | (no_use.astype(np.uint8) << 1)
+
+        count = track.valid.sum(axis=0)
+        mean = np.divide(np.where(track.valid, track.evidence, 0).sum(axis=0), count,
+                         out=np.zeros(N_PPE, dtype=np.float32), where=count > 0)
+        previous = track.status.copy()
+        track.status[mean > self.threshold] = STATUS_USING
+        track.status[mean < -self.threshold] = STATUS_NOT_USING
+        track.status[count == 0] = STATUS_UNKNOWN
+        # Sem evidência recente em nenhum sentido, o primeiro frame define o status.
+        undecided = (previous == STATUS_UNKNOWN) & (track.status == STATUS_UNKNOWN) & (count > 0)
+        track.status[undecided] = np.where(mean[undecided] >= 0, STATUS_USING, STATUS_NOT_USING)
+
+        started = (track.status == STATUS_NOT_USING) & (previous != STATUS_NOT_USING)
+        return int(np.dot(started, 1 << np.arange(N_PPE)))
@@ -0,0 +1,294 @@
+import itertools
+import logging
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+import Protocol
+import SharedFrames
+from Metrics import (REGISTRY, BATCH_SIZE, DECODE_ERRORS, DECODE_MS, INFERENCE_ERRORS, INFERENCE_MS, POSTPROCESS_MS,
+                     JsonFormatter, configure_logging)
+
+"""
+Pool de processos de inferência.
+
+Cada worker é um processo independente com o seu próprio modelo NN.PPE carregado, de modo que
+a decodificação (cv2.imdecode), a inferência e o pós-processamento de frames diferentes rodam
+em núcleos diferentes, sem disputar o GIL do processo do servidor.
+
+O servidor chama WorkerPool.submit com o frame ainda codificado; o pool envia o frame ao worker
+com menos frames pendentes por um Pipe e devolve um Future que é resolvido quando o resultado
+volta. Frames recebidos por memória compartilhada (Protocol.ENCODING_SHM) chegam ao worker
+apenas como a referência à posição do segmento do cliente, que o worker lê sem cópia; quando a
+conexão do cliente termina, o servidor chama WorkerPool.detach para que os workers fechem o
+segmento.
+
+Um worker que morre é recriado automaticamente e os frames que estavam com ele falham com
+RuntimeError, sem afetar o socket de escuta do servidor. Um worker que morre logo depois de
+iniciado (por exemplo, ao carregar o modelo) é recriado com espera exponencial; depois de
+`max_restarts` falhas seguidas ele é abandonado e os frames passam a ir apenas para os demais.
+
+Os tempos de decodificação, inferência e pós-processamento medidos em cada worker voltam junto
+com os resultados e são registrados nas métricas do processo do servidor.
+"""
+
+logger = logging.getLogger(__name__)
+
+RESTARTS = REGISTRY.counter('epi_server_worker_restarts_total', "Workers recriados após encerramento inesperado")
+
+# Um worker que ficou vivo por pelo menos este tempo (s) antes de morrer é reiniciado sem espera.
+STABLE_AFTER = 60.0
+
+
+def worker_main(index, model_path, threads, batch_size, conn, model_options=None, log_config=(logging.INFO, False)):
+    """
+    Laço principal de um processo worker.
+
+    Recebe tuplas (job_id, frame_data, codificação, largura, altura, detailed) pelo Pipe, agrupa até `batch_size` frames já disponíveis
+    em uma única predição e devolve (resultados, tempos): uma lista de (job_id, status, erro) e um dicionário com
+    os tempos de decodificação (por frame), inferência e pós-processamento (do lote), em ms. Uma tupla (None, nome)
+    fecha neste processo o segmento de memória compartilhada `nome` (ver WorkerPool.detach) e não tem resposta.
+    """
+    import cv2
+    import NN
+
+    configure_logging(*log_config)
+    cv2.setNumThreads(1)
+    model = NN.PPE(model_path, threads=threads, **(model_options or {}))
+    logger.info("Worker %d pronto (pid %d).", index, mp.current_process().pid)
+
+    while True:
+        jobs = []
+        try:
+            while not jobs or (len(jobs) < batch_size and conn.poll()):
+                message = conn.recv()
+                if message[0] is None:
+                    SharedFrames.detach(message[1])
+                else:
+                    jobs.append(message)
+        except EOFError:
+            break
+
+        results = []
+        decoded = []
+        timings = {'decode': [], 'decode_errors': 0, 'inference': None, 'postprocess': None, 'batch': 0}
+        for job_id, frame_data, encoding, width, height, detailed in jobs:
+            start = time.perf_counter()
+            frame = Protocol.decode_frame(frame_data, encoding, width, height)
+            timings['decode'].append((time.perf_counter() - start) * 1000)
+            if frame is None:
+                timings['decode_errors'] += 1
+                results.append((job_id, None, "Não foi possível decodificar o frame"))
+            else:
+                decoded.append((job_id, frame, detailed))
+
+        if decoded:
+            try:
+                start = time.perf_counter()
+                responses = model.inner_batch([frame for _, frame, _ in decoded])
+                parsed = time.perf_counter()
+                statuses = [model.parse(resp, detailed) for resp, (_, _, detailed) in zip(responses, decoded)]
+                timings.update(inference=(parsed - start) * 1000, postprocess=(time.perf_counter() - parsed) * 1000, batch=len(decoded))
+                results.extend((job_id, status, None) for (job_id, _, _), status in zip(decoded, statuses))
+            except Exception as e:
+                results.extend((job_id, None, str(e)) for job_id, _, _ in decoded)
+
+        conn.send((results, timings))
+
+
+class _Worker:
+    def __init__(self, index, process, conn, failures=0):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.failures = failures
+        self.started = time.monotonic()
+        self.dead = False
+        self.pending = {}
+        self.lock = threading.Lock()
+
+
+class WorkerPool:
+    """
+    Pool de processos, cada um com um modelo NN.PPE pré-carregado.
+
+    Atributos:
+        model_path (str): Caminho do modelo carregado em cada worker.
+        n_workers (int): Número de processos. Padrão: número de núcleos da máquina.
+        threads (int): Threads do torch em cada worker (torch.set_num_threads). None mantém o padrão do torch.
+        batch_size (int): Máximo de frames já enfileirados que um worker agrupa em uma inferência.
+        model_options (dict): Opções repassadas a NN.PPE em cada worker (backend, imgsz, half, ...).
+        max_restarts (int): Falhas seguidas (mortes antes de STABLE_AFTER segundos) após as quais um worker não é mais recriado.
+        restart_backoff (float): Espera, em segundos, antes de recriar um worker após a primeira falha; dobra a cada falha seguida.
+        max_restart_backoff (float): Espera máxima entre recriações.
+        restarts (int): Quantidade de workers recriados desde o início.
+    Métodos:
+        submit(frame_data, encoding, width, height, detailed=False):
+            Envia um frame codificado ao worker menos ocupado e retorna um Future com o status de EPI
+            (ou a saída de PPE.associate, se detailed).
+        detach(name):
+            Fecha em todos os workers o segmento de memória compartilhada `name`, ao fim da conexão que o usava.
+        stats():
+            Retorna frames pendentes por worker, a quantidade de reinícios e os workers abandonados.
+        stop():
+            Encerra todos os workers.
+    """
+    def __init__(self, model_path, n_workers=None, threads=1, batch_size=8, model_options=None, max_restarts=5,
+                 restart_backoff=1.0, max_restart_backoff=60.0):
+        self.model_path = model_path
+        self.model_options = dict(model_options or {})
+        self.n_workers = n_workers or mp.cpu_count()
+        self.threads = threads
+        self.batch_size = max(1, int(batch_size))
+        self.max_restarts = max_restarts
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.restarts = 0
+
+        self._ctx = mp.get_context('spawn')
+        self._ids = itertools.count()
+        self._running = True
+        self._respawn = {}   # índice -> (instante da recriação, falhas seguidas)
+        self._failed = set()
+        self.workers = [self._spawn(i) for i in range(self.n_workers)]
+
+        self._collector = threading.Thread(target=self._collect_loop, daemon=True)
+        self._collector.start()
+
+    def _spawn(self, index, failures=0):
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(target=worker_main, args=(index, self.model_path, self.threads, self.batch_size, child, self.model_options,
+                                                                   self._log_config()), daemon=True)
+        process.start()
+        child.close()
+        return _Worker(index, process, parent, failures)
+
+    def _log_config(self):
+        # Os workers são processos novos (spawn): repete neles o nível e o formato de log deste processo.
+        root = logging.getLogger()
+        return root.getEffectiveLevel(), any(isinstance(h.formatter, JsonFormatter) for h in root.handlers)
+
+    def submit(self, frame_data, encoding=Protocol.ENCODING_JPEG, width=0, height=0, detailed=False):
+        future = Future()
+        job_id = next(self._ids)
+        while True:
+            alive = [w for w in self.workers if not w.dead]
+            if not alive:
+                future.set_exception(RuntimeError("Nenhum worker de inferência disponível"))
+                return future
+            worker = min(alive, key=lambda w: len(w.pending))
+            with worker.lock:
+                if worker.dead or self.workers[worker.index] is not worker:
+                    continue  # worker encerrado ou substituído enquanto era escolhido
+                worker.pending[job_id] = future
+                try:
+                    worker.conn.send((job_id, frame_data, encoding, width, height, detailed))
+                except OSError as e:
+                    worker.pending.pop(job_id, None)
+                    future.set_exception(RuntimeError(f"Worker {worker.index} indisponível: {e}"))
+            return future
+
+    def detach(self, name):
+        for worker in list(self.workers):
+            if worker.dead:
+                continue   # o novo processo não terá o segmento aberto
+            with worker.lock:
+                try:
+                    worker.conn.send((None, name))
+                except OSError:
+                    pass   # worker sendo reiniciado: o novo processo não tem o segmento aberto
+
+    def _collect_loop(self):
+        while self._running:
+            self._respawn_due()
+            workers = {w.conn: w for w in self.workers if not w.dead}
+            timeout = 1.0
+            if self._respawn:
+                timeout = min(timeout, max(0.0, min(due for due, _ in self._respawn.values()) - time.monotonic()))
+            for conn in wait(list(workers), timeout=timeout):
+                worker = workers[conn]
+                try:
+                    results, timings = conn.recv()
+                except (EOFError, OSError):
+                    self._restart(worker)
+                    continue
+                self._record(results, timings)
+                for job_id, status, error in results:
+                    with worker.lock:
+                        future = worker.pending.pop(job_id, None)
+                    if future is None:
+                        continue
+                    if error is not None:
+                        future.set_exception(RuntimeError(error))
+                    else:
+                        future.set_result(status)
+
+            for worker in list(self.workers):
+                if not worker.dead and not worker.process.is_alive():
+                    self._restart(worker)
+
+    def _record(self, results, timings):
+        for ms in timings['decode']:
+            DECODE_MS.observe(ms)
+        if timings['inference'] is not None:
+            INFERENCE_MS.observe(timings['inference'])
+            POSTPROCESS_MS.observe(timings['postprocess'])
+            BATCH_SIZE.observe(timings['batch'])
+        failed = sum(1 for _, _, error in results if error is not None)
+        if failed:
+            DECODE_ERRORS.inc(timings['decode_errors'])
+            INFERENCE_ERRORS.inc(failed - timings['decode_errors'])
+
+    def _restart(self, worker):
+        if not self._running or worker.dead or self.workers[worker.index] is not worker:
+            return
+        worker.process.join(timeout=1.0)
+        with worker.lock:
+            worker.dead = True
+            pending = list(worker.pending.values())
+            worker.pending.clear()
+        worker.conn.close()
+        for future in pending:
+            future.set_exception(RuntimeError(f"Worker {worker.index} encerrado durante o processamento"))
+
+        # Mortes logo após o início (modelo que não carrega, por exemplo) contam como falhas seguidas.
+        failures = 0 if time.monotonic() - worker.started >= STABLE_AFTER else worker.failures + 1
+        if failures > self.max_restarts:
+            self._failed.add(worker.index)
+            logger.error("Worker %d encerrado (código %s) %d vezes seguidas logo após iniciar; não será recriado.",
+                         worker.index, worker.process.exitcode, failures)
+            return
+        delay = min(self.max_restart_backoff, self.restart_backoff * 2 ** (failures - 1)) if failures else 0.0
+        logger.warning("Worker %d encerrado (código %s), reiniciando em %.1f s.", worker.index, worker.process.exitcode, delay)
+        self._respawn[worker.index] = (time.monotonic() + delay, failures)
+        self._respawn_due()
+
+    def _respawn_due(self):
+        now = time.monotonic()
+        for index, (due, failures) in list(self._respawn.items()):
+            if due > now or not self._running:
+                continue
+            del self._respawn[index]
+            self.workers[index] = self._spawn(index, failures)
+            self.restarts += 1
+            RESTARTS.inc()
+
+    def stats(self):
+        return {
+            'workers': self.n_workers,
+            'pending': [len(w.pending) for w in self.workers],
+            'restarts': self.restarts,
+            'failed': sorted(self._failed),
+        }
+
+    def stop(self):
+        self._running = False
+        for worker in self.workers:
+            worker.conn.close()
+        deadline = time.monotonic() + 5.0
+        for worker in self.workers:
+            worker.process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
@@ -1,18 +1,118 @@
+import argparse
+import logging
 import socket
 import time
 import cv2
 import numpy as np
 import threading
 import json
+import queue
+from concurrent.futures import Future
 
 import torch
 import NN
+import Protocol
+import SharedFrames
+from Batcher import InferenceBatcher
+from ResultCache import ResultCache
+from WorkerPool import WorkerPool
+from AsyncServer import AsyncFrameServer
+from Tracker import Tracker
+import Metrics
+from Metrics import (REGISTRY, BYTES_OUT, CONNECTIONS, DECODE_ERRORS, DECODE_MS, FRAME_LATENCY_MS, PROTOCOL_ERRORS,
+                     RESPONSE_ERRORS)
 import os
 from pathlib import Path
 
 
 model_path = Path('model') / 'best.pt'
-model = NN.PPE(str(model_path))
+model = None
+batcher = None
+pool = None
+cache = None
+frame_bytes_limit = Protocol.MAX_FRAME_BYTES
+
+logger = logging.getLogger('server')
+
+FRAMES_RECEIVED = REGISTRY.counter('epi_server_frames_received_total', "Frames recebidos dos clientes")
+BYTES_IN = REGISTRY.counter('epi_server_bytes_in_total', "Bytes de frames recebidos")
+SEND_ERRORS = REGISTRY.counter('epi_server_errors_total', "Erros no processamento de frames", stage='send')
+
+
+def queue_depth():
+    """Frames aguardando inferência: fila do InferenceBatcher ou frames pendentes nos workers."""
+    if pool is not None:
+        return sum(pool.stats()['pending'])
+    return batcher.queue.qsize() if batcher is not None else 0
+
+
+def submit_frame(frame_data, encoding=Protocol.ENCODING_JPEG, width=0, height=0, detailed=False, ring=None):
+    """
+    Decodifica um frame e o enfileira para a detecção de EPI.
+
+    Args:
+        frame_data (bytes): Imagem recebida do cliente.
+        encoding (int): Codificação da imagem (Protocol.ENCODING_*).
+        width, height (int): Dimensões da imagem, necessárias para Protocol.ENCODING_RAW.
+        detailed (bool): Resolve com a saída de PPE.associate, usada pelo Tracker, em vez do status.
+        ring (SharedFrames.RingReader): Memória compartilhada aceita na conexão, necessária para Protocol.ENCODING_SHM.
+
+    Retorna:
+        concurrent.futures.Future: Resolve com o status de EPI de cada pessoa detectada.
+
+    No modo com processos (pool), a decodificação também é feita pelo worker. Em
+    Protocol.ENCODING_SHM apenas a referência à posição da memória compartilhada vai ao worker,
+    que lê o frame diretamente do segmento do cliente.
+
+    Com o cache de resultados ativo (ver ResultCache), um frame igual a outro processado há
+    pouco tempo recebe um Future já resolvido com o mesmo resultado, sem passar pela inferência.
+    """
+    FRAMES_RECEIVED.inc()
+    BYTES_IN.inc(len(frame_data))
+    if encoding == Protocol.ENCODING_SHM:
+        if ring is None:
+            DECODE_ERRORS.inc()
+            raise ValueError("Memória compartilhada não negociada na conexão")
+        frame_data = ring.reference(frame_data)
+
+    frame = None
+    key = None
+    if cache is not None and cache.cacheable(encoding):
+        if cache.needs_frame(encoding):
+            frame = decode(frame_data, encoding, width, height)
+        key = cache.key(frame_data, encoding, width, height, detailed, frame)
+        result = cache.get(key)
+        if result is not None:
+            future = Future()
+            future.set_result(result)
+            return future
+
+    if pool is not None:
+        future = pool.submit(frame_data, encoding, width, height, detailed)
+    else:
+        if frame is None:
+            frame = decode(frame_data, encoding, width, height)
+        future = batcher.submit(frame, detailed)
+    if key is not None:
+        future.add_done_callback(lambda f: f.exception() is None and cache.put(key, f.result()))
+    return future
+
+
+def decode(frame_data, encoding, width, height):
+    with DECODE_MS.time():
+        frame = Protocol.decode_frame(frame_data, encoding, width, height)
+    if frame is None:
+        DECODE_ERRORS.inc()
+        raise ValueError("Não foi possível decodificar o frame")
+    return frame
+
+
+def detach_ring(name):
+    """Fecha o segmento de memória compartilhada de uma conexão encerrada neste processo e nos workers."""
+    SharedFrames.detach(name)
+    if pool is not None:
+        pool.detach(name)
+
 
 def handle_client(client_socket):
     """
@@ -21,6 +121,7 @@ def handle_client(client_socket):
     decodifica a imagem, processa-a utilizando um modelo de detecção de EPI e retorna o resultado ao cliente.
     O protocolo de comunicação espera que o cliente envie primeiro o tamanho da imagem em 4 bytes (big-endian),
     seguido pelos dados da imagem. O resultado do processamento é enviado de volta em formato JSON.
+    Se os 4 primeiros bytes forem Protocol.MAGIC, a conexão segue no modo persistente (ver handle_persistent).
     Parâmetros:
         client_socket (socket.socket): Socket conectado ao cliente que enviou a imagem.
     Fluxo:
@@ -31,48 +132,246 @@ def handle_client(client_socket):
     Em caso de erro, a exceção é registrada e o socket é fechado.
     """
     try:
-        
-        frame_length = int.from_bytes(client_socket.recv(4), 'big')
-        
-        frame_data = b""
-        while len(frame_data) < frame_length:
-            packet = client_socket.recv(4096)
-            if not packet:
-                break
-            frame_data += packet
-
-        frame = np.frombuffer(frame_data, dtype=np.uint8)
-        frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-        
-        status = model.run(frame)
-        response = json.dumps(status).encode('utf-8')
-        client_socket.send(len(response).to_bytes(4, 'big'))
-
-        client_socket.send(response)
+        head = Protocol.recv_exact(client_socket, Protocol.LENGTH.size)
+        if head == Protocol.MAGIC:
+            handle_persistent(client_socket)
+            return
+
+        frame_length, = Protocol.LENGTH.unpack(head)
+        Protocol.check_length(frame_length, frame_bytes_limit)
+        frame_data = Protocol.recv_exact(client_socket, frame_length)
+        received = time.perf_counter()
 
+        status = submit_frame(frame_data).result()
+        response = Protocol.encode_results(status)
+        Protocol.send_legacy(client_socket, response)
+        BYTES_OUT.inc(Protocol.LENGTH.size + len(response))
+        FRAME_LATENCY_MS.observe((time.perf_counter() - received) * 1000)
+
+    except ValueError as e:
+        PROTOCOL_ERRORS.inc()
+        logger.warning("Conexão encerrada: %s", e)
     except Exception as e:
-        print(f"Erro ao processar o cliente: {e}")
+        logger.error("Erro ao processar o cliente: %s", e)
     finally:
         client_socket.close()
 
+
+def handle_persistent(client_socket):
+    """
+    Atende uma conexão no modo persistente.
+
+    Após a apresentação, a conexão recebe vários frames, cada um com seu número de sequência.
+    Cada frame é decodificado e enfileirado no InferenceBatcher assim que chega, de modo que
+    vários frames da mesma câmera podem entrar no mesmo lote. Uma thread de resposta aguarda
+    os resultados na ordem de chegada e os devolve com o mesmo número de sequência. Se o
+    cliente reduziu o frame antes de enviá-lo, as caixas são convertidas de volta para as
+    coordenadas do frame original. Uma resposta vazia indica que o frame não pôde ser processado.
+    Se o cliente pediu 'load' no hello, cada resposta começa com Protocol.LOAD_HEADER.
+
+    Parâmetros:
+        client_socket (socket.socket): Socket conectado que já enviou Protocol.MAGIC.
+    """
+    hello = Protocol.recv_json(client_socket)
+    reply = Protocol.negotiate(hello)
+    ring = None
+    if reply['ok'] and hello.get('shm'):
+        ring = SharedFrames.attach(hello['shm'])
+        reply['shm'] = ring is not None
+    Protocol.send_json(client_socket, reply)
+    if not reply['ok']:
+        return
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    logger.info("Conexão persistente da câmera %s%s", hello.get('camera'), " (memória compartilhada)" if ring else "")
+
+    tracker = Tracker() if reply['track'] else None
+    frames = queue.Queue()
+    responder = threading.Thread(target=respond_loop, args=(client_socket, frames, reply['result'], tracker, reply['load']), daemon=True)
+    responder.start()
+    try:
+        while True:
+            (seq, encoding, original_w, original_h, width, height), frame_data = Protocol.recv_message(client_socket, Protocol.FRAME_HEADER, frame_bytes_limit)
+            try:
+                future = submit_frame(frame_data, encoding, width, height, reply['result'] == 'binary', ring)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            scale = None
+            if width and height and original_w and original_h and (width, height) != (original_w, original_h):
+                scale = (original_w / width, original_h / height)
+            frames.put((seq, future, scale, time.perf_counter()))
+    except ConnectionError:
+        pass
+    finally:
+        frames.put(None)
+        responder.join()
+        if ring is not None:
+            detach_ring(ring.name)
+
+
+def respond_loop(client_socket, frames, result_format='json', tracker=None, load=False):
+    """
+    Processa os frames recebidos em uma conexão persistente e envia as respostas.
+
+    Os frames são tratados na ordem de chegada, o que mantém o Tracker da conexão (se houver)
+    atualizado na ordem de captura. No formato binário a inferência devolve a saída de
+    PPE.associate, convertida direto em registros Protocol.RESULT_DTYPE (e reescalada no array).
+    """
+    while True:
+        item = frames.get()
+        if item is None:
+            break
+        seq, future, scale, received = item
+        try:
+            status = future.result()
+            if tracker is not None:
+                status = tracker.update(status)
+            elif result_format == 'binary':
+                status = Protocol.assoc_to_records(status)
+            if scale is not None:
+                status = Protocol.scale_status(status, *scale)
+            response = Protocol.encode_results(status, result_format)
+        except Exception as e:
+            RESPONSE_ERRORS.inc()
+            logger.warning("Erro ao processar frame %d: %s", seq, e)
+            response = b''
+        if load:
+            response = Protocol.LOAD_HEADER.pack(queue_depth(), (time.perf_counter() - received) * 1000) + response
+        try:
+            Protocol.send_message(client_socket, Protocol.RESPONSE_HEADER, response, seq)
+        except OSError as e:
+            SEND_ERRORS.inc()
+            logger.warning("Erro ao enviar resposta %d: %s", seq, e)
+            break
+        BYTES_OUT.inc(Protocol.RESPONSE_HEADER.size + len(response))
+        FRAME_LATENCY_MS.observe((time.perf_counter() - received) * 1000)
+
     
-def start_server(host='localhost', port=13750):
+def start_server(host='localhost', port=13750, batch_size=8, max_wait_ms=10.0, report_interval=10.0, workers=0, threads=None,
+                 use_asyncio=True, max_clients=256, max_pending=64, executor_workers=8, model_options=None,
+                 metrics_port=0, metrics_host='127.0.0.1', cache_size=1024, cache_ttl=10.0, cache_mode='exact',
+                 max_frame_bytes=Protocol.MAX_FRAME_BYTES):
+    """
+    Inicia o servidor de detecção de EPI.
+
+    Parâmetros:
+        host (str): Endereço de escuta.
+        port (int): Porta de escuta.
+        batch_size (int): Número máximo de frames, de quaisquer câmeras, em cada lote de inferência.
+        max_wait_ms (float): Tempo máximo que um frame espera pelo lote completar.
+        report_interval (float): Intervalo, em segundos, entre relatórios de vazão e latência. 0 desativa.
+        workers (int): Se maior que 0, a decodificação e a inferência rodam em `workers` processos,
+            cada um com o seu modelo (ver WorkerPool). 0 usa um único modelo neste processo.
+        threads (int): Threads do torch usadas por cada modelo. None mantém o padrão do torch no processo único e,
+            com workers, divide os núcleos da máquina entre eles (os.cpu_count() // workers, no mínimo 1).
+        use_asyncio (bool): Atende as conexões com AsyncFrameServer. Se False, usa o laço com uma thread por conexão.
+        max_clients (int): Conexões simultâneas aceitas pelo servidor asyncio.
+        max_pending (int): Frames em processamento, somando todas as conexões, no servidor asyncio.
+        executor_workers (int): Threads de decodificação do servidor asyncio.
+        model_options (dict): Opções de NN.PPE (backend, imgsz, half, int8, conf, iou, device, roi, roi_imgsz, roi_margin).
+        metrics_port (int): Porta do endpoint de métricas (formato Prometheus, em /metrics). 0 desativa.
+        metrics_host (str): Endereço de escuta do endpoint de métricas.
+        cache_size (int): Resultados guardados no cache de frames repetidos (ver ResultCache). 0 desativa.
+        cache_ttl (float): Tempo, em segundos, durante o qual um resultado do cache pode ser reaproveitado.
+        cache_mode (str): Chave do cache: 'exact' (hash do payload; frames raw e em memória compartilhada não passam pelo cache) ou 'perceptual' (hash de uma miniatura do frame).
+        max_frame_bytes (int): Tamanho máximo de um frame anunciado pelo cliente; acima dele a conexão é fechada sem ler o frame.
+    """
+    global model, batcher, pool, cache, frame_bytes_limit
+    frame_bytes_limit = max_frame_bytes
+    model_options = dict(model_options or {})
+    REGISTRY.gauge('epi_server_queue_depth', "Frames aguardando inferência", fn=queue_depth)
+    if metrics_port:
+        Metrics.start_http_server(metrics_port, metrics_host)
+    if cache_size > 0:
+        cache = ResultCache(max_entries=cache_size, ttl=cache_ttl, mode=cache_mode)
+    if workers > 0:
+        # Exporta (ou valida o cache) uma única vez, antes de os workers carregarem o modelo.
+        NN.export_model(str(model_path), model_options.get('backend', 'torch'), model_options.get('imgsz', 640),
+                        model_options.get('half', False), model_options.get('int8', False))
+        # Sem --threads, os núcleos são divididos entre os workers em vez de cada um usar todos.
+        threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        pool = WorkerPool(str(model_path), n_workers=workers, threads=threads, batch_size=batch_size, model_options=model_options)
+        logger.info("Iniciando %d workers de inferência (%d threads cada).", workers, threads)
+    else:
+        model = NN.PPE(str(model_path), threads=threads, **model_options)
+        batcher = InferenceBatcher(model, max_batch=batch_size, max_wait_ms=max_wait_ms, report_interval=report_interval)
+        logger.info("Modelo carregado com sucesso.")
+
+    try:
+        if use_asyncio:
+            AsyncFrameServer(submit_frame, max_clients, max_pending, executor_workers, queue_depth, detach_ring,
+                             max_frame_bytes).run(host, port)
+        else:
+            serve_threaded(host, port)
+    except Exception as e:
+        logger.exception("Erro no servidor: %s", e)
+    finally:
+        if pool is not None:
+            pool.stop()
+        else:
+            batcher.stop()
+
+
+def serve_threaded(host, port):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.bind((host, port))
-    server_socket.listen(5)
-    print(f"Servidor rodando em {host}:{port}")
+    server_socket.listen(socket.SOMAXCONN)
+    logger.info("Servidor rodando em %s:%d", host, port)
    
 
     try:
         while True:
             client_socket, addr = server_socket.accept()
-            print(f"Conexão de {addr}")
+            CONNECTIONS.inc()
+            logger.debug("Conexão de %s", addr)
             client_thread = threading.Thread(target=handle_client, args=(client_socket,))
             client_thread.start()
-    except Exception as e:
-        print(f"Erro no servidor: {e}")
     finally:
         server_socket.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Servidor de detecção de EPI")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=13750)
+    parser.add_argument('--batch-size', type=int, default=8, help="Máximo de frames por lote de inferência")
+    parser.add_argument('--max-wait-ms', type=float, default=10.0, help="Espera máxima para completar um lote")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Segundos entre relatórios de vazão/latência (0 desativa)")
+    parser.add_argument('--workers', type=int, default=0, help="Processos de inferência, cada um com o seu modelo (0 = processo único)")
+    parser.add_argument('--threads', type=int, default=None, help="Threads do torch por modelo (padrão com --workers: núcleos / workers)")
+    parser.add_argument('--backend', choices=list(NN.BACKENDS), default='torch', help="Backend de inferência (modelos exportados ficam em model/exports)")
+    parser.add_argument('--imgsz', type=int, default=640, help="Tamanho de entrada do modelo")
+    parser.add_argument('--half', action='store_true', help="Inferência em FP16, quando suportado pelo backend")
+    parser.add_argument('--int8', action='store_true', help="Quantização INT8 (apenas openvino)")
+    parser.add_argument('--conf', type=float, default=0.25, help="Confiança mínima das detecções")
+    parser.add_argument('--iou', type=float, default=0.7, help="IoU do NMS")
+    parser.add_argument('--device', default=None, help="Dispositivo de inferência (ex.: cpu, 0)")
+    parser.add_argument('--roi', action='store_true', help="Detecta pessoas no frame reduzido e EPIs nos recortes das pessoas em resolução plena "
+                                                           "(os clientes devem enviar os frames sem reduzir, max_size None)")
+    parser.add_argument('--roi-imgsz', type=int, default=None, help="Tamanho de entrada dos recortes (padrão: --imgsz)")
+    parser.add_argument('--roi-margin', type=float, default=0.15, help="Margem do recorte em torno de cada pessoa")
+    parser.add_argument('--metrics-port', type=int, default=0, help="Porta do endpoint de métricas Prometheus (por exemplo, 9464); 0, o padrão, desativa")
+    parser.add_argument('--metrics-host', default='127.0.0.1', help="Endereço do endpoint de métricas")
+    parser.add_argument('--log-level', default='INFO', help="Nível de log (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument('--log-json', action='store_true', help="Log estruturado, um objeto JSON por linha")
+    parser.add_argument('--cache-size', type=int, default=1024, help="Resultados guardados no cache de frames repetidos (0 desativa)")
+    parser.add_argument('--cache-ttl', type=float, default=10.0, help="Validade, em segundos, de um resultado no cache")
+    parser.add_argument('--cache-mode', choices=['exact', 'perceptual'], default='exact', help="Chave do cache: hash do payload (apenas JPEG e PNG) ou de uma miniatura do frame")
+    parser.add_argument('--threaded', action='store_true', help="Usa uma thread por conexão em vez do servidor asyncio")
+    parser.add_argument('--max-clients', type=int, default=256, help="Conexões simultâneas (asyncio)")
+    parser.add_argument('--max-pending', type=int, default=64, help="Frames em processamento antes de aplicar backpressure (asyncio)")
+    parser.add_argument('--executor-workers', type=int, default=8, help="Threads de decodificação (asyncio)")
+    parser.add_argument('--max-frame-bytes', type=int, default=Protocol.MAX_FRAME_BYTES,
+                        help="Tamanho máximo de um frame recebido; conexões que anunciam frames maiores são fechadas")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":  
-    print("Modelo carregado com sucesso.")
-    start_server()
+    args = parse_args()
+    Metrics.configure_logging(args.log_level, args.log_json)
+    start_server(args.host, args.port, args.batch_size, args.max_wait_ms, args.report_interval, args.workers, args.threads,
+                 not args.threaded, args.max_clients, args.max_pending, args.executor_workers,
+                 {'backend': args.backend, 'imgsz': args.imgsz, 'half': args.half, 'int8': args.int8,
+                  'conf': args.conf, 'iou': args.iou, 'device': args.device,
+                  'roi': args.roi, 'roi_imgsz': args.roi_imgsz, 'roi_margin': args.roi_margin},
+                 args.metrics_port, args.metrics_host, args.cache_size, args.cache_ttl, args.cache_mode, args.max_frame_bytes)